@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import json
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from decoder import Decoder
+from protocol import Datagram, AckMsg, Msg, MsgType, FrameType
+from video.ivf import IVFReader
+from utils.address import Address
+from utils.poller import Poller
+from utils.udp_socket import UDPSocket
+from utils.timestamp import timestamp_us
+from utils.conversion import double_to_string
+
+
+def print_usage(program_name: str) -> None:
+    usage_msg = f"""Usage: {program_name} [options] ivf
+
+Streams a recorded IVF file over loopback to an in-process receiver and
+reports the ACK round-trip times seen by the sender.
+
+Options:
+    --mode <mode>        thread, process or both (default: both)
+    --lazy <level>       0: decode and display frames
+                         1: decode but not display frames (default)
+    --frames <N>         number of frames to stream (default: whole file)
+    --output <file>      file to write the settings and results to as JSON
+"""
+    print(usage_msg, file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark ACK latency with the decoder in a thread or a process')
+    parser.add_argument('ivf', help='IVF file recorded by the sender or receiver')
+    parser.add_argument('--mode', choices=['thread', 'process', 'both'], default='both',
+                        help='Where the decoder worker runs (default: both)')
+    parser.add_argument('--lazy', type=int, choices=[0, 1], default=1,
+                        help='0: decode and display frames\n'
+                             '1: decode but not display frames (default)')
+    parser.add_argument('--frames', type=int, default=0,
+                        help='Number of frames to stream (default: whole file)')
+    parser.add_argument('--output', help='File to write the settings and results to as JSON')
+
+    return parser.parse_args()
+
+
+def sender_main(ivf_path: str, num_frames: int, receiver_addr: Address, conn) -> None:
+    """Pace the frames of 'ivf_path' out at their frame rate and collect RTTs."""
+    reader = IVFReader(ivf_path)
+    frame_interval = 1.0 / reader.frame_rate()
+
+    udp_sock = UDPSocket()
+    udp_sock.connect(receiver_addr)
+    udp_sock.set_blocking(False)
+
+    rtt_samples = []
+
+    def handle_socket_read():
+        while True:
+            raw_data = udp_sock.recv()
+            if not raw_data:
+                break
+
+            msg = Msg.parse_from_string(raw_data)
+            if msg is not None and msg.type == MsgType.ACK:
+                rtt_samples.append(timestamp_us() - msg.send_ts)
+
+    poller = Poller()
+    poller.register_event(udp_sock, Poller.In, handle_socket_read)
+
+    # wait for the receiver to be ready
+    conn.recv()
+
+    next_frame_time = time.monotonic()
+    for frame_id in range(num_frames):
+        payload = reader.frame(frame_id % reader.frame_count())
+        frame_type = (FrameType.KEY if reader.is_key(frame_id % reader.frame_count())
+                      else FrameType.NONKEY)
+        frag_cnt = max(1, -(-len(payload) // Datagram.max_payload))
+
+        for frag_id in range(frag_cnt):
+            start = frag_id * Datagram.max_payload
+            datagram = Datagram(frame_id, frame_type, frag_id, frag_cnt,
+                                payload[start:start + Datagram.max_payload])
+            datagram.send_ts = timestamp_us()
+            while not udp_sock.send(datagram.serialize_to_string()):
+                poller.poll(1)  # EWOULDBLOCK; drain ACKs meanwhile
+
+        # collect ACKs until the next frame is due
+        next_frame_time += frame_interval
+        while (remaining := next_frame_time - time.monotonic()) > 0:
+            poller.poll(int(remaining * 1000) + 1)
+
+    # trailing ACKs
+    drain_deadline = time.monotonic() + 0.5
+    while time.monotonic() < drain_deadline:
+        poller.poll(50)
+
+    conn.send(rtt_samples)
+
+
+def run(args, worker_process: bool) -> np.ndarray:
+    reader = IVFReader(args.ivf)
+    num_frames = args.frames or reader.frame_count()
+
+    udp_sock = UDPSocket()
+    udp_sock.bind(Address(addr=("127.0.0.1", 0)))
+    udp_sock.set_blocking(False)
+
+    # fork the sender before the decoder spawns its worker
+    context = multiprocessing.get_context('fork')
+    conn, sender_conn = context.Pipe()
+    sender = context.Process(target=sender_main,
+                             args=(args.ivf, num_frames, udp_sock.local_address(), sender_conn))
+    sender.start()
+
+    decoder = Decoder(reader.display_width(), reader.display_height(), args.lazy,
+                      worker_process=worker_process)
+
+    connected = []
+
+    # same per-datagram work as video_receiver.py
+    def handle_socket_read():
+        while True:
+            peer_addr, data = udp_sock.recvfrom()
+            if not data:
+                break
+
+            # "connect" to the sender once it shows up
+            if not connected:
+                udp_sock.connect(peer_addr)
+                connected.append(peer_addr)
+
+            datagram = Datagram(0, FrameType.UNKNOWN, 0, 0, b"")
+            if not datagram.parse_from_string(data):
+                raise RuntimeError("Failed to parse datagram")
+
+            ack = AckMsg(frame_id=datagram.frame_id, frag_id=datagram.frag_id,
+                         send_ts=datagram.send_ts)
+            udp_sock.send(ack.serialize_to_string())
+
+            decoder.add_datagram(datagram)
+            while decoder.next_frame_complete():
+                decoder.consume_next_frame()
+
+    poller = Poller()
+    poller.register_event(udp_sock, Poller.In, handle_socket_read)
+
+    conn.send(True)
+    while not conn.poll():
+        poller.poll(50)
+
+    rtt_samples = np.array(conn.recv(), dtype=np.int64)
+    sender.join()
+    decoder.stop_worker()
+
+    return rtt_samples
+
+
+def main():
+    args = parse_arguments()
+
+    # the settings results depend on, to report along with them
+    reader = IVFReader(args.ivf)
+    config = {
+        'ivf': os.path.basename(args.ivf),
+        'width': reader.display_width(),
+        'height': reader.display_height(),
+        'fps': reader.frame_rate(),
+        'frames': args.frames or reader.frame_count(),
+        'lazy': args.lazy,
+        'cpus': os.cpu_count(),
+    }
+    print(f"{config['ivf']}: {config['width']}x{config['height']} at {config['fps']} fps, "
+          f"{config['frames']} frames, lazy level {config['lazy']}, {config['cpus']} CPUs")
+
+    results = {}
+    modes = ['thread', 'process'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        rtt_samples = run(args, mode == 'process')
+        if len(rtt_samples) == 0:
+            print(f"{mode}: no ACKs received", file=sys.stderr)
+            return 1
+
+        p50, p90, p99 = np.percentile(rtt_samples, [50, 90, 99]) / 1000
+        results[mode] = {'acks': len(rtt_samples), 'p50_ms': p50, 'p90_ms': p90,
+                         'p99_ms': p99, 'max_ms': rtt_samples.max() / 1000}
+        print(f"Decoder worker in a {mode}: {len(rtt_samples)} ACKs")
+        print(f" - ACK RTT p50/p90/p99/max (ms): {double_to_string(p50)}/"
+              f"{double_to_string(p90)}/{double_to_string(p99)}/"
+              f"{double_to_string(rtt_samples.max() / 1000)}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'config': config, 'results': results}, output_file, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
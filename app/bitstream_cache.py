@@ -0,0 +1,176 @@
+import os
+import struct
+import hashlib
+from enum import Enum
+from typing import Optional, Tuple
+
+from video.ivf import IVFWriter, IVFReader, ivf_index_path
+from protocol import FrameType
+
+
+class BitstreamCache:
+    """Encoded frames of a looping clip, replayed instead of re-encoding it.
+
+    Entries are IVF files (with a side index) named after a digest of the clip
+    content, the resolution, frame rate, target bitrate and encoder profile.
+    A missing entry is recorded from the live encoder during the first pass
+    over the clip and published atomically once complete.
+
+    The cached frame 0 is always the key frame that started the recording,
+    so replay sends a key frame every time the clip loops, where a live
+    encoder would carry on with an inter frame. A non-key variant of frame 0
+    can't be cached instead: frame 1 was encoded against the key frame's
+    reconstruction and would not decode against anything else. Replayed
+    sessions therefore have a key-frame size spike per loop that live ones
+    don't; only the first pass over the clip is packetized identically.
+    """
+    class State(Enum):
+        RECORD = 0  # encode live and record the encoded frames
+        REPLAY = 1  # replay the cached frames
+        LIVE = 2    # encode live until the clip loops back to a cached key frame
+
+    HASH_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+    def __init__(self, cache_dir: str, clip_path: str, width: int, height: int,
+                 frame_rate: int, target_bitrate: int, encoder_profile: bytes,
+                 num_frames: int):
+        if num_frames <= 0:
+            raise RuntimeError("BitstreamCache: clip has no frames")
+
+        key = hashlib.sha1(self.clip_digest(clip_path))
+        key.update(struct.pack('<HHHI', width, height, frame_rate, target_bitrate))
+        key.update(encoder_profile)
+
+        self.path_ = os.path.join(cache_dir, key.hexdigest() + ".ivf")
+        self.num_frames_ = num_frames
+        # position in the clip of the next frame to send
+        self.next_frame_ = 0
+        # the next live frame has to be a key frame: the receiver holds the
+        # references of replayed frames, not those of the live encoder
+        self.key_frame_pending_ = False
+
+        self.reader_: Optional[IVFReader] = None
+        self.writer_: Optional[IVFWriter] = None
+
+        if os.path.exists(self.path_) and os.path.exists(ivf_index_path(self.path_)):
+            self.reader_ = IVFReader(self.path_)
+
+        if self.reader_ and self.reader_.frame_count() == num_frames:
+            self.state_ = self.State.REPLAY
+            print(f"Bitstream cache: replaying {num_frames} frames from {self.path_}")
+        else:
+            self.reader_ = None
+            os.makedirs(cache_dir, exist_ok=True)
+            self.tmp_path_ = f"{self.path_}.{os.getpid()}.tmp"
+            self.writer_ = IVFWriter(self.tmp_path_, width, height, frame_rate)
+            self.state_ = self.State.RECORD
+            print(f"Bitstream cache: recording {num_frames} frames to {self.path_}")
+
+    @classmethod
+    def clip_digest(cls, clip_path: str) -> bytes:
+        digest = hashlib.sha1()
+        with open(clip_path, 'rb') as f:
+            while True:
+                chunk = f.read(cls.HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+
+        return digest.digest()
+
+    def replaying(self, force_key: bool) -> bool:
+        """Decide whether the next frame is replayed from the cache.
+
+        A forced key frame can be replayed only if the cached frame at the
+        current position is a key frame; otherwise the encoder takes over
+        until the clip loops back to the first (key) frame.
+        """
+        if self.state_ == self.State.LIVE and self.next_frame_ == 0:
+            self.state_ = self.State.REPLAY
+            self.key_frame_pending_ = False
+
+        if (self.state_ == self.State.REPLAY and force_key and
+                not self.reader_.is_key(self.next_frame_)):
+            self.state_ = self.State.LIVE
+            print("Bitstream cache: encoding live until the clip loops")
+
+        return self.state_ == self.State.REPLAY
+
+    def skip(self, n: int) -> bool:
+        """Follow the clip past 'n' raw frames that were not sent.
+
+        Cached frames after the gap reference the skipped ones, so replay
+        stops until the clip loops back to the first frame. A recording with
+        a gap would not match the clip and is abandoned.
+
+        Returns:
+            bool: False if the cache can no longer be used in this run
+        """
+        if n <= 0:
+            return True
+
+        self.next_frame_ = (self.next_frame_ + n) % self.num_frames_
+
+        if self.state_ == self.State.RECORD:
+            self.abandon()
+            return False
+
+        if self.state_ == self.State.REPLAY:
+            self.state_ = self.State.LIVE
+            self.key_frame_pending_ = True
+            print("Bitstream cache: encoding live until the clip loops")
+
+        return True
+
+    def take_key_frame_request(self) -> bool:
+        """Whether the next live frame has to be a key frame, because replay
+        stopped without one; the request is returned only once."""
+        pending = self.key_frame_pending_
+        self.key_frame_pending_ = False
+        return pending
+
+    def next_frame(self) -> Tuple[memoryview, FrameType]:
+        frame_no = self.next_frame_
+        self.next_frame_ = (frame_no + 1) % self.num_frames_
+
+        frame_type = FrameType.KEY if self.reader_.is_key(frame_no) else FrameType.NONKEY
+        return self.reader_.frame(frame_no), frame_type
+
+    def add_live_frame(self, buf, frame_type: FrameType) -> None:
+        if self.state_ == self.State.RECORD:
+            # replaying has to be able to start over at the first frame
+            if self.writer_.frame_count() == 0 and frame_type != FrameType.KEY:
+                raise RuntimeError("BitstreamCache: first recorded frame must be a key frame")
+
+            self.writer_.write_frame(buf, self.writer_.frame_count(),
+                                     frame_type == FrameType.KEY)
+
+            if self.writer_.frame_count() == self.num_frames_:
+                self.publish()
+
+        self.next_frame_ = (self.next_frame_ + 1) % self.num_frames_
+
+    def abandon(self) -> None:
+        """Discard an incomplete recording."""
+        self.writer_.close()
+        self.writer_ = None
+
+        for path in (self.tmp_path_, ivf_index_path(self.tmp_path_)):
+            if os.path.exists(path):
+                os.unlink(path)
+        print(f"Bitstream cache: abandoned recording {self.path_}")
+
+    def publish(self) -> None:
+        self.writer_.close()
+        self.writer_ = None
+
+        # index first: readers look the entry up by the IVF file
+        os.rename(ivf_index_path(self.tmp_path_), ivf_index_path(self.path_))
+        os.rename(self.tmp_path_, self.path_)
+
+        self.reader_ = IVFReader(self.path_)
+        self.state_ = self.State.REPLAY
+        print(f"Bitstream cache: recorded {self.num_frames_} frames to {self.path_}")
+
+    def state(self) -> 'BitstreamCache.State':
+        return self.state_
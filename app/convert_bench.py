@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import argparse
+
+import numpy as np
+
+from video.image import RawImage, ColorMatrix
+from utils.conversion import double_to_string
+
+# name: (bytes per pixel, conversion)
+FORMATS = {
+    'yuyv': (2, lambda img, src: img.copy_from_yuyv(src)),
+    'uyvy': (2, lambda img, src: img.copy_from_uyvy(src)),
+    'nv12': (1.5, lambda img, src: img.copy_from_nv12(src)),
+    'rgb24-bt601': (3, lambda img, src: img.copy_from_rgb24(src, ColorMatrix.BT601)),
+    'rgb24-bt709': (3, lambda img, src: img.copy_from_rgb24(src, ColorMatrix.BT709)),
+    'bgr24-bt601': (3, lambda img, src: img.copy_from_bgr24(src, ColorMatrix.BT601)),
+    'bgr24-bt709': (3, lambda img, src: img.copy_from_bgr24(src, ColorMatrix.BT709)),
+}
+
+SIZES = {
+    '4cif': (704, 576),
+    '1080p': (1920, 1080),
+}
+
+
+def print_usage(program_name: str) -> None:
+    usage_msg = f"""Usage: {program_name} [options]
+
+Options:
+    --frames <N>         frames to convert per format and size (default: 100)
+    --formats <list>     comma-separated formats (default: all)
+"""
+    print(usage_msg, file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark pixel-format conversion into I420 RawImages')
+    parser.add_argument('--frames', type=int, default=100,
+                        help='Frames to convert per format and size (default: 100)')
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help='Comma-separated formats (default: all)')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    rng = np.random.default_rng(0)
+    for size_name, (width, height) in SIZES.items():
+        raw_img = RawImage(width, height)
+
+        for format_name in args.formats.split(','):
+            bytes_per_pixel, convert = FORMATS[format_name]
+            src = rng.integers(0, 256, int(width * height * bytes_per_pixel),
+                               dtype=np.uint8).tobytes()
+
+            start = time.monotonic()
+            for _ in range(args.frames):
+                convert(raw_img, src)
+            elapsed = time.monotonic() - start
+
+            print(f"{size_name} ({width}x{height}) {format_name}: "
+                  f"{double_to_string(args.frames / elapsed)} fps")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
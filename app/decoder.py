@@ -1,53 +1,182 @@
 import os
 import time
+import json
 import threading
-from typing import Optional, Dict, Deque
+from typing import Callable, Optional, Dict, Deque, List, Iterator
 from collections import deque
+from types import SimpleNamespace
 import multiprocessing
 from enum import Enum
-from ctypes import create_string_buffer
 
 from utils.conversion import double_to_string
+from utils.histogram import LatencyHistogram
 from utils.exception_rim import check_call, check_syscall
 from utils.timestamp import timestamp_us
 from utils.file_descriptor import FileDescriptor
 from utils.vpx_wrap import *
 from video.sdl import VideoDisplay
 from video.image import RawImage
+from video.ivf import IVFWriter
 from protocol import FrameType, Datagram
+from frame_channel import FrameChannel
+from playout import PlayoutScheduler
+from event_trace import EventTracer, Event
+from metrics import MetricsRegistry
+from profiler import StageProfiler
+
+
+class FramePool:
+    """Recycled contiguous buffers for frames under reassembly.
+
+    Buffers come in power-of-two size classes; each class keeps at most
+    MAX_FREE_PER_CLASS free buffers. Buffers are released by the decoder
+    worker thread and acquired by the receiving thread; deque's append()
+    and pop() are atomic, so no lock is needed.
+    """
+    MIN_SIZE = 4096
+    MAX_FREE_PER_CLASS = 16
+
+    def __init__(self):
+        self.free_: Dict[int, Deque] = {}
+
+    @classmethod
+    def size_class(cls, size: int) -> int:
+        return max(cls.MIN_SIZE, 1 << (size - 1).bit_length())
+
+    def acquire(self, size: int):
+        size = self.size_class(size)
+        free = self.free_.get(size)
+        if free:
+            try:
+                return free.pop()
+            except IndexError:  # emptied by a concurrent acquire
+                pass
+
+        return (c_ubyte * size)()
+
+    def release(self, buf) -> None:
+        free = self.free_.setdefault(len(buf), deque())
+        if len(free) < self.MAX_FREE_PER_CLASS:
+            free.append(buf)
 
 
 class Frame:
-    def __init__(self, frame_id: int, frame_type: FrameType, frag_cnt: int):
+    # largest payload of a fragment for any MTU accepted by Datagram.set_mtu()
+    MAX_FRAG_SIZE = 1500 - 28 - Datagram.HEADER_SIZE
+
+    # shared by all frames unless a pool is given explicitly
+    default_pool = FramePool()
+
+    def __init__(self, frame_id: int, frame_type: FrameType, frag_cnt: int,
+                 pool: Optional[FramePool] = None):
         if frag_cnt == 0:
             raise RuntimeError("frame cannot have zero fragments")
             
         self.id_ = frame_id
         self.type_ = frame_type
-        self.frags_ = [None] * frag_cnt  # List of Optional[Datagram]
+        self.frag_cnt_ = frag_cnt
+        self.received_ = bytearray(frag_cnt)  # whether each fragment was received
         self.null_frags_ = frag_cnt
         self.frame_size_ = 0
 
-    def has_frag(self, frag_id: int) -> bool:
-        return self.frags_[frag_id] is not None
+        # payloads are written straight into a contiguous buffer: fragment
+        # 'frag_id' starts at frag_id * frag_size_, where frag_size_ is the
+        # (common) size of all but the last fragment
+        self.pool_ = pool or self.default_pool
+        self.buf_ = self.pool_.acquire(frag_cnt * self.MAX_FRAG_SIZE)
+        self.frag_size_: Optional[int] = None
+        # last fragment received before the fragment size is known
+        self.pending_last_: Optional[bytes] = None
+
+        # sender timestamp of the first fragment sent, and local times at
+        # which the first fragment arrived and the frame completed, all in us
+        # (0 if unknown)
+        self.send_ts_ = 0
+        self.first_recv_ts_ = 0
+        self.complete_ts_ = 0
+
+        # whether the worker should display the frame once decoded
+        self.render_ = True
 
-    def get_frag(self, frag_id: int) -> Datagram:
-        return self.frags_[frag_id]
+        # local time at which the frame was handed to the worker (us)
+        self.queued_ts_ = 0
+
+    @classmethod
+    def overhead(cls, frag_cnt: int) -> int:
+        """Approximate memory a frame uses, including its buffer."""
+        return 256 + frag_cnt + FramePool.size_class(frag_cnt * cls.MAX_FRAG_SIZE)
+
+    @classmethod
+    def from_payload(cls, frame_id: int, frame_type: FrameType, payload) -> 'Frame':
+        """Build a complete frame by fragmenting payload as the sender does."""
+        frag_cnt = max(1, -(-len(payload) // Datagram.max_payload))
+        frame = cls(frame_id, frame_type, frag_cnt)
+
+        for frag_id in range(frag_cnt):
+            start = frag_id * Datagram.max_payload
+            frame.insert_frag(Datagram(frame_id, frame_type, frag_id, frag_cnt,
+                                       bytes(payload[start:start + Datagram.max_payload])))
+
+        return frame
+
+    def has_frag(self, frag_id: int) -> bool:
+        return self.received_[frag_id] != 0
 
     def validate_datagram(self, datagram: Datagram) -> None:
         if (datagram.frame_id != self.id_ or
             datagram.frame_type != self.type_ or
-            datagram.frag_id >= len(self.frags_) or
-            datagram.frag_cnt != len(self.frags_)):
+            datagram.frag_id >= self.frag_cnt_ or
+            datagram.frag_cnt != self.frag_cnt_):
             raise RuntimeError("unable to insert an incompatible datagram")
 
+        # every fragment carries data: a zero fragment size would put all
+        # fragments at offset 0
+        payload_size = len(datagram.payload)
+        if self.frag_size_ is None:
+            size_ok = True
+        elif datagram.frag_id == self.frag_cnt_ - 1:
+            size_ok = payload_size <= self.frag_size_
+        else:
+            size_ok = payload_size == self.frag_size_
+        if not size_ok or not 0 < payload_size <= self.MAX_FRAG_SIZE:
+            raise RuntimeError("unable to insert a datagram of inconsistent size")
+
     def insert_frag(self, datagram: Datagram) -> None:
         self.validate_datagram(datagram)
-        
-        if self.frags_[datagram.frag_id] is None:
-            self.frame_size_ += len(datagram.payload)
-            self.null_frags_ -= 1
-            self.frags_[datagram.frag_id] = datagram
+
+        frag_id = datagram.frag_id
+        if self.received_[frag_id]:
+            return
+
+        payload = datagram.payload
+        last = frag_id == self.frag_cnt_ - 1
+
+        if not last and self.frag_size_ is None:
+            # the first non-last fragment reveals the fragment size
+            if self.pending_last_ is not None and len(self.pending_last_) > len(payload):
+                raise RuntimeError("unable to insert a datagram of inconsistent size")
+
+            self.frag_size_ = len(payload)
+            if self.pending_last_ is not None:
+                self.copy_payload(self.frag_cnt_ - 1, self.pending_last_)
+                self.pending_last_ = None
+
+        if last and self.frag_size_ is None and self.frag_cnt_ > 1:
+            self.pending_last_ = payload
+        else:
+            self.copy_payload(frag_id, payload)
+
+        self.frame_size_ += len(payload)
+        self.null_frags_ -= 1
+        self.received_[frag_id] = 1
+
+        # retransmissions carry later timestamps
+        if datagram.send_ts and (not self.send_ts_ or datagram.send_ts < self.send_ts_):
+            self.send_ts_ = datagram.send_ts
+
+    def copy_payload(self, frag_id: int, payload: bytes) -> None:
+        offset = frag_id * self.frag_size_ if frag_id > 0 else 0
+        memmove(byref(self.buf_, offset), payload, len(payload))
 
     def complete(self) -> bool:
         return self.null_frags_ == 0
@@ -57,20 +186,403 @@ class Frame:
             return None
         return self.frame_size_
 
+    def frag_cnt(self) -> int:
+        return self.frag_cnt_
+
+    def send_ts(self) -> int:
+        return self.send_ts_
+
+    def first_recv_ts(self) -> int:
+        return self.first_recv_ts_
+
+    def set_first_recv_ts(self, first_recv_ts: int) -> None:
+        self.first_recv_ts_ = first_recv_ts
+
+    def complete_ts(self) -> int:
+        return self.complete_ts_
+
+    def set_complete_ts(self, complete_ts: int) -> None:
+        self.complete_ts_ = complete_ts
+
+    def render(self) -> bool:
+        return self.render_
+
+    def set_render(self, render: bool) -> None:
+        self.render_ = render
+
+    def queued_ts(self) -> int:
+        return self.queued_ts_
+
+    def set_queued_ts(self, queued_ts: int) -> None:
+        self.queued_ts_ = queued_ts
+
+    def memory_size(self) -> int:
+        return self.overhead(self.frag_cnt_)
+
+    def buffer(self):
+        """Contiguous buffer holding the payload of a complete frame."""
+        if not self.complete():
+            raise RuntimeError("frame must be complete to get its payload")
+        return self.buf_
+
+    def payload(self) -> memoryview:
+        return memoryview(self.buffer())[:self.frame_size_]
+
+    def release(self) -> None:
+        """Return the buffer to the pool; the frame is unusable afterwards."""
+        if self.buf_ is not None:
+            self.pool_.release(self.buf_)
+            self.buf_ = None
+
     def id(self) -> int:
         return self.id_
 
     def type(self) -> FrameType:
         return self.type_
 
+class FrameRing:
+    """Frames under reassembly, indexed by frame ID in a power-of-two ring.
+
+    The ring covers frame IDs [base, base + capacity) and grows (up to
+    max_frames slots) when a frame beyond that window is inserted; lookups
+    are O(1) and moving the base costs O(1) amortized per frame it passes.
+
+    Memory is bounded by max_frames buffered frames and max_bytes of frame
+    memory. When a new datagram does not fit, frames are evicted in this
+    order, oldest first: incomplete non-key frames, incomplete key frames,
+    then complete frames other than the latest complete key frame. If
+    nothing can be evicted, the datagram is dropped.
+
+    Key frames beyond the window are assembled aside (see
+    insert_far_key_datagram()) and never evict buffered frames.
+    """
+    INITIAL_CAPACITY = 256
+    MAX_FRAMES = 1024
+    MAX_BYTES = 32 * 1024 * 1024  # 32 MB
+    MAX_FAR_KEY_FRAMES = 4
+
+    def __init__(self, max_frames: int = MAX_FRAMES, max_bytes: int = MAX_BYTES,
+                 clock: Callable[[], int] = timestamp_us):
+        if max_frames <= 0 or max_bytes <= 0:
+            raise RuntimeError("FrameRing: caps must be positive")
+
+        self.max_frames_ = max_frames
+        self.max_bytes_ = max_bytes
+        # stamps the time frames complete at
+        self.clock_ = clock
+
+        capacity = min(self.INITIAL_CAPACITY, 1 << (max_frames - 1).bit_length())
+        self.slots_: List[Optional[Frame]] = [None] * capacity
+        self.mask_ = capacity - 1
+        self.base_ = 0           # lowest frame ID the ring can hold
+        self.max_frame_id_ = -1  # highest frame ID inserted so far
+        self.num_frames_ = 0
+        self.num_bytes_ = 0
+
+        # frame IDs in order of creation (incomplete) or completion (complete)
+        self.incomplete_nonkey_: Dict[int, None] = {}
+        self.incomplete_key_: Dict[int, None] = {}
+        self.complete_: Dict[int, None] = {}
+        # highest frame ID of a complete key frame
+        self.latest_key_frame_: Optional[int] = None
+
+        # incomplete key frames beyond the window, least recently updated first
+        self.far_key_frames_: Dict[int, Frame] = {}
+        self.far_key_bytes_ = 0
+
+        # counters
+        self.num_evicted_frames_ = 0
+        self.num_evicted_bytes_ = 0
+        self.num_dropped_datagrams_ = 0
+
+    def __len__(self) -> int:
+        return self.num_frames_
+
+    def __iter__(self) -> Iterator[Frame]:
+        for frame_id in range(self.base_, self.max_frame_id_ + 1):
+            frame = self.slots_[frame_id & self.mask_]
+            if frame is not None:
+                yield frame
+
+    def capacity(self) -> int:
+        return len(self.slots_)
+
+    def num_bytes(self) -> int:
+        return self.num_bytes_
+
+    def latest_key_frame(self) -> Optional[int]:
+        return self.latest_key_frame_
+
+    def in_window(self, frame_id: int) -> bool:
+        return self.base_ <= frame_id < self.base_ + self.max_frames_
+
+    def get(self, frame_id: int) -> Optional[Frame]:
+        if frame_id < self.base_ or frame_id > self.max_frame_id_:
+            return None
+        return self.slots_[frame_id & self.mask_]
+
+    def insert_datagram(self, datagram: Datagram) -> Optional[Frame]:
+        """Insert a datagram into its frame, creating the frame if needed.
+
+        Returns:
+            Optional[Frame]: the frame, or None if the datagram was dropped
+        """
+        frame_id = datagram.frame_id
+        if not self.in_window(frame_id):
+            self.num_dropped_datagrams_ += 1
+            return None
+
+        frame = self.get(frame_id)
+        if frame is not None:
+            if frame.complete():
+                # a duplicate, unless it is malformed
+                self.insert_frag(frame, datagram)
+                return frame
+            if not self.insert_frag(frame, datagram):
+                return None
+        else:
+            # a new frame allocates all its memory upfront
+            if not self.make_room(Frame.overhead(datagram.frag_cnt), 1, frame_id):
+                self.num_dropped_datagrams_ += 1
+                return None
+
+            frame = Frame(frame_id, datagram.frame_type, datagram.frag_cnt)
+            frame.set_first_recv_ts(self.clock_())
+            # validated before the frame takes up room in the window
+            if not self.insert_frag(frame, datagram):
+                frame.release()
+                return None
+            self.insert(frame)
+
+        if frame.complete():
+            frame.set_complete_ts(self.clock_())
+            self.mark_complete(frame)
+
+        return frame
+
+    def insert_far_key_datagram(self, datagram: Datagram) -> Optional[Frame]:
+        """Insert a datagram of a key frame beyond the window into a frame
+        assembled aside, until the caller moves the window to it.
+
+        Only a complete far key frame is worth skipping ahead to, so a stray
+        or corrupt datagram with a large frame ID can't stall the session.
+        At most MAX_FAR_KEY_FRAMES are kept (the least recently updated is
+        evicted first) and they fit in max_bytes along with buffered frames;
+        otherwise the datagram is dropped.
+
+        Returns:
+            Optional[Frame]: the frame once complete (no longer kept aside)
+        """
+        frame_id = datagram.frame_id
+        frame = self.far_key_frames_.pop(frame_id, None)
+
+        if frame is None:
+            new_bytes = Frame.overhead(datagram.frag_cnt)
+            while self.far_key_frames_ and (
+                    len(self.far_key_frames_) >= self.MAX_FAR_KEY_FRAMES or
+                    self.num_bytes_ + self.far_key_bytes_ + new_bytes > self.max_bytes_):
+                self.remove_far_key_frame(next(iter(self.far_key_frames_)))
+
+            if self.num_bytes_ + self.far_key_bytes_ + new_bytes > self.max_bytes_:
+                self.num_dropped_datagrams_ += 1
+                return None
+
+            frame = Frame(frame_id, datagram.frame_type, datagram.frag_cnt)
+            frame.set_first_recv_ts(self.clock_())
+            if not self.insert_frag(frame, datagram):
+                frame.release()
+                return None
+            self.far_key_bytes_ += frame.memory_size()
+            inserted = True
+        else:
+            inserted = self.insert_frag(frame, datagram)
+
+        # most recently updated last
+        self.far_key_frames_[frame_id] = frame
+
+        if not inserted or not frame.complete():
+            return None
+
+        del self.far_key_frames_[frame_id]
+        self.far_key_bytes_ -= frame.memory_size()
+        frame.set_complete_ts(self.clock_())
+        return frame
+
+    def insert_frag(self, frame: Frame, datagram: Datagram) -> bool:
+        """Insert a datagram into a frame, dropping a malformed one (e.g. with
+        an out-of-range fragment ID or an inconsistent size).
+
+        Returns:
+            bool: False if the datagram was dropped
+        """
+        try:
+            frame.insert_frag(datagram)
+        except RuntimeError:
+            self.num_dropped_datagrams_ += 1
+            return False
+        return True
+
+    def remove_far_key_frame(self, frame_id: int) -> None:
+        frame = self.far_key_frames_.pop(frame_id)
+        self.far_key_bytes_ -= frame.memory_size()
+        self.num_evicted_frames_ += 1
+        self.num_evicted_bytes_ += frame.memory_size()
+        frame.release()
+
+    def insert_complete(self, frame: Frame) -> bool:
+        """Insert a frame completed aside (e.g. a far key frame) once the
+        window has moved to it; releases the frame if it doesn't fit."""
+        if not self.in_window(frame.id()) or not self.make_room(
+                frame.memory_size(), 1, frame.id()):
+            frame.release()
+            return False
+
+        self.insert(frame)
+        self.mark_complete(frame)
+        return True
+
+    def mark_complete(self, frame: Frame) -> None:
+        frame_id = frame.id()
+        self.incomplete_of(frame).pop(frame_id)
+        self.complete_[frame_id] = None
+
+        # keep track of the latest complete key frame to recover from
+        if frame.type() == FrameType.KEY:
+            if self.latest_key_frame_ is None or frame_id > self.latest_key_frame_:
+                self.latest_key_frame_ = frame_id
+
+    def incomplete_of(self, frame: Frame) -> Dict[int, None]:
+        if frame.type() == FrameType.KEY:
+            return self.incomplete_key_
+        return self.incomplete_nonkey_
+
+    def insert(self, frame: Frame) -> None:
+        frame_id = frame.id()
+        if frame_id - self.base_ >= len(self.slots_):
+            self.grow(frame_id - self.base_ + 1)
+
+        self.slots_[frame_id & self.mask_] = frame
+        self.max_frame_id_ = max(self.max_frame_id_, frame_id)
+        self.num_frames_ += 1
+        self.num_bytes_ += frame.memory_size()
+        self.incomplete_of(frame)[frame_id] = None
+
+    def remove(self, frame: Frame, release: bool = True) -> None:
+        """Remove a frame, releasing its buffer unless it is handed over."""
+        frame_id = frame.id()
+        self.slots_[frame_id & self.mask_] = None
+        self.num_frames_ -= 1
+        self.num_bytes_ -= frame.memory_size()
+
+        if frame.complete():
+            del self.complete_[frame_id]
+        else:
+            del self.incomplete_of(frame)[frame_id]
+
+        if frame_id == self.latest_key_frame_:
+            self.latest_key_frame_ = None
+
+        if release:
+            frame.release()
+
+    def make_room(self, new_bytes: int, new_frames: int, keep_frame_id: int) -> bool:
+        while (self.num_frames_ + new_frames > self.max_frames_ or
+               self.num_bytes_ + new_bytes > self.max_bytes_):
+            victim = self.eviction_candidate(keep_frame_id)
+            if victim is None:
+                return False
+
+            self.num_evicted_frames_ += 1
+            self.num_evicted_bytes_ += victim.memory_size()
+            self.remove(victim)
+
+        return True
+
+    def eviction_candidate(self, keep_frame_id: int) -> Optional[Frame]:
+        for frame_ids in (self.incomplete_nonkey_, self.incomplete_key_, self.complete_):
+            for frame_id in frame_ids:
+                if frame_id != keep_frame_id and frame_id != self.latest_key_frame_:
+                    return self.get(frame_id)
+
+        return None
+
+    def grow(self, min_capacity: int) -> None:
+        capacity = len(self.slots_)
+        while capacity < min_capacity:
+            capacity *= 2
+
+        frames = list(self)
+        self.slots_ = [None] * capacity
+        self.mask_ = capacity - 1
+        for frame in frames:
+            self.slots_[frame.id() & self.mask_] = frame
+
+    def clean_up_to(self, frontier: int) -> None:
+        """Remove all frames before frontier and move the base there."""
+        if frontier <= self.base_:
+            return
+
+        # only slots between the base and the highest frame can be occupied
+        end = min(frontier, self.max_frame_id_ + 1)
+        frame_id = self.base_
+        while self.num_frames_ > 0 and frame_id < end:
+            frame = self.slots_[frame_id & self.mask_]
+            if frame is not None:
+                self.remove(frame)
+            frame_id += 1
+
+        self.base_ = frontier
+        self.max_frame_id_ = max(self.max_frame_id_, frontier - 1)
+
+        # far key frames that the window has reached or passed
+        for frame_id in [frame_id for frame_id in self.far_key_frames_
+                         if frame_id < self.base_ + self.max_frames_]:
+            frame = self.far_key_frames_[frame_id]
+            if frame_id >= self.base_ and self.make_room(frame.memory_size(), 1, frame_id):
+                del self.far_key_frames_[frame_id]
+                self.far_key_bytes_ -= frame.memory_size()
+                self.insert(frame)
+            else:
+                self.remove_far_key_frame(frame_id)
+
+    def clear(self) -> None:
+        self.clean_up_to(self.max_frame_id_ + 1)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'frames': self.num_frames_,
+            'bytes': self.num_bytes_,
+            'evicted_frames': self.num_evicted_frames_,
+            'evicted_bytes': self.num_evicted_bytes_,
+            'dropped_datagrams': self.num_dropped_datagrams_,
+        }
+
+
 class Decoder:
     class LazyLevel(Enum):
         DECODE_DISPLAY = 0    # decode and display
         DECODE_ONLY = 1       # decode only but not display  
         NO_DECODE_DISPLAY = 2 # neither decode nor display
 
+    # the worker catches up once frames have waited this long to be decoded
+    DEFAULT_LATENCY_BUDGET_MS = 200
+
     def __init__(self, display_width: int, display_height: int, 
-                 lazy_level: int = 0, output_path: str = ""):
+                 lazy_level: int = 0, output_path: str = "",
+                 max_buffered_frames: int = FrameRing.MAX_FRAMES,
+                 max_buffered_bytes: int = FrameRing.MAX_BYTES,
+                 worker_process: bool = False,
+                 latency_budget_ms: int = DEFAULT_LATENCY_BUDGET_MS,
+                 stats_path: str = "",
+                 clock: Callable[[], int] = timestamp_us):
+        """
+        Args:
+            stats_path: file to also write the periodic stats of the receiving
+                        loop and the worker to, as one JSON object per line
+            clock: source of the current time in us (e.g. a VirtualClock),
+                   also timing the once-a-second stats of the receiving loop;
+                   the worker's stats keep using the real clock
+        """
         # Add exit flag for worker
         self.should_exit = False
 
@@ -85,148 +597,249 @@ class Decoder:
         if output_path:
             self.output_fd = FileDescriptor(check_syscall(os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)))
 
+        # shared with the worker (thread or process); appends keep lines whole
+        self.stats_fd_: Optional[FileDescriptor] = None
+        if stats_path:
+            self.stats_fd_ = FileDescriptor(check_syscall(os.open(
+                stats_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)))
+
+        # opt-in recording of the received stream
+        self.ivf_writer_: Optional[IVFWriter] = None
+        # opt-in per-packet event trace
+        self.event_tracer_: Optional[EventTracer] = None
+        # opt-in exported metrics (see set_metrics())
+        self.metrics_: Optional[SimpleNamespace] = None
+        # opt-in timing of the worker's stages
+        self.profiler_: Optional[StageProfiler] = None
+
         self.verbose_ = False
         self.next_frame_ = 0
-        self.frame_buf_: Dict[int, Frame] = {}
+        self.clock_ = clock
+        self.frame_buf_ = FrameRing(max_buffered_frames, max_buffered_bytes, clock)
         
         self.num_decodable_frames_ = 0
         self.total_decodable_frame_size_ = 0
+        # from a frame's first fragment arriving to its last one arriving (us);
+        # both on the local clock, unlike the sender's timestamps
+        self.frame_completion_hist_ = LatencyHistogram()
+        # decoding times (us) of the worker thread's periods output so far and
+        # of the current one, read by metrics scrapes
+        self.decode_time_hists_ = (LatencyHistogram(), LatencyHistogram())
         
         self.decoder_epoch_ = time.monotonic()
-        self.last_stats_time_ = self.decoder_epoch_
+        self.last_stats_ts_ = clock()
 
         # Thread synchronization
         self.mtx_ = threading.Lock()
         self.cv_ = threading.Condition(self.mtx_)
         self.shared_queue_: Deque[Frame] = deque()
         
+        # 0 disables catching up
+        self.latency_budget_us_ = latency_budget_ms * 1000
+
+        # opt-in: hold decodable frames until their playout deadline
+        self.playout_: Optional[PlayoutScheduler] = None
+
+        # completed frames are handed to a worker process through shared
+        # memory instead, keeping decoding off the GIL of the receive loop
+        self.channel_: Optional[FrameChannel] = None
+
         self.worker_ = None
         if lazy_level <= self.LazyLevel.DECODE_ONLY.value:
-            self.worker_ = threading.Thread(target=self.worker_main)
-            self.worker_.start()
-            print("Spawned a new thread for decoding and displaying frames")
+            if worker_process:
+                self.channel_ = FrameChannel()
+                # forked so that the worker inherits this (yet unused) decoder
+                context = multiprocessing.get_context('fork')
+                self.worker_ = context.Process(target=self.worker_main,
+                                               args=(self.channel_,), daemon=True)
+                self.worker_.start()
+                print("Spawned a new process for decoding and displaying frames")
+            else:
+                self.worker_ = threading.Thread(target=self.worker_main)
+                self.worker_.start()
+                print("Spawned a new thread for decoding and displaying frames")
 
     def add_datagram_common(self, datagram: Datagram) -> bool:
         frame_id = datagram.frame_id
         
         if frame_id < self.next_frame_:
             return False
-            
-        if frame_id not in self.frame_buf_:
-            self.frame_buf_[frame_id] = Frame(
-                frame_id, datagram.frame_type, datagram.frag_cnt)
-            
+
+        # a key frame beyond the reassembly window: once it is complete, give
+        # up on the buffered frames, as they can no longer lead up to it
+        if not self.frame_buf_.in_window(frame_id) and datagram.frame_type == FrameType.KEY:
+            frame = self.frame_buf_.insert_far_key_datagram(datagram)
+            if frame is None:
+                return False
+
+            frame_diff = frame_id - self.next_frame_
+            self.advance_next_frame(frame_diff)
+            self.frame_buf_.insert_complete(frame)
+            print(f"* Recovery: skipped {frame_diff} frames ahead to incoming key frame {frame_id}")
+            if self.event_tracer_:
+                self.event_tracer_.record(Event.FRAME_SKIP, frame_id, 0, frame_diff)
+            if self.metrics_:
+                self.metrics_.frames_skipped.inc(frame_diff)
+            return False
+
         return True
 
     def add_datagram(self, datagram: Datagram) -> None:
+        # retry frames that did not fit in the shared-memory channel
+        if self.channel_ and self.channel_.num_pending():
+            self.channel_.flush()
+
+        if self.event_tracer_:
+            self.event_tracer_.record(Event.RECV, datagram.frame_id, datagram.frag_id,
+                                      datagram.send_ts)
+
         if not self.add_datagram_common(datagram):
             return
-            
-        self.frame_buf_[datagram.frame_id].insert_frag(datagram)
+
+        self.frame_buf_.insert_datagram(datagram)
 
     def next_frame_complete(self) -> bool:
-        if self.next_frame_ in self.frame_buf_:
-            if self.frame_buf_[self.next_frame_].complete():
-                return True
+        frame = self.frame_buf_.get(self.next_frame_)
+        if frame is not None and frame.complete():
+            return True
                 
         # Look for complete key frame ahead
-        for frame_id in sorted(self.frame_buf_.keys(), reverse=True):
-            frame = self.frame_buf_[frame_id]
-            if (frame.type() == FrameType.KEY and 
-                frame.complete() and 
-                frame_id > self.next_frame_):
-                
-                frame_diff = frame_id - self.next_frame_
-                self.advance_next_frame(frame_diff)
-                print(f"* Recovery: skipped {frame_diff} frames ahead to key frame {frame_id}")
-                return True
+        frame_id = self.frame_buf_.latest_key_frame()
+        if frame_id is not None and frame_id > self.next_frame_:
+            frame_diff = frame_id - self.next_frame_
+            self.advance_next_frame(frame_diff)
+            print(f"* Recovery: skipped {frame_diff} frames ahead to key frame {frame_id}")
+            if self.event_tracer_:
+                self.event_tracer_.record(Event.FRAME_SKIP, frame_id, 0, frame_diff)
+            if self.metrics_:
+                self.metrics_.frames_skipped.inc(frame_diff)
+            return True
                 
         return False
 
     def consume_next_frame(self) -> None:
-        frame = self.frame_buf_[self.next_frame_]
+        frame = self.frame_buf_.get(self.next_frame_)
         if not frame.complete():
             raise RuntimeError("next frame must be complete before consuming it")
 
+        if self.event_tracer_:
+            self.event_tracer_.record(Event.FRAME_DECODABLE, frame.id(), frame.frag_cnt(),
+                                      frame.complete_ts())
+
         # Update stats
         self.num_decodable_frames_ += 1
         frame_size = frame.frame_size()
         self.total_decodable_frame_size_ += frame_size
+        if frame.first_recv_ts():
+            self.frame_completion_hist_.record(frame.complete_ts() - frame.first_recv_ts())
+
+        metrics = self.metrics_
+        if metrics:
+            metrics.frames.inc()
+            metrics.frame_bytes.inc(frame_size)
+            if frame.type() == FrameType.KEY:
+                metrics.key_frames.inc()
 
-        stats_now = time.monotonic()
-        while stats_now >= self.last_stats_time_ + 1:
+        stats_now = self.clock_()
+        while stats_now >= self.last_stats_ts_ + 1000000:
             print(f"Decodable frames in the last ~1s: {self.num_decodable_frames_}")
             
-            diff_ms = (stats_now - self.last_stats_time_) * 1000
+            diff_ms = (stats_now - self.last_stats_ts_) / 1000
+            bitrate = self.total_decodable_frame_size_ * 8 / diff_ms if diff_ms > 0 else 0.0
             if diff_ms > 0:
-                bitrate = self.total_decodable_frame_size_ * 8 / diff_ms
                 print(f"  - Bitrate (kbps): {double_to_string(bitrate)}")
 
+            if self.frame_completion_hist_.count() > 0:
+                print(f"  - Frame completion (ms): {self.frame_completion_hist_.format()}")
+
+            buf_stats = self.frame_buf_.stats()
+            if buf_stats['evicted_frames'] or buf_stats['dropped_datagrams']:
+                print(f"  - Reassembly buffer: {buf_stats['frames']} frames, "
+                      f"{buf_stats['bytes'] // 1024} KB; evicted {buf_stats['evicted_frames']} "
+                      f"frames ({buf_stats['evicted_bytes'] // 1024} KB), "
+                      f"dropped {buf_stats['dropped_datagrams']} datagrams")
+
+            if self.playout_:
+                self.playout_.output_periodic_stats()
+
+            if self.profiler_:
+                self.profiler_.output_periodic_stats()
+
+            if self.stats_fd_:
+                self.stats_fd_.write(json.dumps({
+                    'ts': self.clock_(),
+                    'source': 'receiver',
+                    'decodable_frames': self.num_decodable_frames_,
+                    'bitrate_kbps': bitrate,
+                    'frame_completion_us': self.frame_completion_hist_.summary(),
+                }) + "\n")
+
+            # the exported histogram is cumulative
+            if self.metrics_:
+                self.metrics_.frame_completion_total.merge(self.frame_completion_hist_)
+
             # Reset stats
             self.num_decodable_frames_ = 0
             self.total_decodable_frame_size_ = 0
-            self.last_stats_time_ += 1
+            self.frame_completion_hist_.reset()
+            self.last_stats_ts_ += 1000000
 
-        if self.lazy_level_.value <= self.LazyLevel.DECODE_ONLY.value:
+        # record the frame before the worker may release its buffer
+        if self.ivf_writer_:
+            self.ivf_writer_.write_frame(frame.payload(), frame.id(),
+                                         frame.type() == FrameType.KEY)
+
+        # whoever decodes the frame owns its buffer from now on
+        self.frame_buf_.remove(frame, release=False)
+
+        if self.playout_:
+            self.playout_.schedule(frame)
+        else:
+            self.hand_off(frame)
+
+        self.advance_next_frame()
+
+    def hand_off(self, frame: Frame) -> None:
+        """Pass a decodable frame on to the worker (or just log it)."""
+        frame.set_queued_ts(self.clock_())
+
+        if self.channel_:
+            self.channel_.send(frame)
+            frame.release()
+        elif self.lazy_level_.value <= self.LazyLevel.DECODE_ONLY.value:
             with self.mtx_:
                 self.shared_queue_.append(frame)
                 self.cv_.notify()  # Changed from notify_one()
         else:
             if self.output_fd:
-                frame_decodable_ts = timestamp_us()
+                frame_decodable_ts = self.clock_()
                 self.output_fd.write(
-                    f"{self.next_frame_},{frame_size},{frame_decodable_ts}\n")
+                    f"{frame.id()},{frame.frame_size()},{frame_decodable_ts}\n")
 
-        self.advance_next_frame()
+            frame.release()
+
+    def enable_playout(self) -> PlayoutScheduler:
+        """Release frames on a playout schedule; the caller polls its timer."""
+        self.playout_ = PlayoutScheduler(self.hand_off, self.clock_)
+        return self.playout_
 
     def advance_next_frame(self, n: int = 1) -> None:
         self.next_frame_ += n
         self.clean_up_to(self.next_frame_)
 
     def clean_up_to(self, frontier: int) -> None:
-        to_remove = []
-        for frame_id in self.frame_buf_:
-            if frame_id < frontier:
-                to_remove.append(frame_id)
-        
-        for frame_id in to_remove:
-            del self.frame_buf_[frame_id]
-
-    # Add constants
-    MAX_DECODING_BUF = 1000000  # 1 MB
+        self.frame_buf_.clean_up_to(frontier)
 
     def decode_frame(self, context: 'vpx_codec_ctx_t', frame: 'Frame') -> float:
         if not frame.complete():
             raise RuntimeError("frame must be complete before decoding")
 
-        # Allocate static buffer if needed
-        if not hasattr(self, '_decode_buf'):
-            # self._decode_buf = bytearray(self.MAX_DECODING_BUF)
-            self._decode_buf = create_string_buffer(self.MAX_DECODING_BUF)
-
-        # Copy payload data to buffer
-        buf_ptr = 0
-        for datagram in frame.frags_:
-            if datagram:
-                payload_size = len(datagram.payload)
-                if buf_ptr + payload_size >= self.MAX_DECODING_BUF:
-                    raise RuntimeError("frame size exceeds max decoding buffer size")
-                
-                # Copy payload to buffer
-                # self._decode_buf[buf_ptr:buf_ptr + payload_size] = datagram.payload
-                memmove(byref(self._decode_buf, buf_ptr), 
-                          datagram.payload, 
-                          payload_size)
-                buf_ptr += payload_size
-
-        frame_size = buf_ptr
-
-        # decode the compressed frame in 'decode_buf'
+        # decode the compressed frame straight from its reassembly buffer
         decode_start = time.monotonic()
         check_call(vpx_codec_decode(
                 byref(context),
-                cast(self._decode_buf, POINTER(c_ubyte)),
-                frame_size,
+                cast(frame.buffer(), POINTER(c_ubyte)),
+                frame.frame_size(),
                 None,
                 1
             ),
@@ -260,10 +873,7 @@ class Decoder:
                 vpx_img = raw_img)
             display.show_frame(img)
 
-    def worker_main(self) -> None:
-        if self.lazy_level_ == self.LazyLevel.NO_DECODE_DISPLAY:
-            return
-
+    def init_decoder_context(self) -> 'vpx_codec_ctx_t':
         # initialize a VP9 decoding context
         max_threads = min(multiprocessing.cpu_count(), 4)
         cfg = vpx_codec_dec_cfg(
@@ -283,6 +893,49 @@ class Decoder:
 
         print(f"[worker] Initialized decoder (max threads: {max_threads})")
 
+        return context
+
+    def take_shared_queue(self) -> Optional[List[Frame]]:
+        # worker releases the lock so it doesn't block the main thread anymore
+        with self.cv_:
+            # wait until the shared queue is not empty
+            self.cv_.wait_for(lambda: len(self.shared_queue_) > 0 or self.should_exit)
+            if self.should_exit:
+                return None
+
+            # worker owns the lock after wait and should copy shared queue quickly
+            frames = list(self.shared_queue_)
+            self.shared_queue_.clear()
+
+        return frames
+
+    def over_latency_budget(self, frame: Frame) -> bool:
+        return (self.latency_budget_us_ > 0 and
+                self.clock_() - frame.queued_ts() > self.latency_budget_us_)
+
+    def skip_to_latest_key_frame(self, local_queue: Deque[Frame]) -> int:
+        """Drop the frames queued before the newest key frame without decoding them."""
+        key_index = None
+        for i, frame in enumerate(local_queue):
+            if frame.type() == FrameType.KEY:
+                key_index = i
+
+        if not key_index:
+            return 0
+
+        for _ in range(key_index):
+            local_queue.popleft().release()
+
+        return key_index
+
+    def worker_main(self, channel: Optional[FrameChannel] = None) -> None:
+        """Decode (and display) frames from the shared queue or, in a worker
+        process, from the shared-memory channel."""
+        if self.lazy_level_ == self.LazyLevel.NO_DECODE_DISPLAY:
+            return
+
+        context = self.init_decoder_context()
+
         # video display
         display = None
         if self.lazy_level_ == self.LazyLevel.DECODE_DISPLAY:
@@ -293,8 +946,9 @@ class Decoder:
         
         # stats maintained by the worker thread
         num_decoded_frames = 0
-        total_decode_time_ms = 0.0
-        max_decode_time_ms = 0.0
+        decode_time_hist = self.decode_time_hists_[1]
+        num_decode_only_frames = 0
+        num_skipped_frames = 0
         last_stats_time = self.decoder_epoch_
 
         while True:
@@ -302,35 +956,53 @@ class Decoder:
             if display and display.signal_quit():
                 display = None
 
-            # worker releases the lock so it doesn't block the main thread anymore
-            with self.cv_:
-                # wait until the shared queue is not empty
-                self.cv_.wait_for(lambda: len(self.shared_queue_) > 0 or self.should_exit)
-                if self.should_exit:
-                    break
+            profiler = self.profiler_
+            wait_start_ns = time.monotonic_ns() if profiler else 0
+
+            frames = channel.receive() if channel else self.take_shared_queue()
+            if frames is None:
+                break
+            local_queue.extend(frames)
+
+            if profiler:
+                profiler.add_since('worker_wait', wait_start_ns)
 
-                # worker owns the lock after wait and should copy shared queue quickly
-                while self.shared_queue_:
-                    local_queue.append(self.shared_queue_.popleft())
+            # fallen behind: frames before the newest key frame are not needed
+            if self.over_latency_budget(local_queue[0]):
+                num_skipped_frames += self.skip_to_latest_key_frame(local_queue)
 
             # now worker can take its time to decode and render the frames kept locally
             while local_queue:
                 frame = local_queue.popleft()
+
+                # while behind, only the latest frame of the backlog is rendered
+                render = display is not None and frame.render()
+                if render and local_queue and self.over_latency_budget(frame):
+                    render = False
+                    num_decode_only_frames += 1
+
                 decode_time_ms = self.decode_frame(context, frame)
+                if profiler:
+                    profiler.add('worker_decode', round(decode_time_ms * 1000000))
+
+                # libvpx is done with the compressed data
+                frame.release()
 
                 if self.output_fd:
-                    frame_decoded_ts = timestamp_us()
+                    frame_decoded_ts = self.clock_()
                     self.output_fd.write(
                         f"{frame.id()},{frame.frame_size()},{frame_decoded_ts}\n"
                     )
 
-                if display:
+                if render:
+                    display_start_ns = time.monotonic_ns() if profiler else 0
                     self.display_decoded_frame(context, display)
+                    if profiler:
+                        profiler.add_since('worker_display', display_start_ns)
 
                 # update stats
                 num_decoded_frames += 1
-                total_decode_time_ms += decode_time_ms
-                max_decode_time_ms = max(max_decode_time_ms, decode_time_ms)
+                decode_time_hist.record(round(decode_time_ms * 1000))
 
                 # worker thread also outputs stats roughly every second
                 stats_now = time.monotonic()
@@ -338,27 +1010,116 @@ class Decoder:
                     if num_decoded_frames > 0:
                         print(f"[worker] Avg/Max decoding time (ms) of "
                               f"{num_decoded_frames} frames: "
-                              f"{double_to_string(total_decode_time_ms / num_decoded_frames)}/"
-                              f"{double_to_string(max_decode_time_ms)}")
+                              f"{double_to_string(decode_time_hist.mean() / 1000)}/"
+                              f"{double_to_string(decode_time_hist.max() / 1000)}")
+                        print(f"[worker] Decoding time (ms): {decode_time_hist.format()}")
+
+                    if num_decode_only_frames > 0 or num_skipped_frames > 0:
+                        print(f"[worker] Catching up: decoded {num_decode_only_frames} "
+                              f"frames without rendering, skipped {num_skipped_frames} "
+                              f"frames to a key frame")
+
+                    if self.stats_fd_:
+                        self.stats_fd_.write(json.dumps({
+                            'ts': self.clock_(),
+                            'source': 'worker',
+                            'decoded_frames': num_decoded_frames,
+                            'decode_only_frames': num_decode_only_frames,
+                            'skipped_frames': num_skipped_frames,
+                            'decode_time_us': decode_time_hist.summary(),
+                        }) + "\n")
 
                     # reset stats
                     num_decoded_frames = 0
-                    total_decode_time_ms = 0.0
-                    max_decode_time_ms = 0.0
+                    # replaced together, so a scrape from the main thread
+                    # never counts a period twice or not at all
+                    decode_time_total = LatencyHistogram()
+                    decode_time_total.merge(self.decode_time_hists_[0])
+                    decode_time_total.merge(decode_time_hist)
+                    decode_time_hist = LatencyHistogram()
+                    self.decode_time_hists_ = (decode_time_total, decode_time_hist)
+                    num_decode_only_frames = 0
+                    num_skipped_frames = 0
                     last_stats_time += 1
 
         check_call(vpx_codec_destroy(byref(context)), 0, "vpx_codec_destroy")
 
     # Add cleanup method
-    def __del__(self):
-        if hasattr(self, 'worker_') and self.worker_ and self.worker_.is_alive():
+    def stop_worker(self) -> None:
+        """Let the worker finish the frames handed to it and wait for it."""
+        if self.channel_:
+            self.channel_.shutdown()
+            self.worker_.join(timeout=1.0)
+            if self.worker_.is_alive():
+                self.worker_.terminate()
+            self.channel_.destroy()
+            self.channel_ = None
+        elif self.worker_ and self.worker_.is_alive():
             with self.mtx_:
                 self.should_exit = True
                 self.cv_.notify()
             self.worker_.join(timeout=1.0)
+
+    def __del__(self):
+        if hasattr(self, 'channel_'):
+            self.stop_worker()
         
         if hasattr(self, 'output_fd') and self.output_fd:
             self.output_fd.close()
 
+        if hasattr(self, 'ivf_writer_') and self.ivf_writer_:
+            self.ivf_writer_.close()
+
+    def set_ivf_output(self, ivf_path: str, frame_rate: int) -> None:
+        """Record every decodable frame to an IVF file (with a side index)."""
+        self.ivf_writer_ = IVFWriter(ivf_path, self.display_width_,
+                                     self.display_height_, frame_rate)
+
+    def set_metrics(self, registry: MetricsRegistry) -> None:
+        """Export frame and reassembly metrics and queue depths through
+        'registry'. Decode times are only exported with a worker thread,
+        not a worker process."""
+        self.metrics_ = SimpleNamespace(
+            frames=registry.counter('frames_decodable_total', 'Frames complete in order'),
+            key_frames=registry.counter('key_frames_decodable_total',
+                                        'Key frames complete in order'),
+            frame_bytes=registry.counter('decodable_bytes_total',
+                                         'Bytes of frames complete in order'),
+            frames_skipped=registry.counter('frames_skipped_total',
+                                            'Frames skipped to recover at a key frame'),
+            # frame completion times of the periods output so far
+            frame_completion_total=LatencyHistogram(),
+        )
+        metrics = self.metrics_
+
+        # read only when scraped
+        registry.histogram('frame_completion_seconds',
+                           "From a frame's first fragment arriving to its last one arriving",
+                           fn=lambda: (metrics.frame_completion_total,
+                                       self.frame_completion_hist_))
+        registry.histogram('decode_time_seconds', 'Time to decode a frame',
+                           fn=lambda: self.decode_time_hists_)
+        frame_buf = self.frame_buf_
+        registry.gauge('reassembly_frames', 'Frames under reassembly', lambda: len(frame_buf))
+        registry.gauge('reassembly_bytes', 'Memory of frames under reassembly',
+                       frame_buf.num_bytes)
+        registry.counter('evicted_frames_total', 'Frames evicted from the reassembly buffer',
+                         lambda: frame_buf.stats()['evicted_frames'])
+        registry.counter('dropped_datagrams_total',
+                         'Datagrams dropped by the full reassembly buffer',
+                         lambda: frame_buf.stats()['dropped_datagrams'])
+        registry.gauge('decode_queue_frames', 'Frames handed off but not taken by the worker',
+                       lambda: len(self.shared_queue_))
+
+    def set_profiler(self, profiler: StageProfiler) -> None:
+        """Time the worker's stages (waiting for frames, decoding, displaying)
+        with 'profiler' and output it with the periodic stats. Only a worker
+        thread is timed, not a worker process."""
+        self.profiler_ = profiler
+
+    def set_event_tracer(self, event_tracer: EventTracer) -> None:
+        """Record received datagrams and decodable frames to a per-packet event trace."""
+        self.event_tracer_ = event_tracer
+
     def set_verbose(self, verbose: bool) -> None:
         self.verbose_ = verbose
\ No newline at end of file
@@ -1,16 +1,26 @@
 import os
 import time
-from ctypes import c_void_p, byref, cast
-from typing import Optional, Deque, Dict, Tuple
+import json
+import struct
+from ctypes import c_void_p, c_int, byref, cast
+from types import SimpleNamespace
+from typing import Callable, Optional, Deque, Dict, Tuple
 from collections import deque
 
 from utils.file_descriptor import FileDescriptor
 from utils.exception_rim import check_syscall, check_call
 from utils.timestamp import timestamp_us
 from utils.conversion import narrow_cast
+from utils.histogram import LatencyHistogram
 from utils.vpx_wrap import *
 from video.image import RawImage
+from video.ivf import IVFWriter
 from protocol import Datagram, AckMsg, FrameType
+from telemetry import EncoderTelemetry
+from event_trace import EventTracer, Event
+from metrics import MetricsRegistry
+from profiler import StageProfiler
+from bitstream_cache import BitstreamCache
 
 
 class Encoder:
@@ -18,12 +28,32 @@ class Encoder:
     MAX_NUM_RTX = 3
     MAX_UNACKED_US = 1000 * 1000  # 1s
 
-    def __init__(self, display_width, display_height, frame_rate, output_path=""):
+    def __init__(self, display_width, display_height, frame_rate, output_path="",
+                 telemetry_path="", clock: Callable[[], int] = timestamp_us):
+        """
+        Args:
+            clock: source of the current time in us (e.g. a VirtualClock)
+        """
+        self.clock_ = clock
         self.display_width_ = display_width
         self.display_height_ = display_height
         self.frame_rate_ = frame_rate
         self.output_path = output_path
         self.output_fd: Optional[FileDescriptor] = None
+        # opt-in per-frame quality and rate telemetry
+        self.telemetry_: Optional[EncoderTelemetry] = None
+        # opt-in cache of encoded frames to replay instead of re-encoding
+        self.bitstream_cache_: Optional[BitstreamCache] = None
+        # opt-in recording of the sent stream
+        self.ivf_writer_: Optional[IVFWriter] = None
+        # opt-in per-packet event trace
+        self.event_tracer_: Optional[EventTracer] = None
+        # opt-in machine-readable periodic stats (JSON lines)
+        self.stats_fd_: Optional[FileDescriptor] = None
+        # opt-in exported metrics (see set_metrics())
+        self.metrics_: Optional[SimpleNamespace] = None
+        # opt-in timing of the encode and packetize stages
+        self.profiler_: Optional[StageProfiler] = None
         # print debugging info
         self.verbose_ = False
         # current target bitrate
@@ -42,13 +72,26 @@ class Encoder:
         self.ewma_rtt_us: Optional[float] = None
         # performance stats
         self.num_encoded_frames = 0
-        self.total_encode_time_ms = 0.0
-        self.max_encode_time_ms = 0.0
+        self.num_replayed_frames = 0
+        # latency distributions in the current period (us); ACK delay runs
+        # from a datagram's first transmission to its ACK, across retransmissions
+        self.encode_time_hist_ = LatencyHistogram()
+        self.rtt_hist_ = LatencyHistogram()
+        self.ack_delay_hist_ = LatencyHistogram()
+        # properties of the last encoded frame
+        self.last_frame_type_ = FrameType.UNKNOWN
+        self.last_frag_cnt_ = 0
+        self.last_psnr_ = 0.0
 
         # open the output file
         if output_path:
             self.output_fd = FileDescriptor(check_syscall(os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)))
 
+        # open the telemetry file
+        if telemetry_path:
+            self.telemetry_ = EncoderTelemetry(
+                telemetry_path, display_width, display_height, frame_rate)
+
         # populate VP9 configuration with default values
         check_call(vpx_codec_enc_config_default(
                     byref(vpx_codec_vp9_cx_algo), 
@@ -89,13 +132,17 @@ class Encoder:
 
         # use no more than 16 or the number of avaialble CPUs
         cpu_used = min(os.cpu_count(), 16)
+        self.cpu_used_ = cpu_used
+
+        # ask libvpx for PSNR packets only if they will be recorded
+        init_flags = VPX_CODEC_USE_PSNR if self.telemetry_ else 0
 
         # more encoder settings
         check_call(vpx_codec_enc_init(
             byref(self.context_), 
             byref(vpx_codec_vp9_cx_algo), 
             byref(self.cfg_), 
-            0,
+            init_flags,
             ),
             VPX_CODEC_OK, "vpx_codec_enc_init") 
 
@@ -129,43 +176,85 @@ class Encoder:
         if vpx_codec_destroy(byref(self.context_)) != VPX_CODEC_OK:
             print("~Encoder(): failed to destroy VPX encoder context")
 
-    def compress_frame(self, raw_img: RawImage):
-        frame_generation_ts = timestamp_us()
+        if self.telemetry_:
+            self.telemetry_.close()
 
-        # encode raw_img into frame 'frame_id_'
-        self.encode_frame(raw_img)
+        if self.ivf_writer_:
+            self.ivf_writer_.close()
 
-        # packetize frame 'frame_id_' into datagrams
-        frame_size = self.packetize_encoded_frame()
+    def compress_frame(self, raw_img: RawImage):
+        frame_generation_ts = self.clock_()
+
+        # check if a key frame needs to be encoded
+        force_key = self.give_up_unacked()
+
+        # datagrams queued ahead of this frame (measured before packetizing it)
+        if self.telemetry_:
+            queued_bytes = sum(len(dgram.payload) for dgram in self.send_buf)
+
+        profiler = self.profiler_
+        stage_start_ns = time.monotonic_ns() if profiler else 0
+
+        live = not (self.bitstream_cache_ and self.bitstream_cache_.replaying(force_key))
+        if live:
+            # the encoder's references are older than the replayed frames
+            if self.bitstream_cache_ and self.bitstream_cache_.take_key_frame_request():
+                force_key = True
+
+            # encode raw_img into frame 'frame_id_'
+            encode_time_ms = self.encode_frame(raw_img, force_key)
+            if profiler:
+                stage_start_ns = profiler.add_since('encode', stage_start_ns)
+
+            # packetize frame 'frame_id_' into datagrams
+            frame_size = self.packetize_encoded_frame()
+            if profiler:
+                profiler.add_since('packetize', stage_start_ns)
+        else:
+            # packetize the cached encoding of this frame instead
+            encode_time_ms = 0.0
+            frame_size = self.replay_cached_frame()
+            if profiler:
+                profiler.add_since('replay', stage_start_ns)
+
+        if self.event_tracer_:
+            self.event_tracer_.record(Event.FRAME_ENCODED, self.frame_id_,
+                                      self.last_frag_cnt_, frame_generation_ts)
+
+        metrics = self.metrics_
+        if metrics:
+            metrics.frames.inc()
+            metrics.frame_bytes.inc(frame_size)
+            if self.last_frame_type_ == FrameType.KEY:
+                metrics.key_frames.inc()
 
         # output frame information
         if self.output_fd:
-            frame_encoded_ts = timestamp_us()
+            frame_encoded_ts = self.clock_()
 
             self.output_fd.write(f"{self.frame_id_},{self.target_bitrate_},{frame_size},\
                                  {frame_generation_ts},{frame_encoded_ts}\n")
 
+        if self.telemetry_:
+            self.record_telemetry(frame_size, frame_generation_ts,
+                                  encode_time_ms, queued_bytes, live)
+
         # move onto the next frame
         self.frame_id_ += 1
 
-    def encode_frame(self, raw_img: RawImage):
-        if raw_img.display_width() != self.display_width_ or \
-            raw_img.display_height() != self.display_height_:
-            raise RuntimeError("Encoder: image dimensions don't match")
-
-        # check if a key frame needs to be encoded
-        encode_flags = 0    # normal frame
+    def give_up_unacked(self) -> bool:
+        """Give up on datagrams unacked for too long.
 
+        Returns:
+            bool: True if the next frame must be a key frame
+        """
         if self.unacked:
             first_unacked = next(iter(self.unacked.values()))
 
             # give up if first unacked datagram was initially sent MAX_UNACKED_US ago
-            us_since_first_send = timestamp_us() - first_unacked.send_ts
+            us_since_first_send = self.clock_() - first_unacked.send_ts
 
             if us_since_first_send > self.MAX_UNACKED_US:
-                VPX_EFLAG_FORCE_KF = 1 << 0 
-                encode_flags = VPX_EFLAG_FORCE_KF #  force next frame to be key frame
-
                 print(f"* Recovery: gave up retransmissions and forced a key frame {self.frame_id_}")
 
                 if self.verbose_:
@@ -173,10 +262,33 @@ class Encoder:
                         f"frag_id={first_unacked.frag_id} rtx={first_unacked.num_rtx} "
                         f"us_since_first_send={us_since_first_send}")
 
+                if self.event_tracer_:
+                    self.event_tracer_.record(Event.GIVE_UP, first_unacked.frame_id,
+                                              first_unacked.frag_id, len(self.unacked))
+
+                if self.metrics_:
+                    self.metrics_.give_ups.inc()
+                    self.metrics_.datagrams_given_up.inc(len(self.unacked))
+
                 # clean up
                 self.send_buf.clear()
                 self.unacked.clear()
 
+                return True
+
+        return False
+
+    def encode_frame(self, raw_img: RawImage, force_key: bool = False):
+        if raw_img.display_width() != self.display_width_ or \
+            raw_img.display_height() != self.display_height_:
+            raise RuntimeError("Encoder: image dimensions don't match")
+
+        encode_flags = 0    # normal frame
+
+        if force_key:
+            VPX_EFLAG_FORCE_KF = 1 << 0 
+            encode_flags = VPX_EFLAG_FORCE_KF #  force next frame to be key frame
+
         # encode a frame and calculate encoding time
         encode_start = time.time()
         check_call(vpx_codec_encode(
@@ -194,21 +306,51 @@ class Encoder:
 
         # track stats in the current period
         self.num_encoded_frames += 1
-        self.total_encode_time_ms += encode_time_ms
-        self.max_encode_time_ms = max(self.max_encode_time_ms, encode_time_ms)
+        self.encode_time_hist_.record(round(encode_time_ms * 1000))
+
+        return encode_time_ms
+
+    def record_telemetry(self, frame_size: int, frame_generation_ts: int,
+                         encode_time_ms: float, queued_bytes: int, live: bool):
+        # quantizer chosen by the rate control for the last encoded frame
+        qp = c_int(-1)
+        if live:
+            self.codec_control(byref(self.context_), VP8E_GET_LAST_QUANTIZER, byref(qp))
+
+        # time for the datagrams queued ahead to drain at the target bitrate
+        queue_delay_us = 0
+        if self.target_bitrate_ > 0:
+            queue_delay_us = queued_bytes * 8 * 1000 // self.target_bitrate_
+
+        self.telemetry_.record(
+            frame_id=self.frame_id_,
+            target_bitrate=self.target_bitrate_,
+            frame_size=frame_size,
+            frag_cnt=self.last_frag_cnt_,
+            key=self.last_frame_type_ == FrameType.KEY,
+            qp=qp.value,
+            psnr=self.last_psnr_,
+            gen_ts=frame_generation_ts,
+            encode_time_us=int(encode_time_ms * 1000),
+            queue_delay_us=queue_delay_us)
 
     def packetize_encoded_frame(self):
         # read the encoded frame's "encoder packets" from 'context_'
         iter = c_void_p()
         frames_encoded = 0
         frame_size = 0
+        self.last_psnr_ = 0.0
 
         while True:
             encoder_pkt = vpx_codec_get_cx_data(byref(self.context_), byref(iter))
             if not encoder_pkt:
                 break
+
+            if encoder_pkt.contents.kind == VPX_CODEC_PSNR_PKT:
+                # overall PSNR of the frame (index 0; then Y, U and V)
+                self.last_psnr_ = encoder_pkt.contents.data.psnr.psnr[0]
                 
-            if encoder_pkt.contents.kind == 0: # VPX_CODEC_CX_FRAME_PKT:  
+            elif encoder_pkt.contents.kind == 0: # VPX_CODEC_CX_FRAME_PKT:  
                 frames_encoded += 1
 
                 # there should be exactly one frame encoded
@@ -226,9 +368,6 @@ class Encoder:
                     if self.verbose_:
                         print(f"Encoded a {frame_type} frame: frame_id={self.frame_id_}")
 
-                # total fragments to divide this frame into
-                frag_cnt = narrow_cast(int, (frame_size // (Datagram.max_payload + 1)) + 1)
-                
                 # next address to copy compressed frame data from
                 buf_ptr = cast(
                     encoder_pkt.contents.data.frame.buf,
@@ -237,25 +376,52 @@ class Encoder:
                 
                 # Create a memoryview for efficient slicing
                 buffer = memoryview(buf_ptr.contents)
-                
-                # Split into fragments
-                for frag_id in range(frag_cnt):
-                    # calculate payload size and construct the payload
-                    start = frag_id * Datagram.max_payload
-                    end = min(start + Datagram.max_payload, frame_size)
-                    payload = bytes(buffer[start:end])
-                    
-                    # enqueue a datagram
-                    dgram = Datagram(
-                        frame_id=self.frame_id_,
-                        frame_type=frame_type,
-                        frag_id=frag_id,
-                        frag_cnt=frag_cnt,
-                        payload=payload
-                    )
-                    self.send_buf.append(dgram)
+
+                self.packetize_frame(buffer, frame_type)
+
+                # the cache records (or keeps track of) every live frame
+                if self.bitstream_cache_:
+                    self.bitstream_cache_.add_live_frame(buffer, frame_type)
 
         return frame_size
+
+    def replay_cached_frame(self):
+        buffer, frame_type = self.bitstream_cache_.next_frame()
+        self.last_psnr_ = 0.0
+
+        self.packetize_frame(buffer, frame_type)
+        self.num_replayed_frames += 1
+
+        return len(buffer)
+
+    def packetize_frame(self, buffer: memoryview, frame_type: FrameType):
+        frame_size = len(buffer)
+
+        # total fragments to divide this frame into (ceil division)
+        frag_cnt = narrow_cast(int, max(1, -(-frame_size // Datagram.max_payload)))
+
+        self.last_frame_type_ = frame_type
+        self.last_frag_cnt_ = frag_cnt
+
+        # Split into fragments
+        for frag_id in range(frag_cnt):
+            # calculate payload size and construct the payload
+            start = frag_id * Datagram.max_payload
+            end = min(start + Datagram.max_payload, frame_size)
+            payload = bytes(buffer[start:end])
+            
+            # enqueue a datagram
+            dgram = Datagram(
+                frame_id=self.frame_id_,
+                frame_type=frame_type,
+                frag_id=frag_id,
+                frag_cnt=frag_cnt,
+                payload=payload
+            )
+            self.send_buf.append(dgram)
+
+        if self.ivf_writer_:
+            self.ivf_writer_.write_frame(buffer, self.frame_id_, frame_type == FrameType.KEY)
     
 
     def add_unacked(self, datagram: Datagram):
@@ -265,14 +431,22 @@ class Encoder:
 
         self.unacked[seq_num] = datagram
         self.unacked[seq_num].last_send_ts = datagram.send_ts
+        self.unacked[seq_num].first_send_ts = datagram.send_ts
 
     
     def handle_ack(self, ack: 'AckMsg'):
-        curr_ts = timestamp_us()
+        curr_ts = self.clock_()
 
         # observed an RTT sample
         self.add_rtt_sample(curr_ts - ack.send_ts)
 
+        if self.event_tracer_:
+            self.event_tracer_.record(Event.ACK, ack.frame_id, ack.frag_id, curr_ts - ack.send_ts)
+
+        metrics = self.metrics_
+        if metrics:
+            metrics.acks.inc()
+
         # find the acked datagram in 'unacked'
         acked_seq_num = (ack.frame_id, ack.frag_id)
         acked_it = self.unacked.get(acked_seq_num)
@@ -281,8 +455,12 @@ class Encoder:
             # do nothing else if ACK is not for an unacked datagram
             return
 
-        # retransmit all unacked datagrams before the acked one (backward)
-        for seq_num, datagram in reversed(list(self.unacked.items())):
+        self.ack_delay_hist_.record(curr_ts - acked_it.first_send_ts)
+
+        # retransmit all unacked datagrams before the acked one, i.e. the
+        # ones sent earlier ('unacked' is in send order)
+        rtx = []
+        for seq_num, datagram in self.unacked.items():
             if seq_num == acked_seq_num:
                 break
 
@@ -294,15 +472,20 @@ class Encoder:
             if datagram.num_rtx == 0 or curr_ts - datagram.last_send_ts > self.ewma_rtt_us:
                 datagram.num_rtx += 1
                 datagram.last_send_ts = curr_ts
+                rtx.append(datagram)
 
-                # retransmissions are more urgent
-                self.send_buf.appendleft(datagram)
+        # retransmissions are more urgent; the oldest goes out first
+        self.send_buf.extendleft(reversed(rtx))
+        if metrics and rtx:
+            metrics.rtx_queued.inc(len(rtx))
 
         # finally, erase the acked datagram from 'unacked'
         del self.unacked[acked_seq_num]
 
     
     def add_rtt_sample(self, rtt_us: int):
+        self.rtt_hist_.record(rtt_us)
+
         # min RTT
         if self.min_rtt_us is None or rtt_us < self.min_rtt_us:
             self.min_rtt_us = rtt_us
@@ -317,20 +500,56 @@ class Encoder:
     def output_periodic_stats(self):
         print(f"Frames encoded in the last ~1s: {self.num_encoded_frames}")
 
-        if self.num_encoded_frames > 0:
-            avg_encode_time = self.total_encode_time_ms / self.num_encoded_frames
-            print(f" - Avg/Max encoding time (ms): {avg_encode_time:.2f}/{self.max_encode_time_ms:.2f}")
+        if self.encode_time_hist_.count() > 0:
+            print(f" - Avg/Max encoding time (ms): {self.encode_time_hist_.mean() / 1000:.2f}/"
+                  f"{self.encode_time_hist_.max() / 1000:.2f}")
+            print(f" - Encoding time (ms): {self.encode_time_hist_.format()}")
+
+        if self.num_replayed_frames > 0:
+            print(f" - Frames replayed from bitstream cache: {self.num_replayed_frames}")
         
         if self.min_rtt_us and self.ewma_rtt_us:
             print(f" - Min/EWMA RTT (ms): {(self.min_rtt_us / 1000.0):.2f}/{(self.ewma_rtt_us / 1000.0):.2f}")
 
-        # reset all but RTT-related stats
+        if self.rtt_hist_.count() > 0:
+            print(f" - RTT (ms): {self.rtt_hist_.format()}")
+        if self.ack_delay_hist_.count() > 0:
+            print(f" - ACK delay (ms): {self.ack_delay_hist_.format()}")
+
+        if self.stats_fd_:
+            self.stats_fd_.write(json.dumps({
+                'ts': self.clock_(),
+                'encoded_frames': self.num_encoded_frames,
+                'replayed_frames': self.num_replayed_frames,
+                'encode_time_us': self.encode_time_hist_.summary(),
+                'rtt_us': self.rtt_hist_.summary(),
+                'ack_delay_us': self.ack_delay_hist_.summary(),
+            }) + "\n")
+
+        # write out the telemetry recorded in the last period
+        if self.telemetry_:
+            self.telemetry_.flush()
+
+        # the exported histograms are cumulative
+        if self.metrics_:
+            self.metrics_.encode_time_total.merge(self.encode_time_hist_)
+            self.metrics_.rtt_total.merge(self.rtt_hist_)
+            self.metrics_.ack_delay_total.merge(self.ack_delay_hist_)
+
+        # reset all but the min and EWMA RTT
         self.num_encoded_frames = 0
-        self.total_encode_time_ms = 0.0
-        self.max_encode_time_ms = 0.0
+        self.num_replayed_frames = 0
+        self.encode_time_hist_.reset()
+        self.rtt_hist_.reset()
+        self.ack_delay_hist_.reset()
 
 
     def set_target_bitrate(self, bitrate_kbps: int):
+        # cached frames were encoded at a different bitrate
+        if self.bitstream_cache_ and bitrate_kbps != self.target_bitrate_:
+            print("Bitstream cache: disabled after a target bitrate change")
+            self.bitstream_cache_ = None
+
         self.target_bitrate_ = bitrate_kbps
         
         self.cfg_.rc_target_bitrate = bitrate_kbps
@@ -340,6 +559,90 @@ class Encoder:
                    VPX_CODEC_OK, "set_target_bitrate") 
         
 
+    def set_ivf_output(self, ivf_path: str) -> None:
+        """Record every sent frame to an IVF file (with a side index)."""
+        self.ivf_writer_ = IVFWriter(ivf_path, self.display_width_,
+                                     self.display_height_, self.frame_rate_)
+
+
+    def set_stats_output(self, stats_path: str) -> None:
+        """Also write the periodic stats, with latency percentiles, to stats_path
+        as one JSON object per line."""
+        self.stats_fd_ = FileDescriptor(check_syscall(
+            os.open(stats_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)))
+
+
+    def set_metrics(self, registry: MetricsRegistry) -> None:
+        """Export frame, ACK, retransmission and RTT metrics and the queue
+        depths of the encoder through 'registry'."""
+        self.metrics_ = SimpleNamespace(
+            frames=registry.counter('frames_encoded_total',
+                                    'Frames encoded or replayed from the bitstream cache'),
+            key_frames=registry.counter('key_frames_encoded_total', 'Key frames encoded'),
+            frame_bytes=registry.counter('encoded_bytes_total', 'Bytes of encoded frames'),
+            acks=registry.counter('acks_received_total', 'ACKs received'),
+            rtx_queued=registry.counter('retransmissions_queued_total',
+                                        'Datagrams queued for retransmission'),
+            give_ups=registry.counter('give_ups_total',
+                                      'Times retransmissions were given up for a key frame'),
+            datagrams_given_up=registry.counter('datagrams_given_up_total',
+                                                'Unacked datagrams given up on'),
+            # latencies of the periods output so far
+            encode_time_total=LatencyHistogram(),
+            rtt_total=LatencyHistogram(),
+            ack_delay_total=LatencyHistogram(),
+        )
+        metrics = self.metrics_
+
+        # read only when scraped
+        registry.histogram('encode_time_seconds', 'Time to encode a frame',
+                           fn=lambda: (metrics.encode_time_total, self.encode_time_hist_))
+        registry.histogram('rtt_seconds', 'RTT samples',
+                           fn=lambda: (metrics.rtt_total, self.rtt_hist_))
+        registry.histogram('ack_delay_seconds', "From a datagram's first transmission to its ACK",
+                           fn=lambda: (metrics.ack_delay_total, self.ack_delay_hist_))
+        registry.gauge('send_queue_datagrams', 'Datagrams waiting to be sent',
+                       lambda: len(self.send_buf))
+        registry.gauge('unacked_datagrams', 'Datagrams sent but not acked yet',
+                       lambda: len(self.unacked))
+        registry.gauge('target_bitrate_kbps', 'Target bitrate of the encoder',
+                       lambda: self.target_bitrate_)
+        registry.gauge('min_rtt_seconds', 'Minimum RTT',
+                       lambda: (self.min_rtt_us or 0) / 1e6)
+        registry.gauge('ewma_rtt_seconds', 'EWMA of the RTT',
+                       lambda: (self.ewma_rtt_us or 0) / 1e6)
+
+
+    def set_profiler(self, profiler: StageProfiler) -> None:
+        """Time encoding, packetizing and replaying frames as stages of 'profiler'."""
+        self.profiler_ = profiler
+
+
+    def set_event_tracer(self, event_tracer: EventTracer) -> None:
+        """Record encoded frames, ACKs and give-ups to a per-packet event trace."""
+        self.event_tracer_ = event_tracer
+
+
+    def set_bitstream_cache(self, cache_dir: str, clip_path: str, num_frames: int) -> None:
+        """Replay encoded frames of a looping clip from a cache in cache_dir;
+        the clip must be sent from its first frame."""
+        self.bitstream_cache_ = BitstreamCache(
+            cache_dir, clip_path, self.display_width_, self.display_height_,
+            self.frame_rate_, self.target_bitrate_, self.encoder_profile(), num_frames)
+
+
+    def skip_frames(self, num_frames: int) -> None:
+        """Keep track of raw frames the video input skipped without sending them."""
+        if self.bitstream_cache_ and not self.bitstream_cache_.skip(num_frames):
+            print("Bitstream cache: disabled after skipping frames while recording")
+            self.bitstream_cache_ = None
+
+
+    def encoder_profile(self) -> bytes:
+        """Settings that determine the encoder output besides its input."""
+        return bytes(self.cfg_) + struct.pack('<I', self.cpu_used_)
+
+
     def set_verbose(self, verbose: bool) -> None:
         """Set verbose flag for decoder."""
         self.verbose_ = verbose
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from event_trace import EventTracer, Event
+from utils.conversion import double_to_string
+
+# per-frame stages, in order, and the columns of the per-frame CSV
+STAGES = ['encode', 'sender_queue', 'sending', 'transit', 'in_order_wait', 'total']
+TIMELINE_COLUMNS = ['second', 'sends', 'rtx', 'acks', 'give_ups', 'rtt_p50_ms']
+
+
+def print_usage(program_name: str) -> None:
+    usage_msg = f"""Usage: {program_name} [options] sender_trace [receiver_trace]
+
+Analyzes the per-packet event traces recorded by video_sender.py and
+video_receiver.py (or session_sim.py) with --event-trace: per-frame latency
+breakdown, a per-second timeline of retransmissions and queueing delay.
+The stages that span both traces assume that both endpoints share a clock,
+i.e. run on the same host or in the simulator.
+
+Options:
+    --output <prefix>    write <prefix>.frames.csv and <prefix>.timeline.csv
+"""
+    print(usage_msg, file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Analyze per-packet event traces of the sender and receiver')
+    parser.add_argument('sender_trace', help="Sender's event trace")
+    parser.add_argument('receiver_trace', nargs='?', help="Receiver's event trace")
+    parser.add_argument('--output', metavar='PREFIX',
+                        help='Write <PREFIX>.frames.csv and <PREFIX>.timeline.csv')
+
+    return parser.parse_args()
+
+
+def load(path: str, role: str) -> np.ndarray:
+    trace_role, events = EventTracer.load(path)
+    if trace_role != role:
+        raise RuntimeError(f"{path}: expected a {role} trace, got a {trace_role} trace")
+
+    return events
+
+
+def per_frame(frame_ids: np.ndarray, events: np.ndarray, values: np.ndarray,
+              reduce: np.ufunc) -> np.ndarray:
+    """Reduce 'values' of 'events' by frame into an array aligned with 'frame_ids'.
+
+    Args:
+        frame_ids: sorted unique frame ids
+        reduce: np.fmin or np.fmax, which skip the initial NaN
+    Returns:
+        float64 array with NaN for frames without any event
+    """
+    out = np.full(len(frame_ids), np.nan)
+    idx, known = frame_index(frame_ids, events)
+    reduce.at(out, idx[known], values[known].astype(np.float64))
+    return out
+
+
+def frame_index(frame_ids: np.ndarray, events: np.ndarray):
+    """Index of the frame of each event in the sorted 'frame_ids', and whether it is there."""
+    if len(frame_ids) == 0:
+        return np.zeros(len(events), dtype=np.int64), np.zeros(len(events), dtype=bool)
+
+    idx = np.minimum(np.searchsorted(frame_ids, events['frame_id']), len(frame_ids) - 1)
+    return idx, frame_ids[idx] == events['frame_id']
+
+
+def frame_breakdown(sender: np.ndarray, receiver: Optional[np.ndarray]) -> Dict[str, np.ndarray]:
+    """Latency of each stage of every encoded frame in us (NaN where unknown)."""
+    encoded = sender[sender['event'] == Event.FRAME_ENCODED]
+    encoded = encoded[np.argsort(encoded['frame_id'], kind='stable')]
+    frame_ids = encoded['frame_id']
+
+    sends = sender[sender['event'] == Event.SEND]
+    all_sends = sender[(sender['event'] == Event.SEND) | (sender['event'] == Event.RTX)]
+    first_send = per_frame(frame_ids, sends, sends['ts'], np.fmin)
+    last_first_send = per_frame(frame_ids, sends, sends['ts'], np.fmax)
+
+    generation_ts = encoded['value'].astype(np.float64)
+    encoded_ts = encoded['ts'].astype(np.float64)
+
+    columns = {
+        'frame_id': frame_ids.astype(np.float64),
+        'frag_cnt': encoded['frag_id'].astype(np.float64),
+        'encode': encoded_ts - generation_ts,
+        'sender_queue': first_send - encoded_ts,
+        'sending': last_first_send - first_send,
+    }
+
+    idx, known = frame_index(frame_ids, sender[sender['event'] == Event.RTX])
+    columns['num_rtx'] = np.bincount(idx[known], minlength=len(frame_ids)).astype(np.float64)
+
+    nan = np.full(len(frame_ids), np.nan)
+    if receiver is None:
+        columns.update(transit=nan, in_order_wait=nan, total=nan)
+        return columns
+
+    decodable = receiver[receiver['event'] == Event.FRAME_DECODABLE]
+    complete_ts = per_frame(frame_ids, decodable, decodable['value'], np.fmax)
+    decodable_ts = per_frame(frame_ids, decodable, decodable['ts'], np.fmax)
+
+    # the last fragment arrived from the last (re)transmission before the
+    # frame completed; later ones (e.g. after a lost ACK) were spurious
+    idx, known = frame_index(frame_ids, all_sends)
+    delivering = known.copy()
+    delivering[known] = all_sends['ts'][known] <= complete_ts[idx[known]]
+    last_send = per_frame(frame_ids, all_sends[delivering], all_sends['ts'][delivering], np.fmax)
+
+    columns['transit'] = complete_ts - last_send
+    columns['in_order_wait'] = decodable_ts - complete_ts
+    columns['total'] = decodable_ts - generation_ts
+    return columns
+
+
+def rtx_timeline(sender: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-second counts of sends, retransmissions, ACKs and give-ups, and the RTT."""
+    if len(sender) == 0:
+        return {name: np.zeros(0) for name in TIMELINE_COLUMNS}
+
+    second = ((sender['ts'] - sender['ts'].min()) // 1000000).astype(np.int64)
+    num_seconds = int(second.max()) + 1
+
+    def count(event: Event, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        mask = sender['event'] == event
+        return np.bincount(second[mask], None if weights is None else weights[mask],
+                           minlength=num_seconds)
+
+    acks = sender['event'] == Event.ACK
+    ack_seconds = second[acks]
+    rtts = sender['value'][acks]
+    order = np.argsort(ack_seconds, kind='stable')
+    bounds = np.searchsorted(ack_seconds[order], np.arange(num_seconds + 1))
+    rtt_p50 = np.array([np.median(rtts[order][bounds[i]:bounds[i + 1]]) / 1000
+                        if bounds[i + 1] > bounds[i] else np.nan
+                        for i in range(num_seconds)])
+
+    return {
+        'second': np.arange(num_seconds, dtype=np.float64),
+        'sends': count(Event.SEND).astype(np.float64),
+        'rtx': count(Event.RTX).astype(np.float64),
+        'acks': count(Event.ACK).astype(np.float64),
+        'give_ups': count(Event.GIVE_UP, sender['value'].astype(np.float64)),
+        'rtt_p50_ms': rtt_p50,
+    }
+
+
+def queueing_delays(sender: np.ndarray, receiver: Optional[np.ndarray]) -> Dict[str, np.ndarray]:
+    """Per-datagram delays in us: from the frame being encoded to the datagram's
+    first transmission, and from any transmission to its reception."""
+    encoded = sender[sender['event'] == Event.FRAME_ENCODED]
+    encoded = encoded[np.argsort(encoded['frame_id'], kind='stable')]
+
+    sends = sender[sender['event'] == Event.SEND]
+    idx, known = frame_index(encoded['frame_id'], sends)
+    delays = {'sender_queue': sends['ts'][known].astype(np.float64)
+                              - encoded['ts'][idx[known]]}
+
+    if receiver is not None:
+        received = receiver[receiver['event'] == Event.RECV]
+        delays['one_way'] = received['ts'].astype(np.float64) - received['value']
+
+    return {name: values[~np.isnan(values)] for name, values in delays.items()}
+
+
+def format_percentiles(values_us: np.ndarray) -> str:
+    p50, p90, p99 = np.percentile(values_us / 1000, [50, 90, 99])
+    return (f"p50 {double_to_string(p50)}, p90 {double_to_string(p90)}, "
+            f"p99 {double_to_string(p99)}, max {double_to_string(values_us.max() / 1000)}")
+
+
+def write_csv(path: str, columns: Dict[str, np.ndarray], names: List[str]) -> None:
+    np.savetxt(path, np.column_stack([columns[name] for name in names]),
+               delimiter=',', header=','.join(names), comments='', fmt='%.15g')
+
+
+def main():
+    args = parse_arguments()
+
+    sender = load(args.sender_trace, 'sender')
+    receiver = load(args.receiver_trace, 'receiver') if args.receiver_trace else None
+
+    frames = frame_breakdown(sender, receiver)
+    timeline = rtx_timeline(sender)
+    delays = queueing_delays(sender, receiver)
+
+    num_frames = len(frames['frame_id'])
+    print(f"Frames: encoded {num_frames}, retransmitted "
+          f"{int(np.count_nonzero(frames['num_rtx']))}", end='')
+    if receiver is not None:
+        print(f", decodable {int(np.count_nonzero(~np.isnan(frames['total'])))}, "
+              f"skipped {int(receiver['value'][receiver['event'] == Event.FRAME_SKIP].sum())}")
+    else:
+        print()
+
+    print("Per-frame latency breakdown (ms):")
+    for stage in STAGES:
+        values = frames[stage][~np.isnan(frames[stage])]
+        if len(values):
+            print(f"  {stage}: {format_percentiles(values)}")
+
+    print(f"Datagrams: sent {int(timeline['sends'].sum())}, "
+          f"retransmitted {int(timeline['rtx'].sum())}, acked {int(timeline['acks'].sum())}, "
+          f"given up {int(timeline['give_ups'].sum())}")
+    print("Queueing delay (ms):")
+    for name, values in delays.items():
+        if len(values):
+            print(f"  {name}: {format_percentiles(values)}")
+
+    if args.output:
+        write_csv(f"{args.output}.frames.csv", frames,
+                  ['frame_id', 'frag_cnt', 'num_rtx'] + STAGES)
+        write_csv(f"{args.output}.timeline.csv", timeline, TIMELINE_COLUMNS)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import os
+import signal
+import atexit
+import struct
+import threading
+from enum import IntEnum
+from typing import Callable, Tuple
+
+import numpy as np
+
+from utils.file_descriptor import FileDescriptor
+from utils.exception_rim import check_syscall
+from utils.timestamp import timestamp_us
+
+
+class Event(IntEnum):
+    """Per-packet events and what the value of their record holds."""
+    # sender
+    FRAME_ENCODED = 0    # frame packetized; frag_id: fragment count, value: generation ts
+    SEND = 1             # first transmission of a datagram; value: datagram size
+    RTX = 2              # retransmission of a datagram; value: datagram size
+    ACK = 3              # ACK received; value: RTT sample (us)
+    GIVE_UP = 4          # unacked datagrams dropped, from the oldest on; value: how many
+    # receiver
+    RECV = 5             # datagram received; value: its send ts
+    FRAME_DECODABLE = 6  # frame handed off in order; frag_id: fragment count, value: complete ts
+    FRAME_SKIP = 7       # recovery skipped ahead to frame_id; value: frames skipped
+
+
+class EventTracer:
+    """Binary per-packet event records of one endpoint (sender or receiver).
+
+    The file starts with HEADER and is followed by one RECORD per event.
+    Records are packed into a fixed ring of CAPACITY records by the thread
+    that runs the endpoint's loop (the only producer) and written out in
+    bulk by a background thread, woken every FLUSH_RECORDS records and at
+    least every FLUSH_INTERVAL_S. Recording costs a clock read and a
+    struct.pack_into(); if the writer falls a whole ring behind, events are
+    dropped and counted rather than blocking the loop.
+    """
+    MAGIC = b"RMEVENT1"
+
+    # magic, role (see ROLES), record size
+    HEADER = struct.Struct('<8sBxH')
+    ROLES = ['sender', 'receiver']
+
+    # ts (us), frame_id, frag_id, event, padding, value
+    RECORD = struct.Struct('<QIHBxq')
+
+    # numpy view of RECORD, used by load()
+    DTYPE = np.dtype([
+        ('ts', '<u8'),
+        ('frame_id', '<u4'),
+        ('frag_id', '<u2'),
+        ('event', 'u1'),
+        ('pad', 'u1'),
+        ('value', '<i8'),
+    ])
+
+    CAPACITY = 1 << 16       # records in the ring (1.5 MB)
+    FLUSH_RECORDS = 1 << 12  # records per wake-up of the writer
+    FLUSH_INTERVAL_S = 1.0
+
+    def __init__(self, output_path: str, role: str,
+                 clock: Callable[[], int] = timestamp_us):
+        self.fd_ = FileDescriptor(check_syscall(
+            os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)))
+        os.write(self.fd_.fd_num(), self.HEADER.pack(
+            self.MAGIC, self.ROLES.index(role), self.RECORD.size))
+
+        self.clock_ = clock
+        self.buf_ = bytearray(self.RECORD.size * self.CAPACITY)
+
+        # records ever recorded and ever written; only the producer moves
+        # head_ and only the writer moves tail_
+        self.head_ = 0
+        self.tail_ = 0
+        self.num_dropped_ = 0
+
+        self.wakeup_ = threading.Event()
+        self.closed_ = False
+        self.writer_ = threading.Thread(target=self.writer_main, daemon=True)
+        self.writer_.start()
+
+    def record(self, event: Event, frame_id: int, frag_id: int = 0, value: int = 0) -> None:
+        head = self.head_
+        if head - self.tail_ == self.CAPACITY:
+            self.num_dropped_ += 1
+            return
+
+        self.RECORD.pack_into(self.buf_, (head % self.CAPACITY) * self.RECORD.size,
+                              self.clock_(), frame_id, frag_id, event, value)
+        self.head_ = head + 1
+
+        if self.head_ % self.FLUSH_RECORDS == 0:
+            self.wakeup_.set()
+
+    def num_dropped(self) -> int:
+        return self.num_dropped_
+
+    def writer_main(self) -> None:
+        while not self.closed_:
+            self.wakeup_.wait(self.FLUSH_INTERVAL_S)
+            self.wakeup_.clear()
+            self.write_pending()
+
+    def write_pending(self) -> None:
+        head = self.head_
+        tail = self.tail_
+
+        # the pending records wrap around the end of the ring at most once
+        while tail < head:
+            start = tail % self.CAPACITY
+            end = min(start + head - tail, self.CAPACITY)
+
+            data = memoryview(self.buf_)[start * self.RECORD.size:end * self.RECORD.size]
+            while data:
+                data = data[os.write(self.fd_.fd_num(), data):]
+
+            tail += end - start
+            self.tail_ = tail
+
+    def close(self) -> None:
+        """Write out the pending records and stop the writer."""
+        if self.closed_:
+            return
+
+        self.closed_ = True
+        self.wakeup_.set()
+        self.writer_.join()
+        self.write_pending()
+        self.fd_.close()
+
+        if self.num_dropped_:
+            print(f"Event trace: dropped {self.num_dropped_} events on a full ring")
+
+    def close_at_exit(self) -> None:
+        """Close the trace when the process exits, including on SIGTERM."""
+        atexit.register(self.close)
+
+        def handle_sigterm(signum, frame):
+            self.close()
+            # terminate as if there were no handler
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+    @classmethod
+    def load(cls, path: str) -> Tuple[str, np.ndarray]:
+        """Load a trace into its role and a numpy structured array (see DTYPE)."""
+        with open(path, 'rb') as f:
+            magic, role, record_size = cls.HEADER.unpack(f.read(cls.HEADER.size))
+
+        if magic != cls.MAGIC or record_size != cls.DTYPE.itemsize or role >= len(cls.ROLES):
+            raise RuntimeError("EventTracer: invalid event trace")
+
+        return cls.ROLES[role], np.fromfile(path, dtype=cls.DTYPE, offset=cls.HEADER.size)
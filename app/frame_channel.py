@@ -0,0 +1,205 @@
+import struct
+from collections import deque
+from ctypes import c_ubyte, addressof, memmove
+from multiprocessing import shared_memory
+from typing import Deque, List, Optional, Tuple
+
+from utils.eventfd import Eventfd
+from protocol import FrameType
+
+
+class ChannelFrame:
+    """A complete frame that is decoded in place from a FrameChannel.
+
+    Quacks like a complete Frame as far as Decoder.decode_frame() and the
+    worker are concerned; release() hands its slot back to the producer.
+    """
+    def __init__(self, channel: 'FrameChannel', frame_id: int, frame_type: FrameType,
+                 offset: int, frame_size: int, end: int, render: bool, queued_ts: int):
+        self.channel_ = channel
+        self.id_ = frame_id
+        self.type_ = frame_type
+        self.offset_ = offset
+        self.frame_size_ = frame_size
+        self.end_ = end
+        self.render_ = render
+        self.queued_ts_ = queued_ts
+
+    def id(self) -> int:
+        return self.id_
+
+    def type(self) -> FrameType:
+        return self.type_
+
+    def complete(self) -> bool:
+        return True
+
+    def frame_size(self) -> int:
+        return self.frame_size_
+
+    def render(self) -> bool:
+        return self.render_
+
+    def queued_ts(self) -> int:
+        return self.queued_ts_
+
+    def buffer(self):
+        return (c_ubyte * self.frame_size_).from_address(
+            self.channel_.data_address_ + self.offset_)
+
+    def release(self) -> None:
+        self.channel_.release(self.end_)
+
+
+class FrameChannel:
+    """Single-producer, single-consumer ring of complete frames in shared memory.
+
+    The network process copies every decodable frame into the ring and rings
+    an eventfd doorbell; the decoder process decodes it in place and frees
+    its slot by advancing the tail. No lock is shared: 'head' is written by
+    the producer only and 'tail' by the consumer only. Both are positions
+    in a stream of records that never wraps; a record that would cross the
+    end of the ring is preceded by a WRAP record and starts over at 0.
+    Frames must be released in the order they are received.
+    """
+    # each position lives on its own cache line
+    HEAD_OFFSET = 0
+    TAIL_OFFSET = 64
+    CLOSED_OFFSET = 128
+    DATA_OFFSET = 256
+    POSITION = struct.Struct('<Q')
+
+    # frame size, frame id, frame type, render flag, time handed to the
+    # worker in us (padded to ALIGNMENT)
+    RECORD = struct.Struct('<IIBB6xQ8x')
+    ALIGNMENT = 16
+    WRAP = 0xFFFFFFFF  # frame size of a record that skips to the start
+
+    DEFAULT_CAPACITY = 32 * 1024 * 1024  # 32 MB
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity_ = self.align(capacity)
+        # shared memory is zero-filled: head = tail = 0, not closed
+        self.shm_ = shared_memory.SharedMemory(create=True,
+                                               size=self.DATA_OFFSET + self.capacity_)
+        self.buf_ = self.shm_.buf
+        self.view_ = (c_ubyte * self.capacity_).from_buffer(self.buf_, self.DATA_OFFSET)
+        self.data_address_ = addressof(self.view_)
+
+        self.doorbell_ = Eventfd()
+
+        # producer side: frames waiting for room in the ring
+        self.head_ = 0
+        self.pending_: Deque[Tuple[int, FrameType, bytes, bool, int]] = deque()
+
+        # consumer side: position of the next record to read
+        self.read_pos_ = 0
+
+    @classmethod
+    def align(cls, size: int) -> int:
+        return -(-size // cls.ALIGNMENT) * cls.ALIGNMENT
+
+    def load(self, offset: int) -> int:
+        return self.POSITION.unpack_from(self.buf_, offset)[0]
+
+    def store(self, offset: int, value: int) -> None:
+        self.POSITION.pack_into(self.buf_, offset, value)
+
+    # producer
+
+    def send(self, frame) -> None:
+        """Copy a complete frame into the ring, or queue it while the ring is full."""
+        if self.pending_ or not self.push(frame.id(), frame.type(), frame.buffer(),
+                                          frame.frame_size(), frame.render(),
+                                          frame.queued_ts()):
+            self.pending_.append((frame.id(), frame.type(), bytes(frame.payload()),
+                                  frame.render(), frame.queued_ts()))
+            self.flush()
+
+    def flush(self) -> None:
+        """Move frames queued while the ring was full into the ring."""
+        while self.pending_:
+            frame_id, frame_type, payload, render, queued_ts = self.pending_[0]
+            if not self.push(frame_id, frame_type, payload, len(payload), render, queued_ts):
+                break
+            self.pending_.popleft()
+
+    def push(self, frame_id: int, frame_type: FrameType, payload, size: int,
+             render: bool = True, queued_ts: int = 0) -> bool:
+        record_size = self.RECORD.size + self.align(size)
+        # a record no larger than half the ring always fits once it drains
+        if record_size > self.capacity_ // 2:
+            raise RuntimeError("frame is too large for the frame channel")
+
+        pos = self.head_ % self.capacity_
+        skip = self.capacity_ - pos if self.capacity_ - pos < record_size else 0
+
+        if self.head_ + skip + record_size - self.load(self.TAIL_OFFSET) > self.capacity_:
+            return False
+
+        if skip:
+            self.RECORD.pack_into(self.buf_, self.DATA_OFFSET + pos, self.WRAP, 0, 0, 0, 0)
+            pos = 0
+
+        memmove(self.data_address_ + pos + self.RECORD.size, payload, size)
+        self.RECORD.pack_into(self.buf_, self.DATA_OFFSET + pos,
+                              size, frame_id, frame_type.value, render, queued_ts)
+
+        # publish the record, then wake up the consumer
+        self.head_ += skip + record_size
+        self.store(self.HEAD_OFFSET, self.head_)
+        self.doorbell_.notify()
+
+        return True
+
+    def num_pending(self) -> int:
+        return len(self.pending_)
+
+    def shutdown(self) -> None:
+        """Tell the consumer to exit once it has drained the ring."""
+        self.store(self.CLOSED_OFFSET, 1)
+        self.doorbell_.notify()
+
+    def destroy(self) -> None:
+        del self.view_
+        self.buf_ = None
+        self.shm_.close()
+        self.shm_.unlink()
+
+    # consumer
+
+    def receive(self) -> Optional[List[ChannelFrame]]:
+        """Block until frames arrive; return None once shut down and drained."""
+        while True:
+            frames = self.poll_frames()
+            if frames:
+                return frames
+
+            if self.load(self.CLOSED_OFFSET):
+                return None
+
+            self.doorbell_.read_count()
+
+    def poll_frames(self) -> List[ChannelFrame]:
+        head = self.load(self.HEAD_OFFSET)
+
+        frames = []
+        while self.read_pos_ < head:
+            pos = self.read_pos_ % self.capacity_
+            size, frame_id, frame_type, render, queued_ts = self.RECORD.unpack_from(
+                self.buf_, self.DATA_OFFSET + pos)
+
+            if size == self.WRAP:
+                self.read_pos_ += self.capacity_ - pos
+                continue
+
+            end = self.read_pos_ + self.RECORD.size + self.align(size)
+            frames.append(ChannelFrame(self, frame_id, FrameType(frame_type),
+                                       pos + self.RECORD.size, size, end, bool(render),
+                                       queued_ts))
+            self.read_pos_ = end
+
+        return frames
+
+    def release(self, end: int) -> None:
+        self.store(self.TAIL_OFFSET, end)
@@ -0,0 +1,179 @@
+import random
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from utils.conversion import double_to_string
+
+
+class LinkParams:
+    """Impairments of one direction of a link.
+
+    Loss follows a Gilbert-Elliott model: before each packet the link moves
+    from the good to the bad state with probability 'p_good_bad' and back
+    with 'p_bad_good', then loses the packet with probability 'loss' (good)
+    or 'loss_bad' (bad). With the default transition probabilities the link
+    never leaves the good state, i.e. loss is random.
+    """
+    def __init__(self, rate_kbps: float = 0.0, queue_bytes: int = 0,
+                 delay_ms: float = 0.0, jitter_ms: float = 0.0,
+                 loss: float = 0.0, p_good_bad: float = 0.0, p_bad_good: float = 1.0,
+                 loss_bad: float = 1.0, reorder: float = 0.0):
+        """
+        Args:
+            rate_kbps: bandwidth cap (0: unlimited)
+            queue_bytes: bytes the bottleneck queue holds before dropping (0: unlimited)
+            delay_ms: one-way propagation delay
+            jitter_ms: maximum deviation from 'delay_ms', drawn uniformly
+            reorder: probability that a packet skips the propagation delay
+        """
+        self.rate_kbps = rate_kbps
+        self.queue_bytes = queue_bytes
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.p_good_bad = p_good_bad
+        self.p_bad_good = p_bad_good
+        self.loss_bad = loss_bad
+        self.reorder = reorder
+
+    def update(self, **params) -> None:
+        for name, value in params.items():
+            if not hasattr(self, name):
+                raise RuntimeError(f"unknown link parameter: {name}")
+            setattr(self, name, type(getattr(self, name))(value))
+
+    def __repr__(self) -> str:
+        return ", ".join(f"{name}={value}" for name, value in vars(self).items())
+
+
+class ImpairedLink:
+    """One direction of an emulated link: loss, a rate-limited queue, then delay.
+
+    Packets are handed in with send() and come out of deliver() once their
+    delivery time has passed. Delivery order is kept unless a packet is
+    picked for reordering, in which case it skips the propagation delay and
+    overtakes the packets ahead of it. Delivery times within each of the
+    two paths never decrease, so both are plain FIFOs that deliver() merges.
+    Times are in microseconds.
+    """
+    def __init__(self, params: LinkParams, seed: int = 0):
+        self.params_ = params
+        self.rng_ = random.Random(seed)
+        self.bad_state_ = False
+
+        # departure times and sizes of packets in the bottleneck queue
+        self.queue_: Deque[Tuple[float, int]] = deque()
+        self.queue_bytes_ = 0
+        self.busy_until_ = 0.0
+
+        # (delivery ts, payload) of delayed and of reordered packets
+        self.in_flight_: Deque[Tuple[int, bytes]] = deque()
+        self.overtaking_: Deque[Tuple[int, bytes]] = deque()
+        self.last_delivery_ts_ = 0
+
+        # stats since the last output
+        self.num_delivered_ = 0
+        self.num_lost_ = 0
+        self.num_dropped_ = 0
+        self.num_reordered_ = 0
+        self.num_queued_ = 0
+        self.total_queue_delay_us_ = 0.0
+        self.max_queue_delay_us_ = 0.0
+
+    def params(self) -> LinkParams:
+        return self.params_
+
+    def lose(self) -> bool:
+        params = self.params_
+        if self.bad_state_:
+            if self.rng_.random() < params.p_bad_good:
+                self.bad_state_ = False
+        elif params.p_good_bad and self.rng_.random() < params.p_good_bad:
+            self.bad_state_ = True
+
+        loss = params.loss_bad if self.bad_state_ else params.loss
+        return loss > 0 and self.rng_.random() < loss
+
+    def send(self, data: bytes, now: int) -> None:
+        params = self.params_
+        if (params.loss or params.p_good_bad) and self.lose():
+            self.num_lost_ += 1
+            return
+
+        departure_ts = float(now)
+
+        if params.rate_kbps > 0:
+            # packets that have left the bottleneck
+            while self.queue_ and self.queue_[0][0] <= now:
+                self.queue_bytes_ -= self.queue_.popleft()[1]
+
+            if params.queue_bytes and self.queue_bytes_ + len(data) > params.queue_bytes:
+                self.num_dropped_ += 1  # drop-tail
+                return
+
+            departure_ts = max(departure_ts, self.busy_until_) + len(data) * 8000 / params.rate_kbps
+            self.busy_until_ = departure_ts
+            self.queue_.append((departure_ts, len(data)))
+            self.queue_bytes_ += len(data)
+
+            queue_delay = departure_ts - now
+            self.num_queued_ += 1
+            self.total_queue_delay_us_ += queue_delay
+            self.max_queue_delay_us_ = max(self.max_queue_delay_us_, queue_delay)
+
+        delivery_ts = int(departure_ts)
+        if params.reorder and self.rng_.random() < params.reorder:
+            self.overtaking_.append((delivery_ts, data))
+            self.num_reordered_ += 1
+        else:
+            delay_ms = params.delay_ms
+            if params.jitter_ms:
+                delay_ms += self.rng_.uniform(-params.jitter_ms, params.jitter_ms)
+            delivery_ts += max(int(delay_ms * 1000), 0)
+
+            # jitter alone doesn't reorder
+            delivery_ts = max(delivery_ts, self.last_delivery_ts_)
+            self.last_delivery_ts_ = delivery_ts
+            self.in_flight_.append((delivery_ts, data))
+
+    def next_delivery_ts(self) -> Optional[int]:
+        if self.in_flight_ and self.overtaking_:
+            return min(self.in_flight_[0][0], self.overtaking_[0][0])
+        if self.in_flight_:
+            return self.in_flight_[0][0]
+        return self.overtaking_[0][0] if self.overtaking_ else None
+
+    def deliver(self, now: int) -> List[bytes]:
+        """Remove and return the packets due by 'now', in delivery order."""
+        in_flight, overtaking = self.in_flight_, self.overtaking_
+
+        delivered = []
+        while in_flight and in_flight[0][0] <= now:
+            # reordered packets due earlier go first
+            while overtaking and overtaking[0][0] <= in_flight[0][0]:
+                delivered.append(overtaking.popleft()[1])
+            delivered.append(in_flight.popleft()[1])
+
+        while overtaking and overtaking[0][0] <= now:
+            delivered.append(overtaking.popleft()[1])
+
+        self.num_delivered_ += len(delivered)
+        return delivered
+
+    def output_periodic_stats(self, name: str) -> None:
+        print(f"[{name}] delivered: {self.num_delivered_}, lost: {self.num_lost_}, "
+              f"dropped: {self.num_dropped_}, reordered: {self.num_reordered_}", end='')
+
+        if self.num_queued_ > 0:
+            print(f", avg/max queueing delay (ms): "
+                  f"{double_to_string(self.total_queue_delay_us_ / self.num_queued_ / 1000)}/"
+                  f"{double_to_string(self.max_queue_delay_us_ / 1000)}", end='')
+        print()
+
+        self.num_delivered_ = 0
+        self.num_lost_ = 0
+        self.num_dropped_ = 0
+        self.num_reordered_ = 0
+        self.num_queued_ = 0
+        self.total_queue_delay_us_ = 0.0
+        self.max_queue_delay_us_ = 0.0
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import signal
+import socket
+import argparse
+from typing import Dict, List, Optional
+
+from impairment import LinkParams, ImpairedLink
+from trace_link import TraceLink, DropPolicy, load_trace
+from utils.address import Address
+from utils.poller import Poller
+from utils.udp_socket import UDPSocket
+from utils.timerfd import Timerfd, TFD_NONBLOCK
+from utils.timestamp import timestamp_us
+
+# command-line options of each direction: (option, parameter, type, help)
+LINK_OPTIONS = [
+    ('rate', 'rate_kbps', float, 'bandwidth cap in kbps (default: unlimited)'),
+    ('queue', 'queue_bytes', int, 'bottleneck queue size in bytes (default: unlimited)'),
+    ('delay', 'delay_ms', float, 'one-way delay in ms'),
+    ('jitter', 'jitter_ms', float, 'maximum uniform deviation from the delay in ms'),
+    ('loss', 'loss', float, 'loss probability (in the good state)'),
+    ('p-good-bad', 'p_good_bad', float, 'Gilbert-Elliott probability of entering the bad state'),
+    ('p-bad-good', 'p_bad_good', float, 'Gilbert-Elliott probability of leaving the bad state'),
+    ('loss-bad', 'loss_bad', float, 'loss probability in the bad state (default: 1)'),
+    ('reorder', 'reorder', float, 'probability of a packet skipping the delay'),
+]
+
+# options of each direction that replace the link by a Mahimahi trace;
+# --queue and --delay apply to it as well
+TRACE_OPTIONS = [
+    ('trace', 'trace', str, 'Mahimahi packet-delivery trace to replay'),
+    ('queue-packets', 'queue_packets', int, 'trace queue size in packets (default: unlimited)'),
+    ('drop-policy', 'drop_policy', str, 'trace queue drop policy: droptail or drophead'),
+    ('trace-log', 'trace_log', str, 'file to write the Mahimahi-style link log to'),
+]
+
+DIRECTIONS = ['down', 'up']  # sender to receiver, receiver to sender
+
+
+def print_usage(program_name: str) -> None:
+    link_options = "".join(
+        f"    --{{down,up}}-{option:<13}{help}\n"
+        for option, _, _, help in LINK_OPTIONS + TRACE_OPTIONS)
+
+    usage_msg = f"""Usage: {program_name} [options] port sender_host sender_port
+
+Relays UDP between video_receiver.py (pointed at 'port') and video_sender.py
+and impairs each direction: 'down' is sender to receiver, 'up' the reverse.
+
+Options:
+{link_options}    --script <file>        JSON list of {{"at": <s>, "down": {{...}}, "up": {{...}}}} parameter changes
+    --seed <N>             seed of the loss, jitter and reordering draws (default: 0)
+    --duration <s>         exit after this many seconds (default: run forever)
+"""
+    print(usage_msg, file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='UDP proxy emulating an impaired link between sender and receiver')
+    parser.add_argument('port', type=int, help='Port for the receiver to connect to')
+    parser.add_argument('sender_host', help='Host of the sender')
+    parser.add_argument('sender_port', type=int, help='Port of the sender')
+
+    for direction in DIRECTIONS:
+        for option, param, param_type, help in LINK_OPTIONS + TRACE_OPTIONS:
+            parser.add_argument(f'--{direction}-{option}', dest=f'{direction}_{param}',
+                                type=param_type, help=f'{direction}: {help}')
+
+    parser.add_argument('--script',
+                        help='JSON list of {"at": <s>, "down": {...}, "up": {...}} '
+                             'parameter changes')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the loss, jitter and reordering draws (default: 0)')
+    parser.add_argument('--duration', type=float, default=0,
+                        help='Exit after this many seconds (default: run forever)')
+
+    return parser.parse_args()
+
+
+def set_timer(timer: Timerfd, delay_us: int) -> None:
+    # a zero expiration would disarm the timer
+    delay_us = max(delay_us, 1)
+    timer.set_time((delay_us // 1000000, delay_us % 1000000 * 1000), (0, 0))
+
+
+class ImpairmentProxy:
+    """Relays datagrams between a receiver and a sender through two ImpairedLinks.
+
+    Runs on a Poller with one Timerfd per direction, armed to the next
+    delivery. The receiver's address is learned from its first datagram
+    (the ConfigMsg); both sockets are connected from then on. Parameters
+    can be changed while running with set_params() or a script of timed
+    changes.
+    """
+    SOCKET_BUFFER_SIZE = 4 * 1024 * 1024  # absorb bursts while the loop is busy
+
+    def __init__(self, port: int, sender_addr: Address,
+                 down: Optional[LinkParams] = None, up: Optional[LinkParams] = None,
+                 seed: int = 0):
+        self.poller_ = Poller()
+
+        self.receiver_sock_ = UDPSocket()
+        self.receiver_sock_.bind(Address(addr=("0.0.0.0", port)))
+        self.receiver_sock_.set_blocking(False)
+        self.receiver_connected_ = False
+
+        self.sender_sock_ = UDPSocket()
+        self.sender_sock_.connect(sender_addr)
+        self.sender_sock_.set_blocking(False)
+
+        for sock in (self.receiver_sock_, self.sender_sock_):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.SOCKET_BUFFER_SIZE)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SOCKET_BUFFER_SIZE)
+
+        self.links_ = {'down': ImpairedLink(down or LinkParams(), seed),
+                       'up': ImpairedLink(up or LinkParams(), seed + 1)}
+        self.out_socks_ = {'down': self.receiver_sock_, 'up': self.sender_sock_}
+        self.timers_ = {direction: Timerfd(flags=TFD_NONBLOCK) for direction in DIRECTIONS}
+        self.armed_ts_: Dict[str, Optional[int]] = {direction: None for direction in DIRECTIONS}
+        self.num_send_errors_ = 0
+
+        # (time since start in us, direction, parameters), in time order
+        self.script_: List = []
+        self.script_timer_ = Timerfd(flags=TFD_NONBLOCK)
+        self.start_ts_ = timestamp_us()
+
+        self.poller_.register_event(self.receiver_sock_, Poller.In, self.handle_receiver_read)
+        self.poller_.register_event(self.sender_sock_, Poller.In, self.handle_sender_read)
+        for direction in DIRECTIONS:
+            self.poller_.register_event(self.timers_[direction], Poller.In,
+                                        lambda direction=direction: self.handle_timer(direction))
+        self.poller_.register_event(self.script_timer_, Poller.In, self.handle_script_timer)
+
+    def poller(self) -> Poller:
+        return self.poller_
+
+    def local_address(self) -> Address:
+        return self.receiver_sock_.local_address()
+
+    def link(self, direction: str) -> ImpairedLink:
+        return self.links_[direction]
+
+    def set_link(self, direction: str, link) -> None:
+        """Replace the link of 'direction', e.g. by a TraceLink."""
+        self.links_[direction] = link
+
+    def set_params(self, direction: str, **params) -> None:
+        link = self.links_[direction]
+        if not isinstance(link, ImpairedLink):
+            raise RuntimeError(f"{direction}: only impairment parameters can be changed")
+        link.params().update(**params)
+
+    def load_script(self, script: List[Dict]) -> None:
+        """Schedule parameter changes: [{"at": <s>, "down": {...}, "up": {...}}, ...]."""
+        for step in script:
+            for direction in DIRECTIONS:
+                if direction in step:
+                    self.script_.append((int(step['at'] * 1000000), direction, step[direction]))
+        self.script_.sort(key=lambda change: change[0])
+        self.handle_script_timer()
+
+    def handle_script_timer(self) -> None:
+        try:
+            self.script_timer_.read_expirations()
+        except BlockingIOError:
+            pass
+
+        elapsed = timestamp_us() - self.start_ts_
+        while self.script_ and self.script_[0][0] <= elapsed:
+            _, direction, params = self.script_.pop(0)
+            self.set_params(direction, **params)
+            print(f"[{direction}] {self.links_[direction].params()}", file=sys.stderr)
+
+        if self.script_:
+            set_timer(self.script_timer_, self.script_[0][0] - elapsed)
+
+    def handle_receiver_read(self) -> None:
+        link = self.links_['up']
+        while True:
+            if self.receiver_connected_:
+                raw_data = self.receiver_sock_.recv()
+            else:
+                # learn who the receiver is, then only talk to it
+                receiver_addr, raw_data = self.receiver_sock_.recvfrom()
+                if raw_data:
+                    self.receiver_sock_.connect(receiver_addr)
+                    self.receiver_connected_ = True
+                    print(f"Receiver address: {receiver_addr}", file=sys.stderr)
+
+            if not raw_data:
+                break
+            link.send(raw_data, timestamp_us())
+
+        self.flush('up')
+
+    def handle_sender_read(self) -> None:
+        link = self.links_['down']
+        while True:
+            raw_data = self.sender_sock_.recv()
+            if not raw_data:
+                break
+            link.send(raw_data, timestamp_us())
+
+        self.flush('down')
+
+    def handle_timer(self, direction: str) -> None:
+        try:
+            self.timers_[direction].read_expirations()
+        except BlockingIOError:
+            return  # re-armed since it fired
+
+        self.armed_ts_[direction] = None
+        self.flush(direction)
+
+    def flush(self, direction: str) -> None:
+        """Send the packets that are due and arm the timer for the next one."""
+        link = self.links_[direction]
+        now = timestamp_us()
+
+        if direction == 'up' or self.receiver_connected_:
+            sock = self.out_socks_[direction]
+            for raw_data in link.deliver(now):
+                # a full socket buffer drops the packet, like a real link
+                if not sock.send(raw_data):
+                    self.num_send_errors_ += 1
+
+        next_ts = link.next_delivery_ts()
+        armed_ts = self.armed_ts_[direction]
+        if next_ts is not None and (armed_ts is None or next_ts < armed_ts):
+            set_timer(self.timers_[direction], next_ts - now)
+            self.armed_ts_[direction] = next_ts
+
+    def output_periodic_stats(self) -> None:
+        for direction in DIRECTIONS:
+            self.links_[direction].output_periodic_stats(direction)
+
+        if self.num_send_errors_:
+            print(f"Dropped {self.num_send_errors_} datagrams on full socket buffers")
+            self.num_send_errors_ = 0
+
+    def run(self, duration: float = 0) -> None:
+        stats_timer = Timerfd()
+        stats_timer.set_time((1, 0), (1, 0))
+
+        def handle_stats():
+            if stats_timer.read_expirations() == 0:
+                return
+            self.output_periodic_stats()
+
+        self.poller_.register_event(stats_timer, Poller.In, handle_stats)
+
+        end_ts = self.start_ts_ + int(duration * 1000000)
+        while not duration or timestamp_us() < end_ts:
+            self.poller_.poll(1000 if duration else -1)
+
+
+def link_params(args, direction: str) -> dict:
+    """The LinkParams given on the command line for 'direction'."""
+    return {param: getattr(args, f'{direction}_{param}')
+            for _, param, _, _ in LINK_OPTIONS
+            if getattr(args, f'{direction}_{param}') is not None}
+
+
+def make_trace_link(args, direction: str, params: dict) -> TraceLink:
+    unsupported = set(params) - {'queue_bytes', 'delay_ms'}
+    if unsupported:
+        raise RuntimeError(f"{direction}: {', '.join(sorted(unsupported))} "
+                           f"can't be combined with a trace")
+
+    trace_log = getattr(args, f'{direction}_trace_log')
+    return TraceLink(load_trace(getattr(args, f'{direction}_trace')),
+                     queue_bytes=params.get('queue_bytes', 0),
+                     queue_packets=getattr(args, f'{direction}_queue_packets') or 0,
+                     drop_policy=DropPolicy(getattr(args, f'{direction}_drop_policy')
+                                            or DropPolicy.DROP_TAIL.value),
+                     delay_ms=params.get('delay_ms', 0),
+                     log=open(trace_log, 'w') if trace_log else None)
+
+
+def main():
+    args = parse_arguments()
+
+    # exit cleanly (flushing trace logs) when terminated by a harness
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    links = {}
+    trace_links = {}
+    for direction in DIRECTIONS:
+        params = link_params(args, direction)
+
+        if getattr(args, f'{direction}_trace'):
+            trace_links[direction] = make_trace_link(args, direction, params)
+            print(f"[{direction}] trace: {getattr(args, f'{direction}_trace')}", file=sys.stderr)
+        else:
+            links[direction] = LinkParams(**params)
+            print(f"[{direction}] {links[direction]}", file=sys.stderr)
+
+    proxy = ImpairmentProxy(args.port, Address(ip=args.sender_host, port=args.sender_port),
+                            links.get('down'), links.get('up'), args.seed)
+    for direction, link in trace_links.items():
+        proxy.set_link(direction, link)
+    print(f"Local address: {proxy.local_address()}", file=sys.stderr)
+
+    if args.script:
+        with open(args.script) as script_file:
+            proxy.load_script(json.load(script_file))
+
+    proxy.run(args.duration)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
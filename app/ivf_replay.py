@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import argparse
+from ctypes import byref
+
+from decoder import Decoder, Frame
+from protocol import FrameType
+from video.ivf import IVFReader
+from video.sdl import VideoDisplay
+from utils.conversion import double_to_string
+from utils.exception_rim import check_call
+from utils.vpx_wrap import vpx_codec_destroy
+
+
+def print_usage(program_name: str) -> None:
+    usage_msg = f"""Usage: {program_name} [options] ivf
+
+Options:
+    --loops <N>          number of passes over the file (default: 1)
+    --display            display the decoded frames
+"""
+    print(usage_msg, file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Decode an IVF file as fast as possible through Decoder.decode_frame')
+    parser.add_argument('ivf', help='IVF file recorded by the sender or receiver')
+    parser.add_argument('--loops', type=int, default=1,
+                        help='Number of passes over the file (default: 1)')
+    parser.add_argument('--display', action='store_true',
+                        help='Display the decoded frames')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    reader = IVFReader(args.ivf)
+    width = reader.display_width()
+    height = reader.display_height()
+    print(f"{args.ivf}: {width}x{height}, {reader.frame_count()} frames", file=sys.stderr)
+
+    # decoding happens on this thread; no worker is spawned at this lazy level
+    decoder = Decoder(width, height, Decoder.LazyLevel.NO_DECODE_DISPLAY.value)
+    context = decoder.init_decoder_context()
+
+    display = None
+    if args.display:
+        display = VideoDisplay(width, height)
+
+    num_decoded_frames = 0
+    total_decode_time_ms = 0.0
+    max_decode_time_ms = 0.0
+    total_frame_size = 0
+
+    replay_start = time.monotonic()
+
+    for _ in range(args.loops):
+        for frame_no in range(reader.frame_count()):
+            frame_type = FrameType.KEY if reader.is_key(frame_no) else FrameType.NONKEY
+            frame = Frame.from_payload(reader.pts(frame_no), frame_type, reader.frame(frame_no))
+
+            decode_time_ms = decoder.decode_frame(context, frame)
+            frame.release()
+
+            if display:
+                decoder.display_decoded_frame(context, display)
+
+            num_decoded_frames += 1
+            total_decode_time_ms += decode_time_ms
+            max_decode_time_ms = max(max_decode_time_ms, decode_time_ms)
+            total_frame_size += frame.frame_size()
+
+    replay_time_s = time.monotonic() - replay_start
+
+    check_call(vpx_codec_destroy(byref(context)), 0, "vpx_codec_destroy")
+
+    if num_decoded_frames == 0:
+        print("No frames to decode", file=sys.stderr)
+        return 1
+
+    print(f"Decoded frames: {num_decoded_frames}")
+    print(f" - Avg/Max decoding time (ms): "
+          f"{double_to_string(total_decode_time_ms / num_decoded_frames)}/"
+          f"{double_to_string(max_decode_time_ms)}")
+    print(f" - Decode throughput (fps): "
+          f"{double_to_string(num_decoded_frames * 1000 / total_decode_time_ms)}")
+    print(f" - Replay throughput (fps): "
+          f"{double_to_string(num_decoded_frames / replay_time_s)}")
+    print(f" - Avg frame size (bytes): {total_frame_size // num_decoded_frames}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import time
+import shlex
+import socket
+import signal
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from event_trace import EventTracer, Event
+from utils.conversion import double_to_string
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# metric: whether lower or higher is better (None: informational only)
+METRICS = {
+    'frame_latency_p50_ms': 'lower',
+    'frame_latency_p90_ms': 'lower',
+    'frame_latency_p99_ms': 'lower',
+    'frame_latency_max_ms': None,
+    'bitrate_kbps': None,
+    'decodable_fps': 'higher',
+    'sender_cpu_ms_per_frame': 'lower',
+    'receiver_cpu_ms_per_frame': 'lower',
+    'datagrams_per_sec': None,
+}
+
+
+def print_usage(program_name: str) -> None:
+    usage_msg = f"""Usage: {program_name} [options] [y4m]
+
+Runs video_sender.py and video_receiver.py on loopback for a fixed time
+and reports frame latency percentiles, bitrate, decodable fps and CPU time
+per frame from their -o logs, and the datagrams/s received (retransmissions
+included) from the receiver's event trace. Without a y4m clip the sender
+generates a synthetic one.
+
+Options:
+    --width <W>, --height <H>   resolution (default: 704x576)
+    --fps <FPS>                 frame rate (default: 30)
+    --cbr <kbps>                target bitrate (default: 2000)
+    --lazy <level>              receiver lazy level: 1 or 2 (default: 1)
+    --synthetic <pattern>       synthetic pattern without a clip (default: gradient)
+    --duration <s>              seconds to stream (default: 20)
+    --warmup <s>                seconds of frames to leave out (default: 2)
+    --proxy <args>              relay through impairment_proxy.py with these options
+    --workdir <dir>             directory for the logs (default: a new temporary one)
+    --output <file>             file to write the results to as JSON
+    --baseline <file>           results to compare against; exit 1 on a regression
+    --threshold <ratio>         relative change that counts as a regression (default: 0.1)
+    --metric-threshold <m=r>    threshold for metric m (repeatable)
+"""
+    print(usage_msg, file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='End-to-end benchmark of the sender and receiver on loopback')
+    parser.add_argument('y4m', nargs='?', help='YUV4MPEG clip (default: synthetic)')
+    parser.add_argument('--width', type=int, default=704, help='Width (default: 704)')
+    parser.add_argument('--height', type=int, default=576, help='Height (default: 576)')
+    parser.add_argument('--fps', type=int, default=30, help='Frame rate (default: 30)')
+    parser.add_argument('--cbr', type=int, default=2000,
+                        help='Target bitrate in kbps (default: 2000)')
+    parser.add_argument('--lazy', type=int, choices=[1, 2], default=1,
+                        help='Receiver lazy level (default: 1)')
+    parser.add_argument('--synthetic', default='gradient',
+                        help='Synthetic pattern used without a clip (default: gradient)')
+    parser.add_argument('--duration', type=float, default=20,
+                        help='Seconds to stream (default: 20)')
+    parser.add_argument('--warmup', type=float, default=2,
+                        help='Seconds of frames to leave out of the results (default: 2)')
+    parser.add_argument('--proxy',
+                        help='Relay through impairment_proxy.py with these options, '
+                             'e.g. "--down-rate 2000 --down-delay 20"')
+    parser.add_argument('--workdir', help='Directory for the logs (default: temporary)')
+    parser.add_argument('--output', help='File to write the results to as JSON')
+    parser.add_argument('--baseline', help='Results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change that counts as a regression (default: 0.1)')
+    parser.add_argument('--metric-threshold', action='append', default=[],
+                        metavar='METRIC=RATIO', help='Threshold for one metric (repeatable)')
+
+    return parser.parse_args()
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def launch(cmd: List[str], workdir: str, name: str) -> subprocess.Popen:
+    stdout = open(os.path.join(workdir, f"{name}.out"), 'w')
+    stderr = open(os.path.join(workdir, f"{name}.err"), 'w')
+    return subprocess.Popen(cmd, stdout=stdout, stderr=stderr)
+
+
+def wait_for_output(process: subprocess.Popen, path: str, text: str, timeout: float = 30) -> None:
+    """Wait until 'text' shows up in the output file 'path' of 'process'."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(path) as output_file:
+            if text in output_file.read():
+                return
+
+        if process.poll() is not None:
+            raise RuntimeError(f"{path}: process exited before printing '{text}'")
+        time.sleep(0.05)
+
+    raise RuntimeError(f"{path}: timed out waiting for '{text}'")
+
+
+def stop(process: subprocess.Popen) -> float:
+    """Terminate 'process' and return the CPU time it used in seconds."""
+    # not Popen.send_signal() or wait(): they reap the process, and with it
+    # its resource usage
+    try:
+        os.kill(process.pid, signal.SIGTERM)
+        _, _, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return 0.0  # exited early and already reaped
+
+    process.returncode = 0
+    return rusage.ru_utime + rusage.ru_stime
+
+
+def read_log(path: str, num_fields: int) -> np.ndarray:
+    rows = []
+    with open(path) as log_file:
+        for line in log_file:
+            fields = line.split(',')
+            if len(fields) == num_fields:
+                rows.append([int(field) for field in fields])
+
+    return np.array(rows, dtype=np.int64).reshape(-1, num_fields)
+
+
+def run(args, workdir: str) -> Dict[str, float]:
+    sender_port = free_udp_port()
+    sender_log = os.path.join(workdir, "sender.csv")
+    receiver_log = os.path.join(workdir, "receiver.csv")
+    receiver_events = os.path.join(workdir, "receiver.events")
+
+    sender_cmd = [sys.executable, os.path.join(APP_DIR, "video_sender.py"),
+                  "-o", sender_log, str(sender_port)]
+    if args.y4m:
+        sender_cmd.append(args.y4m)
+    else:
+        sender_cmd += ["--synthetic", args.synthetic]
+
+    processes = []
+    try:
+        sender = launch(sender_cmd, workdir, "sender")
+        processes.append(sender)
+        wait_for_output(sender, os.path.join(workdir, "sender.err"), "Waiting for receiver")
+
+        receiver_port = sender_port
+        if args.proxy:
+            receiver_port = free_udp_port()
+            proxy = launch([sys.executable, os.path.join(APP_DIR, "impairment_proxy.py"),
+                            str(receiver_port), "127.0.0.1", str(sender_port)]
+                           + shlex.split(args.proxy), workdir, "proxy")
+            processes.append(proxy)
+            wait_for_output(proxy, os.path.join(workdir, "proxy.err"), "Local address")
+
+        receiver = launch([sys.executable, os.path.join(APP_DIR, "video_receiver.py"),
+                           "127.0.0.1", str(receiver_port), str(args.width), str(args.height),
+                           "--fps", str(args.fps), "--cbr", str(args.cbr),
+                           "--lazy", str(args.lazy), "-o", receiver_log,
+                           "--event-trace", receiver_events],
+                          workdir, "receiver")
+        processes.append(receiver)
+
+        time.sleep(args.duration)
+    finally:
+        # the receiver first, so that the sender's CPU time covers every frame
+        cpu_times = {}
+        for process, name in reversed(list(zip(processes, ["sender", "proxy", "receiver"]
+                                                if args.proxy else ["sender", "receiver"]))):
+            cpu_times[name] = stop(process)
+
+    _, events = EventTracer.load(receiver_events)
+    datagram_ts = events['ts'][events['event'] == Event.RECV]
+
+    return compute_metrics(args, read_log(sender_log, 5), read_log(receiver_log, 3),
+                           datagram_ts, cpu_times)
+
+
+def compute_metrics(args, sent: np.ndarray, received: np.ndarray, datagram_ts: np.ndarray,
+                    cpu_times: Dict[str, float]) -> Dict[str, float]:
+    """
+    Args:
+        sent: frame id, target bitrate, frame size, generation ts, encoded ts
+        received: frame id, frame size, decodable (lazy 2) or decoded (lazy 1) ts
+        datagram_ts: time every datagram was received at (us)
+    """
+    if len(sent) == 0 or len(received) == 0:
+        raise RuntimeError("no frames were sent or received")
+
+    # leave out the warm-up
+    start_ts = sent[0, 3] + int(args.warmup * 1000000)
+    sent_after_warmup = sent[sent[:, 3] >= start_ts]
+    end_ts = sent_after_warmup[-1, 3]
+    window_s = (end_ts - start_ts) / 1000000
+    if window_s <= 0:
+        raise RuntimeError("the run is shorter than the warm-up")
+
+    # CPU time covers the whole run, warm-up included
+    sender_cpu_ms_per_frame = cpu_times['sender'] * 1000 / len(sent)
+    receiver_cpu_ms_per_frame = cpu_times['receiver'] * 1000 / len(received)
+
+    generation_ts = dict(zip(sent[:, 0].tolist(), sent[:, 3].tolist()))
+    received = received[np.isin(received[:, 0], sent_after_warmup[:, 0])]
+    latencies = np.array([ts - generation_ts[frame_id]
+                          for frame_id, ts in zip(received[:, 0].tolist(),
+                                                  received[:, 2].tolist())]) / 1000
+    if len(latencies) == 0:
+        raise RuntimeError("no frames were received after the warm-up")
+
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    # both endpoints share the host's clock
+    num_datagrams = np.count_nonzero((datagram_ts >= start_ts) & (datagram_ts <= end_ts))
+
+    return {
+        'frame_latency_p50_ms': float(p50),
+        'frame_latency_p90_ms': float(p90),
+        'frame_latency_p99_ms': float(p99),
+        'frame_latency_max_ms': float(latencies.max()),
+        'bitrate_kbps': float(received[:, 1].sum() * 8 / window_s / 1000),
+        'decodable_fps': len(received) / window_s,
+        'sender_cpu_ms_per_frame': sender_cpu_ms_per_frame,
+        'receiver_cpu_ms_per_frame': receiver_cpu_ms_per_frame,
+        'datagrams_per_sec': int(num_datagrams) / window_s,
+    }
+
+
+def compare(metrics: Dict[str, float], baseline: Dict[str, float],
+            thresholds: Dict[str, float], default_threshold: float) -> List[Tuple[str, float]]:
+    """Return (metric, relative change) of every metric that regressed."""
+    regressions = []
+    for name, better in METRICS.items():
+        if better is None or name not in baseline or baseline[name] == 0:
+            continue
+
+        change = (metrics[name] - baseline[name]) / baseline[name]
+        worse = change if better == 'lower' else -change
+        if worse > thresholds.get(name, default_threshold):
+            regressions.append((name, change))
+
+    return regressions
+
+
+def main():
+    args = parse_arguments()
+
+    thresholds = {}
+    for metric_threshold in args.metric_threshold:
+        name, ratio = metric_threshold.split('=')
+        if name not in METRICS:
+            raise RuntimeError(f"unknown metric: {name}")
+        thresholds[name] = float(ratio)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="loopback_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"Logs: {workdir}", file=sys.stderr)
+
+    metrics = run(args, workdir)
+
+    baseline: Optional[Dict[str, float]] = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['metrics']
+
+    for name, value in metrics.items():
+        line = f"{name}: {double_to_string(value)}"
+        if baseline and name in baseline and baseline[name]:
+            change = (value - baseline[name]) / baseline[name]
+            line += f" (baseline {double_to_string(baseline[name])}, " \
+                    f"{'+' if change >= 0 else ''}{double_to_string(100 * change)}%)"
+        print(line)
+
+    if args.output:
+        config = {name: getattr(args, name)
+                  for name in ['y4m', 'width', 'height', 'fps', 'cbr', 'lazy',
+                               'synthetic', 'duration', 'warmup', 'proxy']}
+        with open(args.output, 'w') as output_file:
+            json.dump({'config': config, 'metrics': metrics}, output_file, indent=2)
+
+    if baseline:
+        regressions = compare(metrics, baseline, thresholds, args.threshold)
+        for name, change in regressions:
+            print(f"Regression: {name} changed by {double_to_string(100 * change)}%",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
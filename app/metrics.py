@@ -0,0 +1,314 @@
+import os
+import socket
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from utils.histogram import LatencyHistogram
+from utils.poller import Poller
+
+# upper bounds (us) of the buckets of latency histograms
+LATENCY_BUCKETS_US = [250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000,
+                      250000, 500000, 1000000, 2500000]
+
+
+def format_value(value: Union[int, float]) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if value != value:
+        return "NaN"
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonically increasing count; inc() is an attribute increment."""
+    TYPE = 'counter'
+
+    def __init__(self):
+        self.value_ = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value_ += n
+
+    def value(self) -> Union[int, float]:
+        return self.value_
+
+
+class Gauge:
+    """Value that goes up and down, set on the hot path."""
+    TYPE = 'gauge'
+
+    def __init__(self):
+        self.value_ = 0
+
+    def set(self, value: Union[int, float]) -> None:
+        self.value_ = value
+
+    def value(self) -> Union[int, float]:
+        return self.value_
+
+
+class CallbackMetric:
+    """Counter or gauge read from existing state only when scraped, e.g. a
+    queue's length, so it costs nothing on the hot path."""
+
+    def __init__(self, metric_type: str, fn: Callable[[], Union[int, float]]):
+        self.TYPE = metric_type
+        self.fn_ = fn
+
+    def value(self) -> Union[int, float]:
+        return self.fn_()
+
+
+class Histogram:
+    """Cumulative histogram over fixed bucket upper bounds.
+
+    Values are observed in the caller's unit (e.g. us) and exported
+    multiplied by 'scale' (e.g. 1e-6 for seconds, as Prometheus prefers).
+    """
+    TYPE = 'histogram'
+
+    def __init__(self, bounds: Sequence[int], scale: float = 1.0):
+        self.bounds_ = list(bounds)
+        self.scale_ = scale
+        # the last bucket is +Inf
+        self.counts_ = [0] * (len(self.bounds_) + 1)
+        self.sum_ = 0
+
+    def observe(self, value: int) -> None:
+        self.counts_[bisect_left(self.bounds_, value)] += 1
+        self.sum_ += value
+
+    def samples(self) -> List[Tuple[str, Optional[str], Union[int, float]]]:
+        """(suffix, le label, value) of every exported sample."""
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.bounds_ + [None], self.counts_):
+            cumulative += count
+            le = "+Inf" if bound is None else format(bound * self.scale_, ".12g")
+            samples.append(('_bucket', le, cumulative))
+
+        samples.append(('_sum', None, self.sum_ * self.scale_))
+        samples.append(('_count', None, cumulative))
+        return samples
+
+
+class CallbackHistogram:
+    """Histogram read from existing LatencyHistograms only when scraped, so
+    values recorded for the periodic stats are not recorded a second time.
+
+    fn() returns the LatencyHistograms (in the caller's unit, e.g. us) that
+    together hold every value so far, e.g. the periods output so far and
+    the current one. A bucket counts the LatencyHistogram bucket its bound
+    falls into, so its bound is exact to within ~1.6%.
+    """
+    TYPE = 'histogram'
+
+    def __init__(self, fn: Callable[[], Sequence[LatencyHistogram]],
+                 bounds: Sequence[int], scale: float = 1.0):
+        self.fn_ = fn
+        self.bounds_ = list(bounds)
+        self.scale_ = scale
+        # last LatencyHistogram bucket of every exported bucket
+        self.indices_ = [LatencyHistogram.bucket_index(bound) for bound in self.bounds_]
+
+    def samples(self) -> List[Tuple[str, Optional[str], Union[int, float]]]:
+        """(suffix, le label, value) of every exported sample."""
+        hists = self.fn_()
+        total = sum(hist.count() for hist in hists)
+        cumulatives = [hist.cumulative_counts() for hist in hists]
+
+        samples = []
+        for bound, index in zip(self.bounds_, self.indices_):
+            cumulative = sum(counts[index] for counts in cumulatives)
+            samples.append(('_bucket', format(bound * self.scale_, ".12g"), cumulative))
+        samples.append(('_bucket', "+Inf", total))
+
+        samples.append(('_sum', None, sum(hist.sum() for hist in hists) * self.scale_))
+        samples.append(('_count', None, total))
+        return samples
+
+
+class MetricsRegistry:
+    """Named metrics of one process, rendered in the Prometheus text format.
+
+    Metrics are plain objects updated in place by whoever owns them; the
+    registry only walks them when scraped.
+    """
+    PREFIX = "ringmaster_"
+
+    def __init__(self, labels: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            labels: constant labels of every sample, e.g. {'role': 'sender'}
+        """
+        self.labels_ = ",".join(f'{name}="{value}"' for name, value in (labels or {}).items())
+        # name: (help, metric), in registration order
+        self.metrics_: Dict[str, Tuple[str, object]] = {}
+
+    def register(self, name: str, help_text: str, metric):
+        if name in self.metrics_:
+            raise RuntimeError(f"metric already registered: {name}")
+
+        self.metrics_[name] = (help_text, metric)
+        return metric
+
+    def counter(self, name: str, help_text: str,
+                fn: Optional[Callable[[], Union[int, float]]] = None):
+        """A Counter, or a counter read from fn() when scraped."""
+        return self.register(name, help_text, CallbackMetric('counter', fn) if fn else Counter())
+
+    def gauge(self, name: str, help_text: str,
+              fn: Optional[Callable[[], Union[int, float]]] = None):
+        """A Gauge, or a gauge read from fn() when scraped."""
+        return self.register(name, help_text, CallbackMetric('gauge', fn) if fn else Gauge())
+
+    def histogram(self, name: str, help_text: str,
+                  bounds: Sequence[int] = LATENCY_BUCKETS_US, scale: float = 1e-6,
+                  fn: Optional[Callable[[], Sequence[LatencyHistogram]]] = None):
+        """A Histogram, or a histogram read from the LatencyHistograms
+        returned by fn() when scraped."""
+        if fn:
+            return self.register(name, help_text, CallbackHistogram(fn, bounds, scale))
+        return self.register(name, help_text, Histogram(bounds, scale))
+
+    def labels(self, extra: str = "") -> str:
+        labels = ",".join(label for label in (self.labels_, extra) if label)
+        return "{" + labels + "}" if labels else ""
+
+    def render(self) -> str:
+        lines = []
+        for name, (help_text, metric) in self.metrics_.items():
+            name = self.PREFIX + name
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric.TYPE}")
+
+            if metric.TYPE == 'histogram':
+                for suffix, le, value in metric.samples():
+                    extra = f'le="{le}"' if le is not None else ""
+                    lines.append(f"{name}{suffix}{self.labels(extra)} {format_value(value)}")
+            else:
+                lines.append(f"{name}{self.labels()} {format_value(metric.value())}")
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves a registry over HTTP from an existing Poller loop (no threads).
+
+    Listens on TCP ("host:port") or on a Unix socket (a path), e.g.
+    curl http://127.0.0.1:9100/metrics or
+    curl --unix-socket /tmp/sender.sock http://localhost/metrics.
+    Scrapes are small, so each is read and answered without blocking the
+    loop for more than rendering the registry.
+    """
+    MAX_REQUEST_SIZE = 8192
+
+    def __init__(self, registry: MetricsRegistry, poller: Poller, endpoint: str):
+        self.registry_ = registry
+        self.poller_ = poller
+
+        if '/' in endpoint:
+            if os.path.exists(endpoint):
+                os.unlink(endpoint)
+            self.listener_ = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener_.bind(endpoint)
+        else:
+            host, port = endpoint.rsplit(':', 1)
+            self.listener_ = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener_.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener_.bind((host or "0.0.0.0", int(port)))
+
+        self.listener_.listen(16)
+        self.listener_.setblocking(False)
+
+        # fd: (connection, request received so far, response left to send)
+        self.conns_: Dict[int, List] = {}
+
+        poller.register_event(self.listener_.fileno(), Poller.In, self.handle_accept)
+
+    def address(self):
+        return self.listener_.getsockname()
+
+    def handle_accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self.listener_.accept()
+            except BlockingIOError:
+                return
+
+            conn.setblocking(False)
+            fd = conn.fileno()
+            self.conns_[fd] = [conn, bytearray(), b""]
+            self.poller_.register_event(fd, Poller.In, lambda fd=fd: self.handle_read(fd))
+            # only active while a response is left to send
+            self.poller_.register_event(fd, Poller.Out, lambda fd=fd: self.handle_write(fd))
+            self.poller_.deactivate(fd, Poller.Out)
+
+    def handle_read(self, fd: int) -> None:
+        if fd not in self.conns_:
+            return
+        conn, request, _ = self.conns_[fd]
+
+        try:
+            data = conn.recv(4096)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            data = b""
+
+        if not data:
+            self.close(fd)
+            return
+
+        request += data
+        if b"\r\n\r\n" not in request and len(request) < self.MAX_REQUEST_SIZE:
+            return  # wait for the rest of the request
+
+        # answer once, then only wait to send the rest
+        self.poller_.deactivate(fd, Poller.In)
+        self.conns_[fd][2] = self.response(bytes(request))
+        self.handle_write(fd)
+
+    def response(self, request: bytes) -> bytes:
+        request_line = request.split(b"\r\n", 1)[0].split()
+        path = request_line[1] if len(request_line) > 1 else b"/"
+
+        if path.split(b"?")[0] in (b"/", b"/metrics"):
+            status = "200 OK"
+            body = self.registry_.render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"not found\n"
+
+        header = (f"HTTP/1.0 {status}\r\n"
+                  f"Content-Type: text/plain; version=0.0.4\r\n"
+                  f"Content-Length: {len(body)}\r\n"
+                  f"Connection: close\r\n\r\n")
+        return header.encode() + body
+
+    def handle_write(self, fd: int) -> None:
+        if fd not in self.conns_:
+            return
+        conn, _, response = self.conns_[fd]
+
+        try:
+            response = response[conn.send(response):]
+        except BlockingIOError:
+            pass
+        except ConnectionError:
+            response = b""
+
+        if not response:
+            self.close(fd)
+            return
+
+        # wait for the socket to drain
+        self.conns_[fd][2] = response
+        self.poller_.activate(fd, Poller.Out)
+
+    def close(self, fd: int) -> None:
+        conn, _, _ = self.conns_.pop(fd)
+        self.poller_.deregister(fd)
+        # the fd number may be reused by the next accept() in this round
+        self.poller_.do_deregister()
+        conn.close()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gc
+import re
+import json
+import time
+import socket
+import argparse
+import statistics
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from encoder import Encoder
+from decoder import Decoder
+from metrics import MetricsRegistry
+from protocol import Datagram, AckMsg, Msg, FrameType
+from utils.address import Address
+from utils.eventfd import Eventfd, EFD_NONBLOCK
+from utils.poller import Poller
+from utils.udp_socket import UDPSocket
+from utils.timestamp import timestamp_us
+from utils.histogram import LatencyHistogram
+from utils.conversion import double_to_string
+
+# operations per timed batch
+BATCH_SIZE = 64
+
+
+def print_usage(program_name: str) -> None:
+    usage_msg = f"""Usage: {program_name} [options]
+
+Times the operations that run per datagram in isolation and reports, for
+each, ns/op (median and minimum over the rounds) and the memory each
+operation allocates: the bytes it has allocated at its peak (alloc B/op)
+and the blocks it leaves allocated (net blocks/op).
+
+Options:
+    --filter <regex>     only run the benchmarks whose name matches
+    --n <list>           comma-separated numbers of unacked datagrams or
+                         buffered frames (default: 16,256,1024)
+    --k <list>           comma-separated numbers of polled fds (default: 1,16,64)
+    --rounds <N>         timed rounds per benchmark (default: 7)
+    --min-time <s>       minimum timed seconds per round (default: 0.1)
+    --cpu <id>           pin the process to this CPU
+    --output <file>      file to write the results to as JSON
+"""
+    print(usage_msg, file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Microbenchmarks of the per-datagram hot paths')
+    parser.add_argument('--filter', default='',
+                        help='Only run the benchmarks whose name matches this regex')
+    parser.add_argument('--n', default='16,256,1024',
+                        help='Numbers of unacked datagrams or buffered frames '
+                             '(default: 16,256,1024)')
+    parser.add_argument('--k', default='1,16,64',
+                        help='Numbers of polled fds (default: 1,16,64)')
+    parser.add_argument('--rounds', type=int, default=7,
+                        help='Timed rounds per benchmark (default: 7)')
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        help='Minimum timed seconds per round (default: 0.1)')
+    parser.add_argument('--cpu', type=int, help='Pin the process to this CPU')
+    parser.add_argument('--output', help='File to write the results to as JSON')
+
+    return parser.parse_args()
+
+
+class Benchmark:
+    """An operation that is timed in batches.
+
+    setup() runs outside of the timed region before every batch: it restores
+    whatever state the previous batch changed (e.g. to keep N frames
+    buffered) and returns either the arguments to call op() with, one call
+    each, or the number of times to call op() without arguments.
+    """
+    def __init__(self, name: str, setup: Callable[[], Union[int, List[Any]]],
+                 op: Callable[..., Any], resources: Tuple = ()):
+        """
+        Args:
+            resources: objects (e.g. fds) to keep alive as long as the benchmark
+        """
+        self.name = name
+        self.setup = setup
+        self.op = op
+        self.resources_ = resources
+
+    def run_batch(self) -> Tuple[int, int]:
+        """Return the number of operations and the ns they took."""
+        args = self.setup()
+        op = self.op
+
+        if isinstance(args, int):
+            start = time.perf_counter_ns()
+            for _ in range(args):
+                op()
+            elapsed = time.perf_counter_ns() - start
+            return args, elapsed
+
+        start = time.perf_counter_ns()
+        for arg in args:
+            op(arg)
+        elapsed = time.perf_counter_ns() - start
+        return len(args), elapsed
+
+    def measure_time(self, rounds: int, min_time_s: float) -> List[float]:
+        """Return the ns/op of each round."""
+        self.run_batch()  # warm up
+
+        results = []
+        for _ in range(rounds):
+            # no collections in the middle of a round
+            gc.collect()
+            gc.disable()
+            try:
+                num_ops, total_ns = 0, 0
+                while total_ns < min_time_s * 1e9:
+                    ops, elapsed = self.run_batch()
+                    num_ops += ops
+                    total_ns += elapsed
+            finally:
+                gc.enable()
+
+            results.append(total_ns / num_ops)
+
+        return results
+
+    def measure_memory(self) -> Tuple[float, float]:
+        """Return the peak bytes allocated and the blocks left per operation.
+
+        CPython has no allocation counter, so the peak that tracemalloc
+        traces during each call stands in for the bytes allocated, and the
+        change in sys.getallocatedblocks() over the batch for what is kept.
+        """
+        args = self.setup()
+        calls = [()] * args if isinstance(args, int) else [(arg,) for arg in args]
+        op = self.op
+
+        gc.collect()
+        gc.disable()
+        tracemalloc.start()
+        try:
+            total_peak = 0
+            start_blocks = sys.getallocatedblocks()
+            for call in calls:
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                op(*call)
+                _, peak = tracemalloc.get_traced_memory()
+                total_peak += peak - before
+            blocks = sys.getallocatedblocks() - start_blocks
+        finally:
+            tracemalloc.stop()
+            gc.enable()
+
+        return total_peak / len(calls), blocks / len(calls)
+
+
+def full_datagram(frame_id: int = 0, frag_id: int = 0, frag_cnt: int = 1,
+                  frame_type: FrameType = FrameType.NONKEY) -> Datagram:
+    datagram = Datagram(frame_id, frame_type, frag_id, frag_cnt,
+                        bytes(Datagram.max_payload))
+    datagram.send_ts = timestamp_us()
+    return datagram
+
+
+def protocol_benchmarks() -> List[Benchmark]:
+    datagram = full_datagram()
+    binary = datagram.serialize_to_string()
+    parsed = Datagram(0, FrameType.UNKNOWN, 0, 0, b"")
+    ack = AckMsg(0, 0, timestamp_us())
+    ack_binary = ack.serialize_to_string()
+
+    return [
+        Benchmark("datagram_serialize", lambda: BATCH_SIZE, datagram.serialize_to_string),
+        Benchmark("datagram_parse", lambda: [binary] * BATCH_SIZE, parsed.parse_from_string),
+        Benchmark("msg_parse", lambda: [ack_binary] * BATCH_SIZE, Msg.parse_from_string),
+        Benchmark("ack_serialize", lambda: BATCH_SIZE, ack.serialize_to_string),
+    ]
+
+
+def histogram_benchmarks() -> List[Benchmark]:
+    hist = LatencyHistogram()
+    # RTT-like latencies (us) across a few octaves
+    latencies = [20000 + (i * 7919) % 80000 for i in range(BATCH_SIZE)]
+
+    return [Benchmark("histogram_record", lambda: latencies, hist.record)]
+
+
+def metrics_benchmarks() -> List[Benchmark]:
+    registry = MetricsRegistry({'role': 'bench'})
+    counter = registry.counter('bench_total', 'Benchmark counter')
+    histogram = registry.histogram('bench_seconds', 'Benchmark histogram')
+    latencies = [20000 + (i * 7919) % 80000 for i in range(BATCH_SIZE)]
+
+    # scraped like the encoder's and decoder's latency histograms
+    latency_hist = LatencyHistogram()
+    for latency in latencies:
+        latency_hist.record(latency)
+    registry.histogram('bench_latency_seconds', 'Benchmark latency histogram',
+                       fn=lambda: (latency_hist,))
+
+    return [
+        Benchmark("metrics_counter_inc", lambda: BATCH_SIZE, counter.inc),
+        Benchmark("metrics_histogram_observe", lambda: latencies, histogram.observe),
+        Benchmark("metrics_render", lambda: 1, registry.render),
+    ]
+
+
+def encoder_benchmarks(n: int) -> List[Benchmark]:
+    encoder = Encoder(640, 480, 30)
+    next_frame_id = 0
+
+    def setup() -> List[AckMsg]:
+        nonlocal next_frame_id
+        encoder.send_buf.clear()
+
+        # back to n unacked
+        while len(encoder.unacked) < n:
+            encoder.add_unacked(full_datagram(next_frame_id))
+            next_frame_id += 1
+
+        # in-order ACKs of the oldest datagrams
+        send_ts = timestamp_us()
+        return [AckMsg(frame_id, frag_id, send_ts)
+                for frame_id, frag_id in list(encoder.unacked)[:min(BATCH_SIZE, n)]]
+
+    return [Benchmark(f"encoder_handle_ack[N={n}]", setup, encoder.handle_ack)]
+
+
+def decoder_benchmarks(n: int) -> List[Benchmark]:
+    """Frames have two fragments and only the first has arrived."""
+    def make_decoder() -> Decoder:
+        return Decoder(640, 480, lazy_level=Decoder.LazyLevel.NO_DECODE_DISPLAY.value,
+                       max_buffered_frames=max(n + BATCH_SIZE, 1024))
+
+    def fill(decoder: Decoder, start: int, end: int) -> None:
+        for frame_id in range(start, end):
+            decoder.add_datagram(full_datagram(frame_id, 0, 2))
+
+    # add_datagram: the first fragment of new frames
+    add_decoder = make_decoder()
+    fill(add_decoder, 0, n)
+    add_end = n
+
+    def add_setup() -> List[Datagram]:
+        nonlocal add_end
+        # drop the frames added by the last batch, back to n buffered
+        add_decoder.advance_next_frame(add_end - n - add_decoder.next_frame_)
+        datagrams = [full_datagram(frame_id, 0, 2)
+                     for frame_id in range(add_end, add_end + BATCH_SIZE)]
+        add_end += BATCH_SIZE
+        return datagrams
+
+    # next_frame_complete: the next frame is incomplete
+    complete_decoder = make_decoder()
+    fill(complete_decoder, 0, n)
+
+    # clean_up_to: each call releases the oldest frame
+    clean_decoder = make_decoder()
+    clean_frontier, clean_end = 0, 0
+
+    def clean_setup() -> List[int]:
+        nonlocal clean_frontier, clean_end
+        fill(clean_decoder, clean_end, clean_frontier + n)
+        clean_end = clean_frontier + n
+
+        frontiers = list(range(clean_frontier + 1, clean_frontier + min(BATCH_SIZE, n) + 1))
+        clean_frontier = frontiers[-1]
+        return frontiers
+
+    return [
+        Benchmark(f"decoder_add_datagram[N={n}]", add_setup, add_decoder.add_datagram),
+        Benchmark(f"decoder_next_frame_complete[N={n}]", lambda: BATCH_SIZE,
+                  complete_decoder.next_frame_complete),
+        Benchmark(f"decoder_clean_up_to[N={n}]", clean_setup, clean_decoder.clean_up_to),
+    ]
+
+
+def poller_benchmarks(k: int) -> List[Benchmark]:
+    """k registered eventfds, one of which is always readable."""
+    poller = Poller()
+    eventfds = [Eventfd(0, EFD_NONBLOCK) for _ in range(k)]
+    for eventfd in eventfds:
+        poller.register_event(eventfd, Poller.In, lambda: None)
+    eventfds[0].notify()
+
+    return [Benchmark(f"poller_poll[k={k}]", lambda: [0] * BATCH_SIZE, poller.poll,
+                      tuple(eventfds))]
+
+
+def udp_benchmarks() -> List[Benchmark]:
+    """A connected pair of sockets on loopback exchanging full datagrams."""
+    sender_sock = UDPSocket()
+    receiver_sock = UDPSocket()
+    for sock in (sender_sock, receiver_sock):
+        sock.bind(Address(addr=("127.0.0.1", 0)))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        sock.set_blocking(False)
+    sender_sock.connect(receiver_sock.local_address())
+    receiver_sock.connect(sender_sock.local_address())
+
+    binary = full_datagram().serialize_to_string()
+
+    def drain() -> None:
+        while receiver_sock.recv() is not None:
+            pass
+
+    def send_setup() -> List[bytes]:
+        drain()
+        return [binary] * BATCH_SIZE
+
+    def recv_setup() -> int:
+        drain()
+        for _ in range(BATCH_SIZE):
+            sender_sock.send(binary)
+        return BATCH_SIZE
+
+    return [Benchmark("udp_send", send_setup, sender_sock.send),
+            Benchmark("udp_recv", recv_setup, receiver_sock.recv)]
+
+
+def main():
+    args = parse_arguments()
+
+    if args.cpu is not None:
+        os.sched_setaffinity(0, {args.cpu})
+
+    n_values = [int(n) for n in args.n.split(',')]
+    k_values = [int(k) for k in args.k.split(',')]
+
+    # empty loop iterations, to tell how much of the rest is the harness
+    benchmarks = [Benchmark("call_overhead", lambda: BATCH_SIZE, lambda: None)]
+    benchmarks += protocol_benchmarks()
+    benchmarks += histogram_benchmarks()
+    benchmarks += metrics_benchmarks()
+    for n in n_values:
+        benchmarks += encoder_benchmarks(n)
+    for n in n_values:
+        benchmarks += decoder_benchmarks(n)
+    for k in k_values:
+        benchmarks += poller_benchmarks(k)
+    benchmarks += udp_benchmarks()
+
+    pattern = re.compile(args.filter)
+    results: Dict[str, Dict[str, float]] = {}
+
+    for benchmark in benchmarks:
+        if not pattern.search(benchmark.name):
+            continue
+
+        ns_per_op = benchmark.measure_time(args.rounds, args.min_time)
+        alloc_bytes, net_blocks = benchmark.measure_memory()
+
+        results[benchmark.name] = {
+            'ns_per_op': statistics.median(ns_per_op),
+            'min_ns_per_op': min(ns_per_op),
+            'alloc_bytes_per_op': alloc_bytes,
+            'net_blocks_per_op': net_blocks,
+        }
+
+        print(f"{benchmark.name}: {double_to_string(statistics.median(ns_per_op))} ns/op "
+              f"(min {double_to_string(min(ns_per_op))}), "
+              f"{double_to_string(alloc_bytes)} alloc B/op, "
+              f"{double_to_string(net_blocks)} net blocks/op")
+
+    if args.output:
+        config = {name: getattr(args, name) for name in ['filter', 'n', 'k', 'rounds',
+                                                         'min_time', 'cpu']}
+        with open(args.output, 'w') as output_file:
+            json.dump({'config': config, 'results': results}, output_file, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
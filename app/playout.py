@@ -0,0 +1,169 @@
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple
+
+from utils.timerfd import Timerfd, TFD_NONBLOCK
+from utils.timestamp import timestamp_us
+from utils.conversion import double_to_string
+
+
+class PlayoutScheduler:
+    """Holds decodable frames until their playout deadline.
+
+    A frame's playout time is its sender timestamp plus the base transit
+    time (the smallest transit seen recently, which absorbs the clock offset
+    between sender and receiver) plus an adaptive target delay derived from
+    the jitter of frame transit times (RFC 3550 estimator). The target delay
+    follows jitter increases at once and decays slowly.
+
+    Frames are released in order when a Timerfd fires. A frame that
+    completes after its playout time is late; if it is late by more than a
+    frame interval it is still decoded (later frames depend on it) but is
+    not displayed.
+    """
+    MIN_TARGET_DELAY_US = 0
+    MAX_TARGET_DELAY_US = 500000  # 500 ms
+    JITTER_MULTIPLIER = 3
+    TARGET_DECAY_FRAMES = 64  # frames to close the gap to a lower target delay
+    BASE_WINDOW_US = 10000000  # 10 s
+
+    def __init__(self, release: Callable[['Frame'], None],
+                 clock: Callable[[], int] = timestamp_us):
+        """
+        Args:
+            release: called with each frame once it is due
+            clock: source of the current time in us, the one that stamps
+                   the frames' completion times
+        """
+        self.release_ = release
+        self.clock_ = clock
+
+        self.timer_ = Timerfd(flags=TFD_NONBLOCK)
+        self.timer_armed_ = False
+
+        # frames waiting for their playout time, in frame order
+        self.queue_: Deque[Tuple[int, 'Frame']] = deque()
+
+        # (complete ts, transit) with increasing transits: a sliding window minimum
+        self.base_window_: Deque[Tuple[int, int]] = deque()
+        self.last_transit_: Optional[int] = None
+        self.last_send_ts_: Optional[int] = None
+        self.jitter_us_ = 0.0
+        self.frame_interval_us_ = 0.0
+        self.target_delay_us_ = float(self.MIN_TARGET_DELAY_US)
+        self.last_playout_ts_ = 0
+
+        # stats since the last output
+        self.num_released_ = 0
+        self.num_late_ = 0
+        self.num_skipped_ = 0
+        self.total_added_delay_us_ = 0
+        self.max_added_delay_us_ = 0
+
+    def timer(self) -> Timerfd:
+        return self.timer_
+
+    def update_estimates(self, send_ts: int, complete_ts: int) -> None:
+        transit = complete_ts - send_ts
+
+        while self.base_window_ and self.base_window_[-1][1] >= transit:
+            self.base_window_.pop()
+        self.base_window_.append((complete_ts, transit))
+        while self.base_window_[0][0] < complete_ts - self.BASE_WINDOW_US:
+            self.base_window_.popleft()
+
+        if self.last_transit_ is not None:
+            self.jitter_us_ += (abs(transit - self.last_transit_) - self.jitter_us_) / 16
+        self.last_transit_ = transit
+
+        if self.last_send_ts_ is not None and send_ts > self.last_send_ts_:
+            interval = send_ts - self.last_send_ts_
+            if self.frame_interval_us_ == 0:
+                self.frame_interval_us_ = interval
+            else:
+                self.frame_interval_us_ += (interval - self.frame_interval_us_) / 16
+        self.last_send_ts_ = send_ts
+
+        target = min(max(self.JITTER_MULTIPLIER * self.jitter_us_, self.MIN_TARGET_DELAY_US),
+                     self.MAX_TARGET_DELAY_US)
+        if target > self.target_delay_us_:
+            self.target_delay_us_ = target
+        else:
+            self.target_delay_us_ += (target - self.target_delay_us_) / self.TARGET_DECAY_FRAMES
+
+    def schedule(self, frame: 'Frame') -> None:
+        send_ts = frame.send_ts()
+        complete_ts = frame.complete_ts()
+
+        # without timestamps there is no deadline to hold the frame for
+        if send_ts == 0 or complete_ts == 0:
+            playout_ts = self.last_playout_ts_
+        else:
+            self.update_estimates(send_ts, complete_ts)
+
+            base_transit = self.base_window_[0][1]
+            playout_ts = send_ts + base_transit + int(self.target_delay_us_)
+
+            lateness = complete_ts - playout_ts
+            if lateness > 0:
+                self.num_late_ += 1
+                if lateness > self.frame_interval_us_:
+                    frame.set_render(False)
+                    self.num_skipped_ += 1
+
+        # never release out of order
+        playout_ts = max(playout_ts, self.last_playout_ts_)
+        self.last_playout_ts_ = playout_ts
+
+        self.queue_.append((playout_ts, frame))
+        self.release_due()
+
+    def release_due(self) -> None:
+        now = self.clock_()
+
+        while self.queue_ and self.queue_[0][0] <= now:
+            _, frame = self.queue_.popleft()
+
+            if frame.complete_ts():
+                added_delay = now - frame.complete_ts()
+                self.total_added_delay_us_ += added_delay
+                self.max_added_delay_us_ = max(self.max_added_delay_us_, added_delay)
+            self.num_released_ += 1
+
+            self.release_(frame)
+
+        self.arm_timer(now)
+
+    def arm_timer(self, now: int) -> None:
+        if self.queue_:
+            delay_us = self.queue_[0][0] - now
+            self.timer_.set_time((delay_us // 1000000, delay_us % 1000000 * 1000), (0, 0))
+            self.timer_armed_ = True
+        elif self.timer_armed_:
+            self.timer_.set_time((0, 0), (0, 0))  # disarm
+            self.timer_armed_ = False
+
+    def handle_timer(self) -> None:
+        try:
+            self.timer_.read_expirations()
+        except BlockingIOError:
+            return  # re-armed since it fired
+
+        self.timer_armed_ = False
+        self.release_due()
+
+    def output_periodic_stats(self) -> None:
+        print(f"  - Playout: target delay (ms): "
+              f"{double_to_string(self.target_delay_us_ / 1000)}, "
+              f"jitter (ms): {double_to_string(self.jitter_us_ / 1000)}")
+
+        if self.num_released_ > 0:
+            print(f"  - Playout: avg/max added delay (ms): "
+                  f"{double_to_string(self.total_added_delay_us_ / self.num_released_ / 1000)}/"
+                  f"{double_to_string(self.max_added_delay_us_ / 1000)}, "
+                  f"late frames: {self.num_late_}, skipped frames: {self.num_skipped_}")
+
+        self.num_released_ = 0
+        self.num_late_ = 0
+        self.num_skipped_ = 0
+        self.total_added_delay_us_ = 0
+        self.max_added_delay_us_ = 0
@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import signal
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from utils.conversion import double_to_string
+
+
+class StageProfiler:
+    """Wall time spent in named stages, in monotonic ns, per stats period.
+
+    Stages may nest (e.g. 'encode' runs inside 'handle_fps_timer'); each is
+    only ever updated by one thread, so no lock is needed (a sample racing
+    with the end of a period may land in either). The period's
+    process CPU time is reported alongside for comparison.
+    """
+
+    def __init__(self, name: str):
+        self.name_ = name
+        # stage: [calls, total ns, max ns], in order of first use
+        self.stages_: Dict[str, List[int]] = {}
+        self.period_start_ns_ = time.monotonic_ns()
+        self.period_start_cpu_ns_ = time.process_time_ns()
+
+    def add(self, stage: str, elapsed_ns: int) -> None:
+        stats = self.stages_.get(stage)
+        if stats is None:
+            stats = self.stages_[stage] = [0, 0, 0]
+
+        stats[0] += 1
+        stats[1] += elapsed_ns
+        if elapsed_ns > stats[2]:
+            stats[2] = elapsed_ns
+
+    def add_since(self, stage: str, start_ns: int) -> int:
+        """Add the time since start_ns to 'stage' and return the current time,
+        to time the next stage from."""
+        now_ns = time.monotonic_ns()
+        self.add(stage, now_ns - start_ns)
+        return now_ns
+
+    def wrap(self, stage: str, callback: Callable[[], None]) -> Callable[[], None]:
+        """Time every call of 'callback' (e.g. a Poller callback) as 'stage'."""
+        def timed_callback():
+            start_ns = time.monotonic_ns()
+            try:
+                callback()
+            finally:
+                self.add(stage, time.monotonic_ns() - start_ns)
+
+        return timed_callback
+
+    def output_periodic_stats(self) -> None:
+        now_ns = time.monotonic_ns()
+        cpu_ns = time.process_time_ns()
+        wall_ms = (now_ns - self.period_start_ns_) / 1e6
+        cpu_ms = (cpu_ns - self.period_start_cpu_ns_) / 1e6
+
+        print(f"[{self.name_}] Profile of the last {double_to_string(wall_ms)} ms: "
+              f"process CPU {double_to_string(cpu_ms)} ms")
+        # stages may be added by another thread meanwhile
+        for stage, (calls, total_ns, max_ns) in list(self.stages_.items()):
+            if calls == 0:
+                continue
+            print(f"  - {stage}: {calls} calls, {double_to_string(total_ns / 1e6)} ms "
+                  f"({double_to_string(100 * total_ns / 1e6 / wall_ms)}%), "
+                  f"avg/max {double_to_string(total_ns / calls / 1e3)}/"
+                  f"{double_to_string(max_ns / 1e3)} us")
+            self.stages_[stage] = [0, 0, 0]
+
+        self.period_start_ns_ = now_ns
+        self.period_start_cpu_ns_ = cpu_ns
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of every thread for a window of time and
+    writes them in the collapsed format of flamegraph.pl and speedscope.
+
+    A background thread takes the samples from sys._current_frames() only
+    while a window is open. Samples are of wall time: a loop waiting in
+    poll() shows up there, and as calls into libvpx and SDL release the GIL,
+    time spent in them is attributed to the Python frame that made the call.
+    """
+    INTERVAL_S = 0.005
+
+    def __init__(self, output_prefix: str, window_s: float):
+        self.output_prefix_ = output_prefix
+        self.window_s_ = window_s
+        self.sampler_: Optional[threading.Thread] = None
+        self.num_windows_ = 0
+
+    def start(self) -> bool:
+        """Open a sampling window unless one is already open."""
+        if self.sampler_ and self.sampler_.is_alive():
+            return False
+
+        self.num_windows_ += 1
+        output_path = f"{self.output_prefix_}.{os.getpid()}.{self.num_windows_}.folded"
+        self.sampler_ = threading.Thread(target=self.sample, args=(output_path,), daemon=True)
+        self.sampler_.start()
+        return True
+
+    def sample(self, output_path: str) -> None:
+        own_id = threading.get_ident()
+        thread_names = {}
+        stacks: Counter = Counter()
+        num_samples = 0
+
+        deadline = time.monotonic() + self.window_s_
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                if thread_id not in thread_names:
+                    thread_names.update((thread.ident, thread.name)
+                                        for thread in threading.enumerate())
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                                 f"{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(stack))] += 1
+
+            num_samples += 1
+            time.sleep(self.INTERVAL_S)
+
+        with open(output_path, 'w') as output_file:
+            for stack, count in stacks.items():
+                output_file.write(f"{stack} {count}\n")
+
+        print(f"Sampling profiler: wrote {num_samples} samples to {output_path}",
+              file=sys.stderr)
+
+    def start_on_signal(self, signum: int = signal.SIGUSR1) -> None:
+        """Open a sampling window whenever the process receives 'signum'."""
+        def handle_signal(signum, frame):
+            if self.start():
+                print(f"Sampling profiler: sampling for {self.window_s_} s", file=sys.stderr)
+
+        signal.signal(signum, handle_signal)
@@ -30,6 +30,7 @@ class Datagram:
          # Add retransmission-related members
         self.num_rtx = 0         # Number of retransmissions
         self.last_send_ts = 0    # Last send timestamp
+        self.first_send_ts = 0   # First send timestamp
 
 
     @classmethod
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import time
+import argparse
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from encoder import Encoder
+from decoder import Decoder
+from protocol import Datagram, AckMsg, Msg, MsgType, FrameType
+from impairment import LinkParams, ImpairedLink
+from event_trace import EventTracer, Event
+from impairment_proxy import LINK_OPTIONS, TRACE_OPTIONS, DIRECTIONS, link_params, make_trace_link
+from video.image import RawImage
+from video.video_input import VideoInput
+from video.yuv4mpeg import YUV4MPEG
+from video.synthetic import SyntheticVideoInput, Pattern
+from utils.timestamp import VirtualClock
+from utils.conversion import double_to_string
+from utils.histogram import LatencyHistogram
+
+# the wire format takes a zero timestamp for unknown, so time starts later
+START_TS_US = 1000000
+
+
+def print_usage(program_name: str) -> None:
+    link_options = "".join(
+        f"    --{{down,up}}-{option:<13}{help}\n"
+        for option, _, _, help in LINK_OPTIONS + TRACE_OPTIONS)
+
+    usage_msg = f"""Usage: {program_name} [options] [y4m]
+
+Runs the sender's Encoder and the receiver's Decoder (lazy level 2) against
+each other through modelled links on a virtual clock, i.e. as fast as the
+encoding allows rather than in real time. Given the same inputs, seed and
+(replayed) bitstream, runs are bit-identical. Without a y4m clip, frames
+are generated with --synthetic.
+
+Options:
+    --width <W>, --height <H>   resolution (default: 704x576)
+    --fps <FPS>                 frame rate (default: 30)
+    --cbr <kbps>                target bitrate (default: 2000)
+    --synthetic <pattern>       generate frames (static, gradient or noise) instead of reading y4m
+    --scene-cut <N>             frames per scene of the synthetic input (default: 0, one scene)
+    --bitstream-cache <dir>     replay encoded frames of the looping clip from a cache
+    --mtu <MTU>                 MTU for deciding UDP payload size
+    --duration <s>              seconds of virtual time to simulate (default: 60)
+{link_options}    --script <file>             JSON list of {{"at": <s>, "down": {{...}}, "up": {{...}}}} parameter changes
+    --seed <N>                  seed of the loss, jitter and reordering draws (default: 0)
+    --sender-log <file>         file to write the sender's -o log to
+    --receiver-log <file>       file to write the receiver's -o log to
+    --sender-events <file>      file to record the sender's per-packet event trace to
+    --receiver-events <file>    file to record the receiver's per-packet event trace to
+"""
+    print(usage_msg, file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Simulate a sender-receiver session on a virtual clock')
+    parser.add_argument('y4m', nargs='?', help='YUV4MPEG input file')
+    parser.add_argument('--width', type=int, default=704, help='Width (default: 704)')
+    parser.add_argument('--height', type=int, default=576, help='Height (default: 576)')
+    parser.add_argument('--fps', type=int, default=30, help='Frame rate (default: 30)')
+    parser.add_argument('--cbr', type=int, default=2000,
+                        help='Target bitrate in kbps (default: 2000)')
+    parser.add_argument('--synthetic', choices=[p.value for p in Pattern],
+                        help='Generate frames of the given pattern instead of '
+                             'reading a YUV4MPEG input')
+    parser.add_argument('--scene-cut', type=int, default=0, metavar='N',
+                        help='Frames per scene of the synthetic input '
+                             '(default: 0, a single scene)')
+    parser.add_argument('--bitstream-cache', metavar='DIR',
+                        help='Directory of cached encodings to replay instead of '
+                             're-encoding the looping clip')
+    parser.add_argument('--mtu', type=int, help='MTU for deciding UDP payload size')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='Seconds of virtual time to simulate (default: 60)')
+
+    for direction in DIRECTIONS:
+        for option, param, param_type, help in LINK_OPTIONS + TRACE_OPTIONS:
+            parser.add_argument(f'--{direction}-{option}', dest=f'{direction}_{param}',
+                                type=param_type, help=f'{direction}: {help}')
+
+    parser.add_argument('--script',
+                        help='JSON list of {"at": <s>, "down": {...}, "up": {...}} '
+                             'parameter changes')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the loss, jitter and reordering draws (default: 0)')
+    parser.add_argument('--sender-log', help="File to write the sender's -o log to")
+    parser.add_argument('--receiver-log', help="File to write the receiver's -o log to")
+    parser.add_argument('--sender-events',
+                        help="File to record the sender's per-packet event trace to")
+    parser.add_argument('--receiver-events',
+                        help="File to record the receiver's per-packet event trace to")
+
+    args = parser.parse_args()
+    if bool(args.synthetic) == bool(args.y4m):
+        parser.error("either a y4m input or --synthetic is required")
+    if args.synthetic and args.bitstream_cache:
+        parser.error("--synthetic can't be combined with --bitstream-cache")
+
+    return args
+
+
+class SessionSimulator:
+    """Drives an Encoder and a Decoder through two links in virtual time.
+
+    The loop jumps from event to event: frame ticks, packet deliveries of
+    either link and scripted parameter changes. Events at the same time
+    are handled in a fixed order (deliveries to the receiver, deliveries
+    to the sender, script, frame tick), and encoding as well as sending
+    take no virtual time: every datagram in the send buffer goes out at
+    once, as if the socket were always writable.
+    """
+    def __init__(self, clock: VirtualClock, encoder: Encoder, decoder: Decoder,
+                 video_input: VideoInput, frame_rate: int, links: Dict):
+        """
+        Args:
+            links: the 'down' (sender to receiver) and 'up' link, each an
+                   ImpairedLink or a TraceLink
+        """
+        self.clock_ = clock
+        self.encoder_ = encoder
+        self.decoder_ = decoder
+        self.video_input_ = video_input
+        self.raw_img_ = RawImage(video_input.display_width(), video_input.display_height())
+        self.frame_interval_us_ = 1000000 / frame_rate
+        self.links_ = links
+
+        self.start_ts_ = clock()
+        self.num_frames_ = 0
+        self.next_frame_ts_ = self.start_ts_
+
+        # (time since start in us, direction, parameters), in time order
+        self.script_: List = []
+
+        # generation ts of the frames not decodable yet, in frame ID order
+        self.generation_ts_: Deque[Tuple[int, int]] = deque()
+        self.frame_latency_hist_ = LatencyHistogram()
+
+        # opt-in per-packet event trace of the sender
+        self.event_tracer_: Optional[EventTracer] = None
+
+        self.num_sent_ = 0
+        self.bytes_sent_ = 0
+        self.num_rtx_ = 0
+        self.num_acks_ = 0
+
+    def set_event_tracer(self, event_tracer: EventTracer) -> None:
+        """Record the datagrams sent to the sender's event trace."""
+        self.event_tracer_ = event_tracer
+
+    def load_script(self, script: List[Dict]) -> None:
+        """Schedule parameter changes: [{"at": <s>, "down": {...}, "up": {...}}, ...]."""
+        for step in script:
+            for direction in DIRECTIONS:
+                if direction in step:
+                    self.script_.append((int(step['at'] * 1000000), direction, step[direction]))
+        self.script_.sort(key=lambda change: change[0])
+
+    def next_event_ts(self) -> int:
+        next_ts = self.next_frame_ts_
+        for link in self.links_.values():
+            delivery_ts = link.next_delivery_ts()
+            if delivery_ts is not None:
+                next_ts = min(next_ts, delivery_ts)
+        if self.script_:
+            next_ts = min(next_ts, self.start_ts_ + self.script_[0][0])
+        return next_ts
+
+    def run(self, duration_s: float) -> None:
+        end_ts = self.start_ts_ + int(duration_s * 1000000)
+
+        while True:
+            now = self.next_event_ts()
+            if now >= end_ts:
+                break
+            self.clock_.advance_to(now)
+
+            self.deliver_to_receiver(now)
+            self.deliver_to_sender(now)
+            self.apply_script(now)
+            if self.next_frame_ts_ <= now:
+                self.handle_frame_tick(now)
+
+    def handle_frame_tick(self, now: int) -> None:
+        if not self.video_input_.read_frame(self.raw_img_):
+            raise RuntimeError("Reached end of video input")
+
+        self.generation_ts_.append((self.encoder_.frame_id_, now))
+        self.encoder_.compress_frame(self.raw_img_)
+        self.send_datagrams(now)
+
+        self.num_frames_ += 1
+        self.next_frame_ts_ = self.start_ts_ + int(self.num_frames_ * self.frame_interval_us_)
+
+    def send_datagrams(self, now: int) -> None:
+        send_buf = self.encoder_.send_buf
+        link = self.links_['down']
+
+        while send_buf:
+            datagram = send_buf.popleft()
+            datagram.send_ts = now
+            raw_data = datagram.serialize_to_string()
+            link.send(raw_data, now)
+            if self.event_tracer_:
+                self.event_tracer_.record(Event.RTX if datagram.num_rtx else Event.SEND,
+                                          datagram.frame_id, datagram.frag_id, len(raw_data))
+
+            self.num_sent_ += 1
+            self.bytes_sent_ += len(raw_data)
+            if datagram.num_rtx == 0:
+                self.encoder_.add_unacked(datagram)
+            else:
+                self.num_rtx_ += 1
+
+    def deliver_to_receiver(self, now: int) -> None:
+        ack_link = self.links_['up']
+        decoder = self.decoder_
+
+        for raw_data in self.links_['down'].deliver(now):
+            datagram = Datagram(0, FrameType.UNKNOWN, 0, 0, b"")
+            if not datagram.parse_from_string(raw_data):
+                raise RuntimeError("Failed to parse datagram")
+
+            ack = AckMsg(datagram.frame_id, datagram.frag_id, datagram.send_ts)
+            ack_link.send(ack.serialize_to_string(), now)
+
+            decoder.add_datagram(datagram)
+            while decoder.next_frame_complete():
+                self.record_decodable(decoder.next_frame_, now)
+                decoder.consume_next_frame()
+
+    def record_decodable(self, frame_id: int, now: int) -> None:
+        # frames skipped over by a recovery never become decodable
+        while self.generation_ts_ and self.generation_ts_[0][0] < frame_id:
+            self.generation_ts_.popleft()
+
+        if self.generation_ts_ and self.generation_ts_[0][0] == frame_id:
+            self.frame_latency_hist_.record(now - self.generation_ts_.popleft()[1])
+
+    def deliver_to_sender(self, now: int) -> None:
+        raw_acks = self.links_['up'].deliver(now)
+        for raw_data in raw_acks:
+            msg = Msg.parse_from_string(raw_data)
+            if msg is None or msg.type != MsgType.ACK:
+                continue
+
+            self.encoder_.handle_ack(msg)
+            self.num_acks_ += 1
+
+        # retransmissions go out right away
+        if raw_acks:
+            self.send_datagrams(now)
+
+    def apply_script(self, now: int) -> None:
+        while self.script_ and self.start_ts_ + self.script_[0][0] <= now:
+            _, direction, params = self.script_.pop(0)
+
+            link = self.links_[direction]
+            if not isinstance(link, ImpairedLink):
+                raise RuntimeError(f"{direction}: only impairment parameters can be changed")
+            link.params().update(**params)
+
+    def output_stats(self) -> None:
+        elapsed_us = self.clock_() - self.start_ts_
+        print(f"Frames: sent {self.num_frames_}, decodable {self.frame_latency_hist_.count()}")
+        print(f"Datagrams: sent {self.num_sent_} ({self.num_rtx_} retransmissions), "
+              f"acked {self.num_acks_}")
+
+        if elapsed_us > 0:
+            print(f"Sending rate (kbps): "
+                  f"{double_to_string(self.bytes_sent_ * 8000 / elapsed_us)}")
+
+        if self.frame_latency_hist_.count():
+            print(f"Frame latency (ms): {self.frame_latency_hist_.format()}")
+
+        # the encoder's periodic stats are never output here, so its
+        # histograms cover the whole session
+        for name, hist in (('RTT', self.encoder_.rtt_hist_),
+                           ('ACK delay', self.encoder_.ack_delay_hist_)):
+            if hist.count():
+                print(f"{name} (ms): {hist.format()}")
+
+        for direction in DIRECTIONS:
+            self.links_[direction].output_periodic_stats(direction)
+
+
+def main():
+    args = parse_arguments()
+
+    if args.mtu:
+        Datagram.set_mtu(args.mtu)
+
+    if args.synthetic:
+        video_input = SyntheticVideoInput(args.width, args.height, Pattern(args.synthetic),
+                                          args.scene_cut)
+    else:
+        video_input = YUV4MPEG(args.y4m, args.width, args.height)
+
+    clock = VirtualClock(START_TS_US)
+
+    encoder = Encoder(args.width, args.height, args.fps, args.sender_log or "", clock=clock)
+    encoder.set_target_bitrate(args.cbr)
+    if args.bitstream_cache:
+        encoder.set_bitstream_cache(args.bitstream_cache, args.y4m, video_input.frame_count())
+
+    decoder = Decoder(args.width, args.height, Decoder.LazyLevel.NO_DECODE_DISPLAY.value,
+                      args.receiver_log or "", clock=clock)
+
+    links = {}
+    for seed, direction in enumerate(DIRECTIONS, args.seed):
+        params = link_params(args, direction)
+        if getattr(args, f'{direction}_trace'):
+            links[direction] = make_trace_link(args, direction, params)
+        else:
+            links[direction] = ImpairedLink(LinkParams(**params), seed)
+
+    simulator = SessionSimulator(clock, encoder, decoder, video_input, args.fps, links)
+
+    event_tracers = []
+    if args.sender_events:
+        event_tracers.append(EventTracer(args.sender_events, 'sender', clock))
+        encoder.set_event_tracer(event_tracers[-1])
+        simulator.set_event_tracer(event_tracers[-1])
+    if args.receiver_events:
+        event_tracers.append(EventTracer(args.receiver_events, 'receiver', clock))
+        decoder.set_event_tracer(event_tracers[-1])
+    if args.script:
+        with open(args.script) as script_file:
+            simulator.load_script(json.load(script_file))
+
+    start = time.monotonic()
+    simulator.run(args.duration)
+    elapsed = time.monotonic() - start
+
+    print(f"Simulated {double_to_string(args.duration)} s in {double_to_string(elapsed)} s "
+          f"({double_to_string(args.duration / elapsed)}x real time)")
+    simulator.output_stats()
+
+    for event_tracer in event_tracers:
+        event_tracer.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import os
+import struct
+
+import numpy as np
+
+from utils.file_descriptor import FileDescriptor
+from utils.exception_rim import check_syscall
+
+
+class EncoderTelemetry:
+    """Per-frame encoder records in a compact fixed-size binary layout.
+
+    The file starts with HEADER and is followed by one RECORD per encoded
+    frame. Records are packed into a preallocated buffer and written with a
+    single os.write() once FLUSH_RECORDS frames are pending (or on flush()),
+    so the per-frame cost is one struct.pack_into().
+    """
+    MAGIC = b"RMTELEM1"
+
+    # magic, width, height, frame rate, record size
+    HEADER = struct.Struct('<8sHHHH')
+
+    # frame_id, target bitrate (kbps), frame size (bytes), fragment count,
+    # key frame flag, last quantizer (-1 if unknown), PSNR in dB (0 if unknown),
+    # frame generation timestamp (us), encode time (us), send queue delay (us)
+    RECORD = struct.Struct('<IIIHBhdQII')
+
+    # numpy view of RECORD, used by load()
+    DTYPE = np.dtype([
+        ('frame_id', '<u4'),
+        ('target_bitrate', '<u4'),
+        ('frame_size', '<u4'),
+        ('frag_cnt', '<u2'),
+        ('key', 'u1'),
+        ('qp', '<i2'),
+        ('psnr', '<f8'),
+        ('gen_ts', '<u8'),
+        ('encode_time_us', '<u4'),
+        ('queue_delay_us', '<u4'),
+    ])
+
+    FLUSH_RECORDS = 64
+
+    def __init__(self, output_path: str, width: int, height: int, frame_rate: int):
+        self.fd_ = FileDescriptor(check_syscall(
+            os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)))
+
+        os.write(self.fd_.fd_num(), self.HEADER.pack(
+            self.MAGIC, width, height, frame_rate, self.RECORD.size))
+
+        self.buf_ = bytearray(self.RECORD.size * self.FLUSH_RECORDS)
+        self.num_pending_ = 0
+
+    def record(self, frame_id: int, target_bitrate: int, frame_size: int,
+               frag_cnt: int, key: bool, qp: int, psnr: float, gen_ts: int,
+               encode_time_us: int, queue_delay_us: int) -> None:
+        self.RECORD.pack_into(self.buf_, self.num_pending_ * self.RECORD.size,
+                              frame_id, target_bitrate, frame_size, frag_cnt,
+                              key, qp, psnr, gen_ts, encode_time_us, queue_delay_us)
+        self.num_pending_ += 1
+
+        if self.num_pending_ == self.FLUSH_RECORDS:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.num_pending_ == 0:
+            return
+
+        data = memoryview(self.buf_)[:self.num_pending_ * self.RECORD.size]
+        while data:
+            data = data[os.write(self.fd_.fd_num(), data):]
+
+        self.num_pending_ = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.fd_.close()
+
+    @classmethod
+    def load(cls, path: str) -> np.ndarray:
+        """Load a telemetry file into a numpy structured array (see DTYPE)."""
+        with open(path, 'rb') as f:
+            magic, _, _, _, record_size = cls.HEADER.unpack(f.read(cls.HEADER.size))
+
+        if magic != cls.MAGIC or record_size != cls.DTYPE.itemsize:
+            raise RuntimeError("EncoderTelemetry: invalid telemetry file")
+
+        return np.fromfile(path, dtype=cls.DTYPE, offset=cls.HEADER.size)
@@ -0,0 +1,228 @@
+from enum import Enum
+from bisect import bisect_right
+from collections import deque
+from typing import Deque, List, Optional, TextIO, Tuple
+
+from utils.conversion import double_to_string
+
+# bytes that may leave the queue at each delivery opportunity, as in Mahimahi
+MTU_BYTES = 1504
+
+
+class DropPolicy(Enum):
+    DROP_TAIL = "droptail"  # drop arriving packets when the queue is full
+    DROP_HEAD = "drophead"  # drop the oldest waiting packets to make room
+
+
+def load_trace(trace_path: str) -> List[int]:
+    """Read a Mahimahi trace: one delivery opportunity per line, in ms."""
+    trace = []
+    with open(trace_path) as trace_file:
+        for line in trace_file:
+            line = line.strip()
+            if not line:
+                continue
+
+            ts = int(line)
+            if trace and ts < trace[-1]:
+                raise RuntimeError(f"{trace_path}: timestamps must not decrease")
+            trace.append(ts)
+
+    if not trace or trace[-1] == 0:
+        raise RuntimeError(f"{trace_path}: trace must span at least 1 ms")
+
+    return trace
+
+
+class TraceLink:
+    """One direction of a link that replays a Mahimahi packet-delivery trace.
+
+    At every timestamp of the trace MTU_BYTES may leave the queue; the trace
+    repeats with the period of its last timestamp. A packet leaves once
+    opportunities have covered all of its bytes, and bytes of an opportunity
+    that find the queue empty are wasted. Departed packets are delivered
+    after a fixed propagation delay.
+
+    Like ImpairedLink it is driven by the times passed to send() and
+    deliver() (in us, starting at the first call), so it runs just as well
+    on a virtual clock. With a log file it writes a Mahimahi-style log:
+    arrivals ('+'), opportunities ('#'), departures ('-' with the queueing
+    delay) and drops ('d'). Opportunities that pass while the queue is idle
+    are skipped over at once and not logged.
+    """
+    def __init__(self, trace: List[int], queue_bytes: int = 0, queue_packets: int = 0,
+                 drop_policy: DropPolicy = DropPolicy.DROP_TAIL, delay_ms: float = 0,
+                 log: Optional[TextIO] = None):
+        """
+        Args:
+            queue_bytes, queue_packets: limits of the queue (0: unlimited)
+        """
+        self.trace_ = trace
+        self.period_ms_ = trace[-1]
+        self.queue_bytes_limit_ = queue_bytes
+        self.queue_packets_limit_ = queue_packets
+        self.drop_policy_ = drop_policy
+        self.delay_us_ = int(delay_ms * 1000)
+        self.log_ = log
+
+        self.base_ts_: Optional[int] = None
+        self.next_opportunity_ = 0  # counts across repetitions of the trace
+
+        # (arrival ts, payload) of waiting packets
+        self.queue_: Deque[Tuple[int, bytes]] = deque()
+        self.queue_bytes_ = 0
+
+        # packet being served: (arrival ts, payload), bytes still to serve
+        self.in_transit_: Optional[Tuple[int, bytes]] = None
+        self.in_transit_left_ = 0
+
+        # (delivery ts, payload) of departed packets
+        self.out_: Deque[Tuple[int, bytes]] = deque()
+
+        # stats since the last output
+        self.num_delivered_ = 0
+        self.num_departed_ = 0
+        self.num_dropped_ = 0
+        self.bytes_delivered_ = 0
+        self.bytes_offered_ = 0  # capacity of the opportunities
+        self.total_queue_delay_us_ = 0
+        self.max_queue_delay_us_ = 0
+
+    def opportunity_ts(self, opportunity: int) -> int:
+        repetition, index = divmod(opportunity, len(self.trace_))
+        return self.base_ts_ + (repetition * self.period_ms_ + self.trace_[index]) * 1000
+
+    def log(self, ts: int, event: str) -> None:
+        if self.log_ is not None:
+            self.log_.write(f"{(ts - self.base_ts_) // 1000} {event}\n")
+
+    def start(self, now: int) -> None:
+        self.base_ts_ = now
+        if self.log_ is not None:
+            self.log_.write(f"# base timestamp: {now // 1000}\n")
+
+    def advance(self, now: int) -> None:
+        """Serve the queue at the opportunities up to 'now'."""
+        if self.base_ts_ is None:
+            self.start(now)
+
+        if self.in_transit_ is None and not self.queue_:
+            self.skip_idle(now)
+
+        while True:
+            opportunity_ts = self.opportunity_ts(self.next_opportunity_)
+            if opportunity_ts > now:
+                break
+            self.next_opportunity_ += 1
+
+            self.bytes_offered_ += MTU_BYTES
+            self.log(opportunity_ts, f"# {MTU_BYTES}")
+
+            budget = MTU_BYTES
+            while budget > 0:
+                if self.in_transit_ is None:
+                    if not self.queue_:
+                        break
+                    self.in_transit_ = self.queue_.popleft()
+                    self.in_transit_left_ = len(self.in_transit_[1])
+                    self.queue_bytes_ -= self.in_transit_left_
+
+                served = min(budget, self.in_transit_left_)
+                budget -= served
+                self.in_transit_left_ -= served
+
+                if self.in_transit_left_ == 0:
+                    self.depart(opportunity_ts)
+
+    def skip_idle(self, now: int) -> None:
+        # the first opportunity after 'now'
+        repetition, offset = divmod((now - self.base_ts_) // 1000, self.period_ms_)
+        opportunity = repetition * len(self.trace_) + bisect_right(self.trace_, offset)
+
+        if opportunity > self.next_opportunity_:
+            self.bytes_offered_ += (opportunity - self.next_opportunity_) * MTU_BYTES
+            self.next_opportunity_ = opportunity
+
+    def depart(self, ts: int) -> None:
+        arrival_ts, data = self.in_transit_
+        self.in_transit_ = None
+
+        queue_delay = ts - arrival_ts
+        self.log(ts, f"- {len(data)} {queue_delay // 1000}")
+        self.num_departed_ += 1
+        self.total_queue_delay_us_ += queue_delay
+        self.max_queue_delay_us_ = max(self.max_queue_delay_us_, queue_delay)
+
+        self.out_.append((ts + self.delay_us_, data))
+
+    def full(self, size: int) -> bool:
+        return ((self.queue_bytes_limit_ and self.queue_bytes_ + size > self.queue_bytes_limit_)
+                or (self.queue_packets_limit_ and len(self.queue_) + 1 > self.queue_packets_limit_))
+
+    def drop(self, ts: int, size: int) -> None:
+        self.log(ts, f"d 1 {size}")
+        self.num_dropped_ += 1
+
+    def send(self, data: bytes, now: int) -> None:
+        self.advance(now)
+        self.log(now, f"+ {len(data)}")
+
+        if self.full(len(data)):
+            if self.drop_policy_ == DropPolicy.DROP_TAIL:
+                self.drop(now, len(data))
+                return
+
+            while self.queue_ and self.full(len(data)):
+                _, dropped = self.queue_.popleft()
+                self.queue_bytes_ -= len(dropped)
+                self.drop(now, len(dropped))
+
+            if self.full(len(data)):  # larger than the whole queue
+                self.drop(now, len(data))
+                return
+
+        self.queue_.append((now, data))
+        self.queue_bytes_ += len(data)
+
+    def next_delivery_ts(self) -> Optional[int]:
+        if self.out_:
+            return self.out_[0][0]
+        if self.in_transit_ is not None or self.queue_:
+            # the earliest a waiting packet can get out
+            return self.opportunity_ts(self.next_opportunity_) + self.delay_us_
+        return None
+
+    def deliver(self, now: int) -> List[bytes]:
+        """Remove and return the packets due by 'now', in delivery order."""
+        if self.base_ts_ is None:
+            self.start(now)
+        self.advance(now - self.delay_us_)
+
+        delivered = []
+        while self.out_ and self.out_[0][0] <= now:
+            data = self.out_.popleft()[1]
+            self.bytes_delivered_ += len(data)
+            delivered.append(data)
+
+        self.num_delivered_ += len(delivered)
+        return delivered
+
+    def output_periodic_stats(self, name: str) -> None:
+        print(f"[{name}] delivered: {self.num_delivered_}, dropped: {self.num_dropped_}", end='')
+
+        if self.bytes_offered_ > 0:
+            print(f", link utilization: "
+                  f"{double_to_string(100 * self.bytes_delivered_ / self.bytes_offered_)}%", end='')
+        if self.num_departed_ > 0:
+            print(f", avg/max queueing delay (ms): "
+                  f"{double_to_string(self.total_queue_delay_us_ / self.num_departed_ / 1000)}/"
+                  f"{double_to_string(self.max_queue_delay_us_ / 1000)}", end='')
+        print()
+
+        self.num_delivered_ = 0
+        self.num_departed_ = 0
+        self.num_dropped_ = 0
+        self.bytes_delivered_ = 0
+        self.bytes_offered_ = 0
+        self.total_queue_delay_us_ = 0
+        self.max_queue_delay_us_ = 0
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import argparse
+from typing import Dict, List
+
+import numpy as np
+
+from protocol import Datagram, FrameType
+from trace_link import TraceLink, DropPolicy, load_trace
+from video.ivf import IVFReader
+from utils.conversion import double_to_string
+
+IP_UDP_HEADER_SIZE = 28
+
+
+def print_usage(program_name: str) -> None:
+    usage_msg = f"""Usage: {program_name} [options] trace ivf
+
+Replays the frames of a recorded IVF stream, packetized like the sender
+does and sent at the stream's frame rate, through a Mahimahi trace on a
+virtual clock, i.e. as fast as possible rather than in real time.
+
+Options:
+    --queue-bytes <N>      queue size in bytes (default: unlimited)
+    --queue-packets <N>    queue size in packets (default: unlimited)
+    --drop-policy <p>      droptail or drophead (default: droptail)
+    --delay <ms>           one-way propagation delay (default: 0)
+    --frames <N>           number of frames to send (default: whole file)
+    --log <file>           file to write the Mahimahi-style link log to
+"""
+    print(usage_msg, file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Replay a recorded stream through a Mahimahi trace faster than real time')
+    parser.add_argument('trace', help='Mahimahi packet-delivery trace')
+    parser.add_argument('ivf', help='IVF file recorded by the sender or receiver')
+    parser.add_argument('--queue-bytes', type=int, default=0,
+                        help='Queue size in bytes (default: unlimited)')
+    parser.add_argument('--queue-packets', type=int, default=0,
+                        help='Queue size in packets (default: unlimited)')
+    parser.add_argument('--drop-policy', choices=[p.value for p in DropPolicy],
+                        default=DropPolicy.DROP_TAIL.value,
+                        help='Queue drop policy (default: droptail)')
+    parser.add_argument('--delay', type=float, default=0,
+                        help='One-way propagation delay in ms (default: 0)')
+    parser.add_argument('--frames', type=int, default=0,
+                        help='Number of frames to send (default: whole file)')
+    parser.add_argument('--log', help='File to write the Mahimahi-style link log to')
+
+    return parser.parse_args()
+
+
+def packetize(frame_id: int, frame_type: FrameType, payload) -> List[Datagram]:
+    frag_cnt = max(1, -(-len(payload) // Datagram.max_payload))
+    return [Datagram(frame_id, frame_type, frag_id, frag_cnt,
+                     bytes(payload[frag_id * Datagram.max_payload:
+                                   (frag_id + 1) * Datagram.max_payload]))
+            for frag_id in range(frag_cnt)]
+
+
+def main():
+    args = parse_arguments()
+
+    reader = IVFReader(args.ivf)
+    num_frames = args.frames or reader.frame_count()
+    frame_interval_us = 1000000 / reader.frame_rate()
+
+    log = open(args.log, 'w') if args.log else None
+    link = TraceLink(load_trace(args.trace), args.queue_bytes, args.queue_packets,
+                     DropPolicy(args.drop_policy), args.delay, log)
+
+    packet_delays = []
+    frags_left: Dict[int, int] = {}
+    frame_delays = []
+    num_sent = 0
+    bytes_delivered = 0
+
+    def deliver(now: int) -> None:
+        nonlocal bytes_delivered
+        for raw_data in link.deliver(now):
+            datagram = Datagram(0, FrameType.UNKNOWN, 0, 0, b"")
+            datagram.parse_from_string(raw_data[IP_UDP_HEADER_SIZE:])
+            packet_delays.append(now - datagram.send_ts)
+            bytes_delivered += len(raw_data)
+
+            frags_left[datagram.frame_id] -= 1
+            if frags_left[datagram.frame_id] == 0:
+                frame_delays.append(now - datagram.send_ts)
+
+    def run_until(end_ts: int) -> None:
+        # step from delivery to delivery so that every packet is timed exactly
+        while True:
+            next_ts = link.next_delivery_ts()
+            if next_ts is None or next_ts > end_ts:
+                break
+            deliver(next_ts)
+
+    start = time.monotonic()
+    padding = bytes(IP_UDP_HEADER_SIZE)
+
+    for frame_no in range(num_frames):
+        send_ts = int(frame_no * frame_interval_us)
+        run_until(send_ts)
+
+        frame_id = frame_no % reader.frame_count()
+        frame_type = FrameType.KEY if reader.is_key(frame_id) else FrameType.NONKEY
+        datagrams = packetize(frame_no, frame_type, reader.frame(frame_id))
+        frags_left[frame_no] = len(datagrams)
+
+        for datagram in datagrams:
+            datagram.send_ts = send_ts
+            link.send(padding + datagram.serialize_to_string(), send_ts)
+            num_sent += 1
+
+    # drain the queue
+    end_ts = int(num_frames * frame_interval_us)
+    while link.next_delivery_ts() is not None:
+        end_ts = link.next_delivery_ts()
+        run_until(end_ts)
+
+    elapsed = time.monotonic() - start
+    if log is not None:
+        log.close()
+
+    print(f"Simulated {double_to_string(end_ts / 1000000)} s in {double_to_string(elapsed)} s "
+          f"({double_to_string(end_ts / 1000000 / elapsed)}x real time)")
+    print(f"Packets: sent {num_sent}, delivered {len(packet_delays)}, "
+          f"dropped {num_sent - len(packet_delays)}")
+    print(f"Throughput (Mbps): {double_to_string(bytes_delivered * 8 / end_ts)}")
+
+    for name, delays in (('Packet delay', packet_delays), ('Frame delay', frame_delays)):
+        if delays:
+            p50, p90, p99 = np.percentile(np.array(delays) / 1000, [50, 90, 99])
+            print(f"{name} (ms): p50 {double_to_string(p50)}, p90 {double_to_string(p90)}, "
+                  f"p99 {double_to_string(p99)}, max {double_to_string(max(delays) / 1000)}")
+    print(f"Frames: sent {num_frames}, complete {len(frame_delays)}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,13 +2,18 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import argparse
+from types import SimpleNamespace
 from termcolor import colored
 
 from protocol import Datagram, ConfigMsg, AckMsg, FrameType
-from decoder import  Decoder
+from decoder import  Decoder, FrameRing
+from event_trace import EventTracer
+from metrics import MetricsRegistry, MetricsServer
+from profiler import StageProfiler, SamplingProfiler
 from utils.conversion import narrow_cast
 from utils.udp_socket import UDPSocket
 from utils.address import Address
+from utils.poller import Poller
 
 # try:
 #     import debugpy; debugpy.connect(5678)
@@ -25,6 +30,23 @@ def print_usage(program_name):
                             1: decode but not display frames
                             2: neither decode nor display frames
         -o, --output <file>  file to output performance results to
+        --ivf <file>         file to record the received (compressed) stream to
+        --stats-json <file>  file to also write the periodic stats (with latency
+                             percentiles) to, one JSON object per line
+        --max-buffered-frames <N>   cap on frames under reassembly (default: 1024)
+        --max-buffered-bytes <N>    cap on memory of frames under reassembly
+        --decoder-process    decode (and display) in a separate process
+        --playout            hold frames until an adaptive playout deadline
+        --latency-budget <ms>   catch up once frames wait longer than this
+                                to be decoded; 0 disables (default: 200)
+        --event-trace <file>    file to record per-packet events (receptions,
+                                decodable frames) to
+        --metrics <endpoint>    serve Prometheus metrics on host:port or a
+                                Unix socket path
+        --profile               time the receive loop and decoder worker stages
+                                every second, and sample stacks on SIGUSR1
+        --profile-window <s>    seconds to sample stacks for after SIGUSR1 (default: 10)
+        --profile-output <prefix>   prefix of the collapsed stack files (default: profile)
         -v, --verbose        enable more logging for debugging
     """
     print(usage_msg, file=sys.stderr)
@@ -44,6 +66,42 @@ def parse_arguments():
                            '1: decode but not display frames\n'
                            '2: neither decode nor display frames')
     parser.add_argument('-o', '--output', help='File to output performance results to')
+    parser.add_argument('--ivf', help='IVF file to record the received stream to')
+    parser.add_argument('--stats-json',
+                      help='File to also write the periodic stats (with frame completion '
+                           'and decode time percentiles) to as JSON lines')
+    parser.add_argument('--max-buffered-frames', type=int, default=FrameRing.MAX_FRAMES,
+                      help='Cap on frames under reassembly '
+                           f'(default: {FrameRing.MAX_FRAMES})')
+    parser.add_argument('--max-buffered-bytes', type=int, default=FrameRing.MAX_BYTES,
+                      help='Cap on memory of frames under reassembly '
+                           f'(default: {FrameRing.MAX_BYTES})')
+    parser.add_argument('--decoder-process', action='store_true',
+                      help='Decode (and display) in a separate process fed '
+                           'through shared memory')
+    parser.add_argument('--playout', action='store_true',
+                      help='Hold decodable frames until an adaptive playout '
+                           'deadline derived from network jitter')
+    parser.add_argument('--latency-budget', type=int,
+                      default=Decoder.DEFAULT_LATENCY_BUDGET_MS,
+                      help='Decode without rendering (or skip to the newest key '
+                           'frame) once frames wait longer than this many ms '
+                           f'to be decoded; 0 disables '
+                           f'(default: {Decoder.DEFAULT_LATENCY_BUDGET_MS})')
+    parser.add_argument('--event-trace',
+                      help='File to record per-packet events (receptions, '
+                           'decodable frames, skips) to in a binary format')
+    parser.add_argument('--metrics', metavar='ENDPOINT',
+                      help='Serve Prometheus metrics over HTTP on host:port, or on a '
+                           'Unix socket if ENDPOINT is a path')
+    parser.add_argument('--profile', action='store_true',
+                      help='Time the receive loop and decoder worker stages every '
+                           'second, and sample stacks on SIGUSR1')
+    parser.add_argument('--profile-window', type=float, default=10,
+                      help='Seconds to sample stacks for after SIGUSR1 (default: 10)')
+    parser.add_argument('--profile-output', default='profile',
+                      help='Prefix of the collapsed stack files for flame graphs '
+                           '(default: profile)')
     parser.add_argument('-v', '--verbose', action='store_true',
                       help='Enable more logging for debugging')
     
@@ -87,50 +145,107 @@ def main():
         print(colored(f"Verbose: {verbose}", "cyan"), file=sys.stderr)
 
     # initialize decoder
-    decoder = Decoder(width, height, lazy_level, output_path)
+    decoder = Decoder(width, height, lazy_level, output_path,
+                      args.max_buffered_frames, args.max_buffered_bytes,
+                      args.decoder_process, args.latency_budget, args.stats_json or "")
     decoder.set_verbose(verbose)
-
-    # main loop
-    if verbose:
-        frames_processed = 0
-    while True:
-        # Receive and parse datagram
-        data = udp_sock.recv()
-        if not data:
-            continue
-        
-        # parse a datagram received from sender
-        datagram = Datagram(0, FrameType.UNKNOWN, 0, 0, b"")
-        if not datagram.parse_from_string(data):
-            raise RuntimeError("Failed to parse datagram")
-
-        # send an ACK back to sender
-        ack = AckMsg(
-            frame_id=datagram.frame_id, 
-            frag_id=datagram.frag_id,
-            send_ts=datagram.send_ts
+    if args.ivf:
+        decoder.set_ivf_output(args.ivf, frame_rate)
+    if args.event_trace:
+        event_tracer = EventTracer(args.event_trace, 'receiver')
+        event_tracer.close_at_exit()
+        decoder.set_event_tracer(event_tracer)
+
+    # setup polling
+    poller = Poller()
+    udp_sock.set_blocking(False)
+
+    # opt-in metrics endpoint, served from the poll loop
+    metrics = None
+    if args.metrics:
+        registry = MetricsRegistry({'role': 'receiver'})
+        decoder.set_metrics(registry)
+        metrics = SimpleNamespace(
+            datagrams_received=registry.counter('datagrams_received_total',
+                                                'Datagrams received'),
+            bytes_received=registry.counter('bytes_received_total',
+                                            'UDP payload bytes received'),
         )
-        udp_sock.send(ack.serialize_to_string())
+        MetricsServer(registry, poller, args.metrics)
+        print(f"Metrics endpoint: {args.metrics}", file=sys.stderr)
+
+    # opt-in profiling: per-callback timing and stack sampling on demand
+    profiler = None
+    if args.profile:
+        profiler = StageProfiler("receiver")
+        decoder.set_profiler(profiler)
+        SamplingProfiler(args.profile_output, args.profile_window).start_on_signal()
+        print(f"Profiling: kill -USR1 {os.getpid()} to sample stacks for "
+              f"{args.profile_window} s", file=sys.stderr)
+
+    def timed(stage, callback):
+        return profiler.wrap(stage, callback) if profiler else callback
+
+    # release frames whose playout time has come
+    if args.playout:
+        playout = decoder.enable_playout()
+        poller.register_event(playout.timer(), Poller.In,
+                              timed('playout_timer', playout.handle_timer))
+
+    frames_processed = 0
+
+    # when UDP socket is readable
+    def handle_socket_read():
+        nonlocal frames_processed
+
+        while True:
+            # Receive and parse datagram
+            data = udp_sock.recv()
+            if not data:    # EWOULDBLOCK; try again when data is available
+                break
+
+            # parse a datagram received from sender
+            datagram = Datagram(0, FrameType.UNKNOWN, 0, 0, b"")
+            if not datagram.parse_from_string(data):
+                raise RuntimeError("Failed to parse datagram")
+
+            if metrics:
+                metrics.datagrams_received.inc()
+                metrics.bytes_received.inc(len(data))
+
+            # send an ACK back to sender
+            ack = AckMsg(
+                frame_id=datagram.frame_id, 
+                frag_id=datagram.frag_id,
+                send_ts=datagram.send_ts
+            )
+            udp_sock.send(ack.serialize_to_string())
 
-        if verbose:
-            print(f"Acked datagram: frame_id={datagram.frame_id} "
-                    f"frag_id={datagram.frag_id}", file=sys.stderr)
+            if verbose:
+                print(f"Acked datagram: frame_id={datagram.frame_id} "
+                        f"frag_id={datagram.frag_id}", file=sys.stderr)
 
-        # process the received datagram in the decoder
-        decoder.add_datagram(datagram)
+            # process the received datagram in the decoder
+            decoder.add_datagram(datagram)
+
+            # check if the expected frame(s) is complete
+            while decoder.next_frame_complete():
+                if verbose:
+                    frames_processed += 1
+                    print(colored(f"Processing complete frame {frames_processed}", "green"), 
+                        file=sys.stderr)
+                # depending on the lazy level, might decode and display the next frame
+                decoder.consume_next_frame()
 
-        # check if the expected frame(s) is complete
-        while decoder.next_frame_complete():
             if verbose:
-                frames_processed += 1
-                print(colored(f"Processing complete frame {frames_processed}", "green"), 
+                print(colored(f"\nProcessed {frames_processed} frames", "cyan"), 
                     file=sys.stderr)
-            # depending on the lazy level, might decode and display the next frame
-            decoder.consume_next_frame()
 
-        if verbose:
-            print(colored(f"\nProcessed {frames_processed} frames", "cyan"), 
-                file=sys.stderr)
+    poller.register_event(udp_sock, Poller.In, timed('handle_socket_read', handle_socket_read))
+
+    # main loop
+    while True:
+        poller.poll(-1)
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -4,10 +4,17 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import argparse
 import struct
+from types import SimpleNamespace
 from typing import Tuple
 
 from video.yuv4mpeg import YUV4MPEG
+from video.prefetch import PrefetchingVideoInput
+from video.shared_clip import SharedClip
+from video.synthetic import SyntheticVideoInput, Pattern
 from encoder import Encoder
+from event_trace import EventTracer, Event
+from metrics import MetricsRegistry, MetricsServer
+from profiler import StageProfiler, SamplingProfiler
 from protocol import Datagram, MsgType, Msg, ConfigMsg
 from utils.udp_socket import UDPSocket
 from video.image import RawImage
@@ -43,11 +50,29 @@ void print_usage(const string & program_name)
 }
 """
 def print_usage(program_name: str) -> None:
-    usage_msg = f"""Usage: {program_name} [options] port y4m
+    usage_msg = f"""Usage: {program_name} [options] port [y4m]
 
 Options:
     --mtu <MTU>                MTU for deciding UDP payload size
     -o, --output <file>        file to output performance results to 
+    --telemetry <file>         file to output binary per-frame encoder telemetry to
+    --stats-json <file>        file to also write the periodic stats (with latency
+                               percentiles) to, one JSON object per line
+    --bitstream-cache <dir>    replay encoded frames of the looping clip from a cache
+    --ivf <file>               file to record the sent (compressed) stream to
+    --zero-copy                encode frames in place from the mapped input file
+    --start-frame <N>          first frame of the input to send (default: 0); not
+                               with --bitstream-cache
+    --prefetch <N>             read up to N raw frames ahead on a background thread
+    --shared-clip              share the input's frames with other senders through shared memory
+    --synthetic <pattern>      generate frames (static, gradient or noise) instead of reading y4m
+    --scene-cut <N>            frames per scene of the synthetic input (default: 0, one scene)
+    --event-trace <file>       file to record per-packet events (sends, RTX, ACKs) to
+    --metrics <endpoint>       serve Prometheus metrics on host:port or a Unix socket path
+    --profile                  time the poll loop's callbacks, encoding and packetizing
+                               every second, and sample stacks on SIGUSR1
+    --profile-window <s>       seconds to sample stacks for after SIGUSR1 (default: 10)
+    --profile-output <prefix>  prefix of the collapsed stack files (default: profile)
     -v, --verbose              enable more logging for debugging
 """
     print(usage_msg, file=sys.stderr)
@@ -91,12 +116,63 @@ def main():
     parser = argparse.ArgumentParser(description='Video sender')
     parser.add_argument('--mtu', type=int, help='MTU for deciding UDP payload size')
     parser.add_argument('-o', '--output', help='File to output performance results to')
+    parser.add_argument('--telemetry',
+                       help='File to output binary per-frame encoder telemetry '
+                            '(PSNR, QP, size, timing) to')
+    parser.add_argument('--stats-json',
+                       help='File to also write the periodic stats (with encode time, '
+                            'RTT and ACK delay percentiles) to as JSON lines')
+    parser.add_argument('--bitstream-cache', metavar='DIR',
+                       help='Directory of cached encodings to replay instead of '
+                            're-encoding the looping clip')
+    parser.add_argument('--ivf', help='IVF file to record the sent stream to')
+    parser.add_argument('--start-frame', type=int, default=0,
+                       help='First frame of the input to send (default: 0)')
+    parser.add_argument('--zero-copy', action='store_true',
+                       help='Encode frames in place from the memory-mapped input '
+                            'instead of copying them into a raw image')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='N',
+                       help='Read up to N raw frames ahead of the frame timer '
+                            'on a background thread (default: 0, disabled)')
+    parser.add_argument('--shared-clip', action='store_true',
+                       help='Load the input once into shared memory and share it '
+                            'with other senders looping the same clip')
+    parser.add_argument('--synthetic', choices=[p.value for p in Pattern],
+                       help='Generate frames of the given pattern instead of '
+                            'reading a YUV4MPEG input')
+    parser.add_argument('--scene-cut', type=int, default=0, metavar='N',
+                       help='Frames per scene of the synthetic input '
+                            '(default: 0, a single scene)')
+    parser.add_argument('--event-trace',
+                       help='File to record per-packet events (sends, retransmissions, '
+                            'ACKs, give-ups) to in a binary format')
+    parser.add_argument('--metrics', metavar='ENDPOINT',
+                       help='Serve Prometheus metrics over HTTP on host:port, or on a '
+                            'Unix socket if ENDPOINT is a path')
+    parser.add_argument('--profile', action='store_true',
+                       help='Time the poll loop callbacks, encoding and packetizing '
+                            'every second, and sample stacks on SIGUSR1')
+    parser.add_argument('--profile-window', type=float, default=10,
+                       help='Seconds to sample stacks for after SIGUSR1 (default: 10)')
+    parser.add_argument('--profile-output', default='profile',
+                       help='Prefix of the collapsed stack files for flame graphs '
+                            '(default: profile)')
     parser.add_argument('-v', '--verbose', action='store_true', 
                        help='Enable more logging for debugging')
     parser.add_argument('port', type=int, help='Port number')
-    parser.add_argument('y4m', help='YUV4MPEG input file')
+    parser.add_argument('y4m', nargs='?', help='YUV4MPEG input file')
     
     args = parser.parse_args()
+    if args.prefetch and args.zero_copy:
+        parser.error("--prefetch and --zero-copy are mutually exclusive")
+    if bool(args.synthetic) == bool(args.y4m):
+        parser.error("either a y4m input or --synthetic is required")
+    if args.synthetic and (args.zero_copy or args.shared_clip or args.bitstream_cache):
+        parser.error("--synthetic can't be combined with --zero-copy, --shared-clip "
+                     "or --bitstream-cache")
+    if args.start_frame and args.bitstream_cache:
+        # cached frames are recorded and replayed from the first frame of the clip
+        parser.error("--start-frame can't be combined with --bitstream-cache")
     
     if args.mtu:
         Datagram.set_mtu(args.mtu)
@@ -126,19 +202,74 @@ def main():
     udp_sock.set_blocking(False)
     
     # open the video file
-    video_input = YUV4MPEG(args.y4m, width, height)
+    if args.synthetic:
+        video_input = SyntheticVideoInput(width, height, Pattern(args.synthetic),
+                                          args.scene_cut)
+    elif args.shared_clip:
+        video_input = SharedClip(args.y4m, width, height)
+        print(f"Shared clip: {video_input.name()}", file=sys.stderr)
+    else:
+        video_input = YUV4MPEG(args.y4m, width, height)
+    if args.start_frame:
+        video_input.seek(args.start_frame)
+
+    # read frames ahead into a ring of raw images, handed over by reference
+    prefetcher = None
+    if args.prefetch:
+        prefetcher = PrefetchingVideoInput(video_input, args.prefetch)
 
     # allocate a raw image
     raw_img = RawImage(width, height)
 
     # initialize the encoder
-    encoder = Encoder(width, height, frame_rate, args.output)
+    encoder = Encoder(width, height, frame_rate, args.output, args.telemetry)
     encoder.set_target_bitrate(target_bitrate)
     encoder.set_verbose(args.verbose)
+    if args.ivf:
+        encoder.set_ivf_output(args.ivf)
+    if args.stats_json:
+        encoder.set_stats_output(args.stats_json)
+    if args.bitstream_cache:
+        encoder.set_bitstream_cache(args.bitstream_cache, args.y4m,
+                                    video_input.frame_count())
+
+    event_tracer = None
+    if args.event_trace:
+        event_tracer = EventTracer(args.event_trace, 'sender')
+        event_tracer.close_at_exit()
+        encoder.set_event_tracer(event_tracer)
 
     
     # setup polling
     poller = Poller()
+
+    # opt-in metrics endpoint, served from the poll loop
+    metrics = None
+    if args.metrics:
+        registry = MetricsRegistry({'role': 'sender'})
+        encoder.set_metrics(registry)
+        metrics = SimpleNamespace(
+            datagrams_sent=registry.counter('datagrams_sent_total',
+                                            'Datagrams sent, retransmissions included'),
+            rtx_sent=registry.counter('retransmissions_sent_total', 'Datagrams retransmitted'),
+            bytes_sent=registry.counter('bytes_sent_total', 'UDP payload bytes sent'),
+            raw_frames_skipped=registry.counter('raw_frames_skipped_total',
+                                                'Raw frames skipped by a late frame timer'),
+        )
+        MetricsServer(registry, poller, args.metrics)
+        print(f"Metrics endpoint: {args.metrics}", file=sys.stderr)
+
+    # opt-in profiling: per-callback timing and stack sampling on demand
+    profiler = None
+    if args.profile:
+        profiler = StageProfiler("sender")
+        encoder.set_profiler(profiler)
+        SamplingProfiler(args.profile_output, args.profile_window).start_on_signal()
+        print(f"Profiling: kill -USR1 {os.getpid()} to sample stacks for "
+              f"{args.profile_window} s", file=sys.stderr)
+
+    def timed(stage, callback):
+        return profiler.wrap(stage, callback) if profiler else callback
     
     # create a periodic timer with the same period as the frame interval
     fps_timer = Timerfd()
@@ -151,18 +282,35 @@ def main():
     
     # read a raw frame when the periodic timer fires
     def handle_fps_timer():
-        # being lenient: read raw frames 'num_exp' times and use the last one
+        # being lenient: skip the frames missed since the last expiration
+        # (without reading them) and use the latest one
         num_exp = fps_timer.read_expirations()
         if num_exp > 1:
             print(f"Warning: skipping {num_exp - 1} raw frames", file=sys.stderr)
+            (prefetcher or video_input).skip(num_exp - 1)
+            encoder.skip_frames(num_exp - 1)
+            if metrics:
+                metrics.raw_frames_skipped.inc(num_exp - 1)
             
-        for i in range(num_exp):
-            # fetch a raw frame into 'raw_img' from the video input
-            if not video_input.read_frame(raw_img):
+        frame_img = raw_img
+        if prefetcher:
+            # take over a frame that has been read ahead
+            frame_img = prefetcher.next_frame()
+            if frame_img is None:
                 raise RuntimeError("Reached end of video input")
+
+        elif args.zero_copy:
+            # borrow the frame straight from the mapped video input
+            frame_img = video_input.wrap_frame()
+            if frame_img is None:
+                raise RuntimeError("Reached end of video input")
+
+        # fetch a raw frame into 'raw_img' from the video input
+        elif not video_input.read_frame(raw_img):
+            raise RuntimeError("Reached end of video input")
         
-        # compress 'raw_img' into frame 'frame_id' and packetize it
-        encoder.compress_frame(raw_img)
+        # compress the frame into frame 'frame_id' and packetize it
+        encoder.compress_frame(frame_img)
         
         # interested in socket being writable if there are datagrams to send
         if encoder.send_buf:
@@ -177,7 +325,17 @@ def main():
             # timestamp the sending time before sending
             datagram.send_ts = timestamp_us() # time.time_ns() // 1000  # microseconds
             
-            if udp_sock.send(datagram.serialize_to_string()):
+            raw_data = datagram.serialize_to_string()
+            if udp_sock.send(raw_data):
+                if event_tracer:
+                    event_tracer.record(Event.RTX if datagram.num_rtx else Event.SEND,
+                                        datagram.frame_id, datagram.frag_id, len(raw_data))
+                if metrics:
+                    metrics.datagrams_sent.inc()
+                    metrics.bytes_sent.inc(len(raw_data))
+                    if datagram.num_rtx:
+                        metrics.rtx_sent.inc()
+
                 if args.verbose:
                     print(f"Sent datagram: frame_id={datagram.frame_id} "
                           f"frag_id={datagram.frag_id} "
@@ -223,9 +381,9 @@ def main():
                 poller.activate(udp_sock, Poller.Out)
     
     # register events
-    poller.register_event(fps_timer, Poller.In, handle_fps_timer)
-    poller.register_event(udp_sock, Poller.Out, handle_socket_write) 
-    poller.register_event(udp_sock, Poller.In, handle_socket_read)
+    poller.register_event(fps_timer, Poller.In, timed('handle_fps_timer', handle_fps_timer))
+    poller.register_event(udp_sock, Poller.Out, timed('handle_socket_write', handle_socket_write))
+    poller.register_event(udp_sock, Poller.In, timed('handle_socket_read', handle_socket_read))
     
     # create a periodic timer for outputting stats every second
     stats_timer = Timerfd()
@@ -238,8 +396,12 @@ def main():
         
         # output stats every second
         encoder.output_periodic_stats()
+        if prefetcher:
+            prefetcher.output_periodic_stats()
+        if profiler:
+            profiler.output_periodic_stats()
             
-    poller.register_event(stats_timer, Poller.In, handle_stats)
+    poller.register_event(stats_timer, Poller.In, timed('stats', handle_stats))
     
     # Main loop
     while True:
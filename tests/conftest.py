@@ -0,0 +1,7 @@
+import os
+import sys
+
+# app modules import each other by name, and utils/video as packages
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'app'))
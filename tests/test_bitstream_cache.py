@@ -0,0 +1,74 @@
+import pytest
+
+try:
+    from encoder import Encoder
+except OSError:  # libvpx is not installed
+    pytest.skip("encoder requires libvpx", allow_module_level=True)
+
+from bitstream_cache import BitstreamCache
+from protocol import FrameType
+
+NUM_FRAMES = 5
+
+
+@pytest.fixture
+def encoder(tmp_path):
+    clip_path = tmp_path / "clip.yuv"
+    clip_path.write_bytes(b"raw frames")
+
+    encoder = Encoder(64, 64, 30, clock=lambda: 0)
+    encoder.set_bitstream_cache(str(tmp_path / "cache"), str(clip_path), NUM_FRAMES)
+
+    # libvpx is replaced by frames whose type follows the key frame requests
+    encoder.forced_keys = []
+    encoder.encoded_frame = None
+
+    def encode_frame(raw_img, force_key=False):
+        encoder.forced_keys.append(force_key)
+        frame_type = FrameType.KEY if force_key or encoder.frame_id_ == 0 else FrameType.NONKEY
+        encoder.encoded_frame = (memoryview(bytes([encoder.frame_id_]) * 100), frame_type)
+        return 0.0
+
+    def packetize_encoded_frame():
+        buffer, frame_type = encoder.encoded_frame
+        encoder.packetize_frame(buffer, frame_type)
+        encoder.bitstream_cache_.add_live_frame(buffer, frame_type)
+        return len(buffer)
+
+    encoder.encode_frame = encode_frame
+    encoder.packetize_encoded_frame = packetize_encoded_frame
+    return encoder
+
+
+def send_frames(encoder, n):
+    frame_types = []
+    for _ in range(n):
+        encoder.compress_frame(None)
+        frame_types.append(encoder.last_frame_type_)
+        # every datagram is acked right away
+        encoder.send_buf.clear()
+    return frame_types
+
+
+def test_skip_during_replay_forces_one_key_frame(encoder):
+    cache = encoder.bitstream_cache_
+
+    # the first pass records and publishes the clip
+    send_frames(encoder, NUM_FRAMES)
+    assert cache.state() == BitstreamCache.State.REPLAY
+    assert encoder.forced_keys == [False] * NUM_FRAMES
+
+    # replay frames 0-1, then skip frame 2
+    assert send_frames(encoder, 2) == [FrameType.KEY, FrameType.NONKEY]
+    assert encoder.num_replayed_frames == 2
+    encoder.skip_frames(1)
+    assert cache.state() == BitstreamCache.State.LIVE
+
+    # live frames 3-4: only the first is a key frame
+    assert send_frames(encoder, 2) == [FrameType.KEY, FrameType.NONKEY]
+    assert encoder.forced_keys[NUM_FRAMES:] == [True, False]
+
+    # replay resumes at the cached key frame without another request
+    assert send_frames(encoder, 1) == [FrameType.KEY]
+    assert encoder.num_replayed_frames == 3
+    assert not cache.take_key_frame_request()
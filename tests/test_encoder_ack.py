@@ -0,0 +1,95 @@
+import pytest
+
+try:
+    from encoder import Encoder
+except OSError:  # libvpx is not installed
+    pytest.skip("encoder requires libvpx", allow_module_level=True)
+
+from protocol import AckMsg, Datagram, FrameType
+
+RTT_US = 10000
+
+
+class Clock:
+    def __init__(self):
+        self.now_us = 1000000
+
+    def __call__(self) -> int:
+        return self.now_us
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def encoder(clock):
+    encoder = Encoder(64, 64, 30, clock=clock)
+    # datagrams 0-5 of frame 0, sent 1 ms apart and just taken off 'send_buf'
+    for frag_id in range(6):
+        datagram = Datagram(0, FrameType.KEY, frag_id, 6, b"x")
+        datagram.send_ts = clock() - (6 - frag_id) * 1000
+        encoder.add_unacked(datagram)
+    return encoder
+
+
+def ack(encoder, clock, frag_id, rtt_us=RTT_US):
+    encoder.handle_ack(AckMsg(frame_id=0, frag_id=frag_id, send_ts=clock() - rtt_us))
+
+
+def queued(encoder):
+    return [datagram.frag_id for datagram in encoder.send_buf]
+
+
+def test_ack_requeues_older_unacked_oldest_first(encoder, clock):
+    pending = Datagram(1, FrameType.NONKEY, 0, 1, b"y")
+    encoder.send_buf.append(pending)
+
+    ack(encoder, clock, 3)
+
+    # retransmissions go ahead of new datagrams
+    assert queued(encoder) == [0, 1, 2, 0]
+    assert encoder.send_buf[-1] is pending
+    assert list(encoder.unacked) == [(0, 0), (0, 1), (0, 2), (0, 4), (0, 5)]
+    assert [encoder.unacked[(0, i)].num_rtx for i in (0, 1, 2, 4, 5)] == [1, 1, 1, 0, 0]
+    assert encoder.unacked[(0, 0)].last_send_ts == clock()
+
+
+def test_ack_of_oldest_requeues_nothing(encoder, clock):
+    ack(encoder, clock, 0)
+    assert queued(encoder) == []
+    assert (0, 0) not in encoder.unacked
+
+
+def test_ack_of_unknown_datagram_requeues_nothing(encoder, clock):
+    ack(encoder, clock, 3)
+    encoder.send_buf.clear()
+
+    ack(encoder, clock, 3)  # duplicate ACK
+    encoder.handle_ack(AckMsg(frame_id=7, frag_id=0, send_ts=clock() - RTT_US))
+    assert queued(encoder) == []
+
+
+def test_ack_waits_about_an_rtt_between_retransmissions(encoder, clock):
+    ack(encoder, clock, 2)
+    assert queued(encoder) == [0, 1]
+    encoder.send_buf.clear()
+
+    # within an RTT of the last retransmission
+    clock.now_us += RTT_US // 2
+    ack(encoder, clock, 3)
+    assert queued(encoder) == []
+
+    clock.now_us += RTT_US
+    ack(encoder, clock, 4)
+    assert queued(encoder) == [0, 1]
+    assert encoder.unacked[(0, 0)].num_rtx == 2
+
+
+def test_ack_stops_after_max_retransmissions(encoder, clock):
+    encoder.unacked[(0, 1)].num_rtx = Encoder.MAX_NUM_RTX
+
+    ack(encoder, clock, 2)
+    assert queued(encoder) == [0]
+    assert encoder.unacked[(0, 1)].num_rtx == Encoder.MAX_NUM_RTX
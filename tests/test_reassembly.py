@@ -0,0 +1,408 @@
+import pytest
+
+try:
+    from decoder import Decoder, Frame, FramePool, FrameRing
+except OSError:  # libvpx is not installed
+    pytest.skip("decoder requires libvpx", allow_module_level=True)
+
+from protocol import Datagram, FrameType
+
+FRAG_SIZE = 100
+
+
+def datagram(frame_id, frag_id, frag_cnt, size=FRAG_SIZE, frame_type=FrameType.NONKEY,
+             fill=None):
+    fill = frag_id if fill is None else fill
+    return Datagram(frame_id, frame_type, frag_id, frag_cnt, bytes([fill]) * size)
+
+
+def fragments(frame_id, frag_cnt, last_size=40, frame_type=FrameType.NONKEY):
+    return [datagram(frame_id, i, frag_cnt, last_size if i == frag_cnt - 1 else FRAG_SIZE,
+                     frame_type) for i in range(frag_cnt)]
+
+
+def expected_payload(frag_cnt, last_size=40):
+    return b"".join(bytes([i]) * (last_size if i == frag_cnt - 1 else FRAG_SIZE)
+                    for i in range(frag_cnt))
+
+
+def complete_frame(ring, frame_id, frag_cnt=1, frame_type=FrameType.NONKEY):
+    for dgram in fragments(frame_id, frag_cnt, frame_type=frame_type):
+        frame = ring.insert_datagram(dgram)
+    assert frame.complete()
+    return frame
+
+
+# Frame
+
+@pytest.mark.parametrize("order", [[0, 1, 2, 3], [2, 0, 3, 1], [3, 2, 1, 0], [3, 0, 1, 2]])
+def test_frame_reassembles_in_any_order(order):
+    dgrams = fragments(7, 4)
+    frame = Frame(7, FrameType.NONKEY, 4)
+    for i in order:
+        assert not frame.complete()
+        frame.insert_frag(dgrams[i])
+
+    assert frame.complete()
+    assert frame.frame_size() == 3 * FRAG_SIZE + 40
+    assert bytes(frame.payload()) == expected_payload(4)
+
+
+def test_frame_stashes_last_fragment_until_fragment_size_is_known():
+    frame = Frame(0, FrameType.KEY, 2)
+    frame.insert_frag(datagram(0, 1, 2, 40, FrameType.KEY))
+    assert frame.pending_last_ is not None
+    assert frame.frame_size() is None
+
+    frame.insert_frag(datagram(0, 0, 2, FRAG_SIZE, FrameType.KEY))
+    assert frame.pending_last_ is None
+    assert bytes(frame.payload()) == expected_payload(2)
+
+
+def test_frame_ignores_duplicate_fragments():
+    dgrams = fragments(0, 3)
+    frame = Frame(0, FrameType.NONKEY, 3)
+    frame.insert_frag(dgrams[2])
+    frame.insert_frag(dgrams[2])
+    frame.insert_frag(dgrams[0])
+    frame.insert_frag(dgrams[0])
+    assert not frame.complete()
+
+    frame.insert_frag(dgrams[1])
+    assert frame.complete()
+    assert frame.frame_size() == 2 * FRAG_SIZE + 40
+    assert bytes(frame.payload()) == expected_payload(3)
+
+
+def test_frame_single_fragment():
+    frame = Frame(0, FrameType.KEY, 1)
+    frame.insert_frag(datagram(0, 0, 1, 40, FrameType.KEY))
+    assert bytes(frame.payload()) == bytes([0]) * 40
+
+
+@pytest.mark.parametrize("first, second", [
+    # non-last fragments of different sizes
+    (datagram(0, 0, 3, FRAG_SIZE), datagram(0, 1, 3, FRAG_SIZE - 1)),
+    # a last fragment larger than the others
+    (datagram(0, 0, 3, FRAG_SIZE), datagram(0, 2, 3, FRAG_SIZE + 1)),
+    # an empty last fragment
+    (datagram(0, 0, 3, FRAG_SIZE), datagram(0, 2, 3, 0)),
+    # a stashed last fragment larger than the fragment size learned later
+    (datagram(0, 2, 3, FRAG_SIZE + 1), datagram(0, 0, 3, FRAG_SIZE)),
+])
+def test_frame_rejects_inconsistent_sizes(first, second):
+    frame = Frame(0, FrameType.NONKEY, 3)
+    frame.insert_frag(first)
+    with pytest.raises(RuntimeError):
+        frame.insert_frag(second)
+
+
+@pytest.mark.parametrize("frag_id", [0, 2])
+def test_frame_rejects_empty_fragment(frag_id):
+    frame = Frame(0, FrameType.NONKEY, 3)
+    with pytest.raises(RuntimeError):
+        frame.insert_frag(datagram(0, frag_id, 3, 0))
+
+    # the fragment size is still learned from the first non-empty fragment
+    frame.insert_frag(datagram(0, 1, 3, FRAG_SIZE))
+    with pytest.raises(RuntimeError):
+        frame.insert_frag(datagram(0, 0, 3, FRAG_SIZE - 1))
+
+
+def test_frame_rejects_oversized_fragment():
+    frame = Frame(0, FrameType.NONKEY, 2)
+    with pytest.raises(RuntimeError):
+        frame.insert_frag(datagram(0, 0, 2, Frame.MAX_FRAG_SIZE + 1))
+
+
+@pytest.mark.parametrize("dgram", [
+    datagram(1, 0, 3),                               # another frame
+    datagram(0, 0, 3, frame_type=FrameType.KEY),     # another type
+    datagram(0, 3, 3),                               # fragment out of range
+    datagram(0, 0, 4),                               # another fragment count
+])
+def test_frame_rejects_incompatible_datagram(dgram):
+    frame = Frame(0, FrameType.NONKEY, 3)
+    with pytest.raises(RuntimeError):
+        frame.insert_frag(dgram)
+
+
+def test_frame_keeps_earliest_send_ts():
+    dgrams = fragments(0, 2)
+    dgrams[0].send_ts = 2000
+    dgrams[1].send_ts = 1000  # e.g. the first fragment was retransmitted
+    frame = Frame(0, FrameType.NONKEY, 2)
+    frame.insert_frag(dgrams[0])
+    frame.insert_frag(dgrams[1])
+    assert frame.send_ts() == 1000
+
+
+@pytest.mark.parametrize("size, frag_cnt", [
+    (1, 1),
+    (Datagram.max_payload, 1),
+    (Datagram.max_payload + 1, 2),
+    (3 * Datagram.max_payload, 3),
+    (3 * Datagram.max_payload + 1, 4),
+])
+def test_from_payload_fragment_count(size, frag_cnt):
+    payload = bytes(i % 251 for i in range(size))
+    frame = Frame.from_payload(0, FrameType.KEY, payload)
+    assert frame.frag_cnt() == frag_cnt
+    assert bytes(frame.payload()) == payload
+
+
+# FramePool
+
+def test_pool_size_classes():
+    assert FramePool.size_class(1) == FramePool.MIN_SIZE
+    assert FramePool.size_class(FramePool.MIN_SIZE + 1) == 2 * FramePool.MIN_SIZE
+    assert FramePool.size_class(1 << 20) == 1 << 20
+
+
+def test_pool_reuses_released_buffers():
+    pool = FramePool()
+    buf = pool.acquire(5000)
+    assert len(buf) == 8192
+
+    pool.release(buf)
+    assert pool.acquire(6000) is buf
+    # the class is empty again
+    assert pool.acquire(6000) is not buf
+
+
+def test_pool_bounds_free_buffers():
+    pool = FramePool()
+    bufs = [pool.acquire(100) for _ in range(FramePool.MAX_FREE_PER_CLASS + 2)]
+    for buf in bufs:
+        pool.release(buf)
+    assert len(pool.free_[FramePool.MIN_SIZE]) == FramePool.MAX_FREE_PER_CLASS
+
+
+def test_frame_release_returns_buffer_once():
+    pool = FramePool()
+    frame = Frame(0, FrameType.KEY, 1, pool)
+    buf = frame.buf_
+    frame.release()
+    frame.release()
+    assert list(pool.free_[len(buf)]) == [buf]
+    assert Frame(1, FrameType.KEY, 1, pool).buf_ is buf
+
+
+# FrameRing
+
+def test_ring_reassembles_and_ignores_duplicates():
+    ring = FrameRing()
+    dgrams = fragments(3, 3)
+    ring.insert_datagram(dgrams[1])
+    ring.insert_datagram(dgrams[1])
+    ring.insert_datagram(dgrams[2])
+    frame = ring.insert_datagram(dgrams[0])
+
+    assert frame.complete()
+    assert len(ring) == 1
+    assert ring.get(3) is frame
+    assert bytes(frame.payload()) == expected_payload(3)
+
+
+def test_ring_grows_and_keeps_frames():
+    ring = FrameRing(max_frames=1024)
+    frame_ids = [0, 5, FrameRing.INITIAL_CAPACITY + 3, 600]
+    for frame_id in frame_ids:
+        complete_frame(ring, frame_id)
+
+    assert ring.capacity() >= 601
+    assert [frame.id() for frame in ring] == frame_ids
+
+
+def test_ring_drops_datagrams_outside_window():
+    ring = FrameRing(max_frames=8)
+    assert ring.insert_datagram(datagram(8, 0, 1)) is None
+
+    ring.clean_up_to(4)
+    assert ring.insert_datagram(datagram(3, 0, 1)) is None
+    assert ring.insert_datagram(datagram(11, 0, 1)) is not None
+    assert ring.stats()['dropped_datagrams'] == 2
+
+
+@pytest.mark.parametrize("dgram", [
+    datagram(0, 3, 3),                               # fragment out of range
+    datagram(0, 0, 2, Frame.MAX_FRAG_SIZE + 1),      # oversized payload
+])
+def test_ring_drops_malformed_datagram_of_new_frame(dgram):
+    ring = FrameRing()
+    assert ring.insert_datagram(dgram) is None
+    assert len(ring) == 0 and ring.num_bytes() == 0
+    assert ring.stats()['dropped_datagrams'] == 1
+
+
+def test_ring_drops_malformed_datagram_of_existing_frame():
+    ring = FrameRing()
+    dgrams = fragments(0, 2)
+    ring.insert_datagram(dgrams[0])
+
+    assert ring.insert_datagram(datagram(0, 0, 3)) is None
+    assert ring.insert_datagram(dgrams[1]).complete()
+    # duplicates of a complete frame are ignored, malformed ones are counted
+    assert ring.insert_datagram(dgrams[1]).complete()
+    assert ring.insert_datagram(datagram(0, 1, 2, FRAG_SIZE + 1)).complete()
+    assert ring.stats()['dropped_datagrams'] == 2
+
+
+def test_ring_drops_malformed_far_key_datagram():
+    ring = FrameRing(max_frames=8)
+    key = FrameType.KEY
+    assert ring.insert_far_key_datagram(datagram(20, 2, 2, frame_type=key)) is None
+    assert ring.insert_far_key_datagram(datagram(20, 0, 2, frame_type=key)) is None
+    assert ring.insert_far_key_datagram(datagram(20, 1, 3, frame_type=key)) is None
+    assert ring.stats()['dropped_datagrams'] == 2
+
+    frame = ring.insert_far_key_datagram(datagram(20, 1, 2, 40, frame_type=key))
+    assert frame is not None and frame.complete()
+    frame.release()
+
+
+def test_ring_clean_up_releases_frames():
+    ring = FrameRing()
+    frames = [complete_frame(ring, frame_id) for frame_id in range(4)]
+    ring.clean_up_to(2)
+
+    assert [frame.id() for frame in ring] == [2, 3]
+    assert frames[0].buf_ is None and frames[1].buf_ is None
+    assert ring.num_bytes() == 2 * Frame.overhead(1)
+
+
+def test_ring_remove_hands_over_buffer():
+    ring = FrameRing()
+    frame = complete_frame(ring, 0)
+    ring.remove(frame, release=False)
+    assert len(ring) == 0 and ring.num_bytes() == 0
+    assert frame.buf_ is not None
+
+
+def insert_eviction_mix(ring):
+    """Frames 0-4: complete key, incomplete key, incomplete non-key,
+    complete non-key, complete key (the latest)."""
+    complete_frame(ring, 0, frame_type=FrameType.KEY)
+    ring.insert_datagram(datagram(1, 0, 2, frame_type=FrameType.KEY))
+    ring.insert_datagram(datagram(2, 0, 2))
+    complete_frame(ring, 3)
+    complete_frame(ring, 4, frame_type=FrameType.KEY)
+    assert ring.latest_key_frame() == 4
+
+
+def test_ring_eviction_order_under_frame_cap():
+    ring = FrameRing(max_frames=5)
+    insert_eviction_mix(ring)
+
+    # the window is as wide as the frame cap, so ask for room for new
+    # frames directly rather than inserting frames beyond the window
+    for new_frames, remaining in [(1, [0, 1, 3, 4]), (2, [0, 3, 4]), (3, [3, 4]), (4, [4])]:
+        assert ring.make_room(0, new_frames, -1)
+        assert [frame.id() for frame in ring] == remaining
+
+    assert not ring.make_room(0, 5, -1)
+    assert ring.stats()['evicted_frames'] == 4
+
+
+def test_ring_eviction_order_under_byte_cap():
+    ring = FrameRing(max_frames=64, max_bytes=5 * Frame.overhead(2))
+    insert_eviction_mix(ring)
+
+    # each new (complete) frame makes room for itself by evicting one frame:
+    # incomplete non-key, incomplete key, then complete frames but the latest key
+    for frame_id, evicted in [(5, 2), (6, 1), (7, 0), (8, 3), (9, 5)]:
+        assert ring.insert_datagram(datagram(frame_id, 0, 1)) is not None
+        assert ring.get(evicted) is None, f"frame {evicted} should be evicted"
+        assert ring.get(4) is not None
+
+    assert ring.stats()['evicted_frames'] == 5
+
+
+def test_ring_keeps_latest_key_frame_and_drops_when_nothing_to_evict():
+    ring = FrameRing(max_frames=64, max_bytes=Frame.overhead(1))
+    complete_frame(ring, 0, frame_type=FrameType.KEY)
+
+    assert ring.insert_datagram(datagram(1, 0, 1)) is None
+    assert ring.get(0) is not None
+    assert ring.stats()['dropped_datagrams'] == 1
+
+
+def test_ring_latest_key_frame_tracks_removal():
+    ring = FrameRing()
+    complete_frame(ring, 0, frame_type=FrameType.KEY)
+    complete_frame(ring, 2, frame_type=FrameType.KEY)
+    complete_frame(ring, 1, frame_type=FrameType.KEY)
+    assert ring.latest_key_frame() == 2
+
+    ring.clean_up_to(3)
+    assert ring.latest_key_frame() is None
+
+
+# Decoder recovery
+
+@pytest.fixture
+def decoder():
+    # lazy level 2: no worker, frames are only handed off
+    decoder = Decoder(64, 64, lazy_level=2, max_buffered_frames=16)
+    yield decoder
+    decoder.frame_buf_.clear()
+
+
+def receive(decoder, dgrams):
+    """Add datagrams and consume what becomes decodable; returns the frame IDs."""
+    consumed = []
+    for dgram in dgrams:
+        decoder.add_datagram(dgram)
+        while decoder.next_frame_complete():
+            consumed.append(decoder.next_frame_)
+            decoder.consume_next_frame()
+    return consumed
+
+
+def test_decoder_consumes_frames_in_order(decoder):
+    dgrams = fragments(1, 2) + fragments(0, 2, frame_type=FrameType.KEY)
+    assert receive(decoder, dgrams) == [0, 1]
+
+
+def test_decoder_recovers_to_latest_complete_key_frame(decoder):
+    assert receive(decoder, fragments(0, 1, frame_type=FrameType.KEY)) == [0]
+
+    # frame 1 is lost for good; 2 is useless without it, 3 and 5 are key frames
+    dgrams = (fragments(2, 1) + fragments(3, 1, frame_type=FrameType.KEY) +
+              fragments(4, 1) + fragments(5, 1, frame_type=FrameType.KEY))
+    assert receive(decoder, dgrams) == [3, 4, 5]
+    assert decoder.next_frame_ == 6
+
+    # late datagrams of skipped frames are ignored
+    assert receive(decoder, fragments(1, 1)) == []
+
+
+def test_decoder_skips_to_complete_key_frame_beyond_window(decoder):
+    assert receive(decoder, fragments(0, 1, frame_type=FrameType.KEY)) == [0]
+    receive(decoder, fragments(2, 1))
+
+    # the key frame is complete only with its last fragment
+    far = fragments(100, 3, frame_type=FrameType.KEY)
+    assert receive(decoder, far[:2]) == []
+    assert decoder.next_frame_ == 1
+    assert receive(decoder, far[2:] + fragments(101, 1)) == [100, 101]
+
+
+def test_decoder_ignores_stray_far_key_datagram(decoder):
+    assert receive(decoder, fragments(0, 1, frame_type=FrameType.KEY)) == [0]
+    assert receive(decoder, [datagram(1 << 30, 0, 2, frame_type=FrameType.KEY)]) == []
+    assert receive(decoder, fragments(1, 1) + fragments(2, 1)) == [1, 2]
+
+
+def test_decoder_moves_far_key_frame_into_window(decoder):
+    far = fragments(20, 2, frame_type=FrameType.KEY)
+    receive(decoder, far[:1])
+
+    frames = fragments(0, 1, frame_type=FrameType.KEY)
+    for frame_id in range(1, 8):
+        frames += fragments(frame_id, 1)
+    assert receive(decoder, frames) == list(range(8))
+    assert decoder.frame_buf_.get(20) is not None
+
+    # with frames 8-19 lost, the key frame completes inside the window
+    assert receive(decoder, far[1:]) == [20]
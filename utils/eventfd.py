@@ -0,0 +1,45 @@
+import os
+import struct
+import ctypes
+from .file_descriptor import FileDescriptor
+from .exception_rim import check_syscall
+from .conversion import narrow_cast
+
+
+# eventfd with ctypes (os.eventfd requires Python 3.10)
+libc = ctypes.CDLL('libc.so.6')
+
+# Constants
+EFD_SEMAPHORE = 0o1
+EFD_NONBLOCK = 0o4000
+EFD_CLOEXEC = 0o2000000
+
+eventfd = libc.eventfd
+eventfd.argtypes = [ctypes.c_uint, ctypes.c_int]
+eventfd.restype = ctypes.c_int
+
+class Eventfd(FileDescriptor):
+    """A 64-bit counter in the kernel, used as a doorbell between processes."""
+
+    COUNTER = struct.Struct('Q')
+
+    def __init__(self, initval: int = 0, flags: int = 0):
+        fd = check_syscall(eventfd(initval, flags))
+        super().__init__(fd)
+
+
+    def notify(self, n: int = 1) -> None:
+        os.write(self._fd, self.COUNTER.pack(n))
+
+
+    def read_count(self) -> int:
+        """Block until the counter is nonzero, then return and reset it."""
+        result = os.read(self._fd, self.COUNTER.size)
+
+        if len(result) != self.COUNTER.size:
+            raise RuntimeError("read error in eventfd")
+
+        return narrow_cast(int, self.COUNTER.unpack(result)[0])
+
+    def fileno(self) -> int:
+        return self._fd
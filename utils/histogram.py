@@ -0,0 +1,135 @@
+from bisect import bisect_left
+from itertools import accumulate
+from operator import add
+from typing import Dict, List, Sequence
+
+from utils.conversion import double_to_string
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram of non-negative integers (e.g. latencies in us).
+
+    Like HdrHistogram, every power of two is split into 2^SUB_BUCKET_BITS
+    linear sub-buckets, so a value is known to within 1/2^SUB_BUCKET_BITS
+    (~1.6%) of itself at any magnitude; values below 2^(SUB_BUCKET_BITS + 1)
+    are exact. Values of MAX_VALUE or more fall into the last bucket, and
+    negative values (e.g. across a clock step) are not recorded. The exact
+    count, sum, minimum and maximum are kept alongside.
+    """
+    SUB_BUCKET_BITS = 6
+    MAX_VALUE_BITS = 36  # ~19 hours in us
+
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    MAX_VALUE = 1 << MAX_VALUE_BITS
+    NUM_BUCKETS = (MAX_VALUE_BITS - SUB_BUCKET_BITS + 1) << SUB_BUCKET_BITS
+
+    # percentiles reported by summary() and format()
+    PERCENTILES = {'p50': 50, 'p90': 90, 'p99': 99, 'p999': 99.9}
+
+    def __init__(self):
+        self.counts_ = [0] * self.NUM_BUCKETS
+        self.count_ = 0
+        self.sum_ = 0
+        self.min_ = 0
+        self.max_ = 0
+
+    def record(self, value: int) -> None:
+        if value < 2 * self.SUB_BUCKETS:
+            if value < 0:
+                return
+            index = value
+        else:
+            shift = value.bit_length() - self.SUB_BUCKET_BITS - 1
+            index = min((shift << self.SUB_BUCKET_BITS) + (value >> shift),
+                        self.NUM_BUCKETS - 1)
+
+        self.counts_[index] += 1
+        if self.count_ == 0 or value < self.min_:
+            self.min_ = value
+        if value > self.max_:
+            self.max_ = value
+        self.count_ += 1
+        self.sum_ += value
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        """Add the values recorded in 'other' to this histogram."""
+        if other.count_ == 0:
+            return
+
+        self.counts_ = list(map(add, self.counts_, other.counts_))
+        self.min_ = other.min_ if self.count_ == 0 else min(self.min_, other.min_)
+        self.max_ = max(self.max_, other.max_)
+        self.count_ += other.count_
+        self.sum_ += other.sum_
+
+    def reset(self) -> None:
+        self.__init__()
+
+    def count(self) -> int:
+        return self.count_
+
+    def min(self) -> int:
+        return self.min_
+
+    def max(self) -> int:
+        return self.max_
+
+    def sum(self) -> int:
+        return self.sum_
+
+    def mean(self) -> float:
+        return self.sum_ / self.count_ if self.count_ else 0.0
+
+    @classmethod
+    def bucket_index(cls, value: int) -> int:
+        """Bucket that a non-negative 'value' falls into (inlined in record())."""
+        if value < 2 * cls.SUB_BUCKETS:
+            return value
+
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS - 1
+        return min((shift << cls.SUB_BUCKET_BITS) + (value >> shift), cls.NUM_BUCKETS - 1)
+
+    @classmethod
+    def bucket_high(cls, index: int) -> int:
+        """Highest value that falls into bucket 'index'."""
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+
+        shift = (index >> cls.SUB_BUCKET_BITS) - 1
+        return (((index - (shift << cls.SUB_BUCKET_BITS)) + 1) << shift) - 1
+
+    def cumulative_counts(self) -> List[int]:
+        """Number of values in every bucket and the ones below it."""
+        return list(accumulate(self.counts_))
+
+    def percentiles(self, percentiles: Sequence[float]) -> List[int]:
+        """Values at or below which the given percentages (0-100) of values fall.
+
+        Each is the highest value of its bucket, clamped to the recorded range.
+        """
+        if self.count_ == 0:
+            return [0] * len(percentiles)
+
+        cumulative = self.cumulative_counts()
+        values = []
+        for percentile in percentiles:
+            rank = max(1, -(-int(percentile * self.count_) // 100))
+            index = bisect_left(cumulative, min(rank, self.count_))
+            values.append(max(self.min_, min(self.bucket_high(index), self.max_)))
+
+        return values
+
+    def percentile(self, percentile: float) -> int:
+        return self.percentiles([percentile])[0]
+
+    def summary(self) -> Dict[str, float]:
+        """Count, mean, max and PERCENTILES, e.g. for JSON output."""
+        summary = {'count': self.count_, 'mean': self.mean(), 'max': self.max_}
+        summary.update(zip(self.PERCENTILES, self.percentiles(list(self.PERCENTILES.values()))))
+        return summary
+
+    def format(self, scale: float = 1000) -> str:
+        """PERCENTILES and the maximum divided by 'scale' (by default us to ms)."""
+        values = self.percentiles(list(self.PERCENTILES.values())) + [self.max_]
+        return ", ".join(f"{name} {double_to_string(value / scale)}"
+                         for name, value in zip(list(self.PERCENTILES) + ['max'], values))
@@ -25,4 +25,22 @@ uint64_t timestamp_ms()
 }
 """
 def timestamp_ms() -> int:
-    return int(time.time() * 1e3)
\ No newline at end of file
+    return int(time.time() * 1e3)
+
+
+class VirtualClock:
+    """A clock that only moves when advanced, for simulations.
+
+    Calling it returns the current time in us, so it can stand in for
+    timestamp_us wherever a clock is injected.
+    """
+    def __init__(self, start_us: int = 0):
+        self.now_us_ = start_us
+
+    def __call__(self) -> int:
+        return self.now_us_
+
+    def advance_to(self, ts_us: int) -> None:
+        if ts_us < self.now_us_:
+            raise RuntimeError("VirtualClock: time cannot go backwards")
+        self.now_us_ = ts_us
\ No newline at end of file
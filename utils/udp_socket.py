@@ -66,9 +66,10 @@ class UDPSocket(Socket):
         if not data:
             raise RuntimeError("attempted to send empty data")
         
-        bytes_sent = self._sock.sendto(data.encode(), dst_addr.sock_addr())
+        data_bytes = data.encode() if isinstance(data, str) else data
+        bytes_sent = self._sock.sendto(data_bytes, dst_addr.sock_addr())
 
-        return self.check_bytes_sent(bytes_sent, len(data))
+        return self.check_bytes_sent(bytes_sent, len(data_bytes))
 
 
     def check_bytes_received(self, bytes_received: int) -> bool:
@@ -91,12 +92,12 @@ class UDPSocket(Socket):
             Optional[bytes]: Received data or None if error/no data
         """
         try:
-            # data to receive
-            buf = bytearray(self.UDP_MTU)
-            bytes_received = self._sock.recv_into(buf, self.UDP_MTU)
-            if not self.check_bytes_received(bytes_received):
+            # recv() shrinks its buffer to the datagram instead of
+            # allocating and copying out of a zeroed bytearray every time
+            data = self._sock.recv(self.UDP_MTU)
+            if not self.check_bytes_received(len(data)):
                 return None
-            return bytes(buf[:bytes_received])
+            return data
             
         except BlockingIOError:
             return None  # No data available (non-blocking socket)
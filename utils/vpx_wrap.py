@@ -111,6 +111,8 @@ vpx_image_t = vpx_image
 libvpx.vpx_img_alloc.restype = POINTER(vpx_image)
 libvpx.vpx_img_alloc.argtypes = [POINTER(vpx_image), vpx_img_fmt, c_uint16, c_uint16, c_uint16]
 libvpx.vpx_img_free.argtypes = [POINTER(vpx_image)]
+libvpx.vpx_img_wrap.restype = POINTER(vpx_image)
+libvpx.vpx_img_wrap.argtypes = [POINTER(vpx_image), vpx_img_fmt, c_uint, c_uint, c_uint, c_void_p]
 
 
 
@@ -290,6 +292,9 @@ vpx_codec_err_t = c_int # enum
 
 vpx_codec_flags_t = c_long
 
+# encoder init flags (vpx_encoder.h)
+VPX_CODEC_USE_PSNR = 0x10000            # calculate PSNR on each frame
+
 
 class vpx_codec_dec_cfg(Structure):
     _fields_ = [
@@ -332,6 +337,8 @@ VPX_ENCODER_ABI_VERSION = 15 + VPX_CODEC_ABI_VERSION + VPX_EXT_RATECTRL_ABI_VERS
 # codec_control const
 VP8E_SET_CPUUSED = 13
 VP8E_SET_STATIC_THRESHOLD = 17
+VP8E_GET_LAST_QUANTIZER = 19        # int *: internal quantizer index (0..255)
+VP8E_GET_LAST_QUANTIZER_64 = 20     # int *: quantizer on the 0..63 scale
 VP8E_SET_MAX_INTRA_BITRATE_PCT = 26
 VP9E_SET_AQ_MODE = 36
 VP9E_SET_TILE_COLUMNS = 33
@@ -2,7 +2,58 @@ from utils.vpx_wrap import *
 
 from ctypes import c_size_t, c_uint16, c_uint8
 from ctypes import POINTER, cast, memmove
-from ctypes import c_int
+from ctypes import c_int, c_void_p
+
+import numpy as np
+from enum import Enum
+
+
+class ColorMatrix(Enum):
+    """RGB to limited-range YCbCr matrices."""
+    BT601 = 0
+    BT709 = 1
+
+
+# fixed-point coefficients (scaled by 256) of R, G, B for Y, U and V
+RGB_TO_YUV = {
+    ColorMatrix.BT601: ((66, 129, 25), (-38, -74, 112), (112, -94, -18)),
+    ColorMatrix.BT709: ((47, 157, 16), (-26, -87, 112), (112, -102, -10)),
+}
+
+
+def _fixed_point_dot(r: np.ndarray, g: np.ndarray, b: np.ndarray,
+                     coeffs: tuple, offset: int) -> np.ndarray:
+    """(cr * r + cg * g + cb * b) / 256 + offset, rounded, in uint16 arithmetic.
+
+    Intermediate results may wrap around; the final value always fits in
+    16 bits for 8-bit input, so modular arithmetic yields the exact result.
+    """
+    cr, cg, cb = (np.uint16(c & 0xFFFF) for c in coeffs)
+
+    acc = r * cr
+    acc += g * cg
+    acc += b * cb
+    acc += np.uint16(offset * 256 + 128)
+    acc >>= 8
+    return acc
+
+
+def _average_2x2(plane: np.ndarray) -> np.ndarray:
+    """Average each 2x2 block of a uint16 plane with even dimensions."""
+    rows = plane[0::2] + plane[1::2]
+    blocks = rows[:, 0::2] + rows[:, 1::2]
+    blocks += 2
+    blocks >>= 2
+    return blocks
+
+
+def _average_row_pairs(plane: np.ndarray) -> np.ndarray:
+    """Halve the height of a uint8 plane by averaging pairs of rows."""
+    if plane.shape[0] % 2:
+        plane = np.concatenate((plane, plane[-1:]))
+
+    rows = plane.astype(np.uint16)
+    return ((rows[0::2] + rows[1::2] + 1) >> 1).astype(np.uint8)
 
 
 class RawImage:
@@ -75,24 +126,110 @@ class RawImage:
         return self._vpx_img.contents.stride[VPX_PLANE_V]
 
 
-    def copy_from_yuyv(self, src: bytes):
+    def plane_array(self, plane: int, width: int, height: int) -> np.ndarray:
+        """View a plane as a (height, width) uint8 array without copying.
+
+        Rows are 'stride' bytes apart in memory, so the view is not
+        contiguous unless the stride equals the width. It stays valid as
+        long as the vpx_image does: for a borrowed decoder image, only
+        until the next frame is decoded.
+        """
+        img = self._vpx_img.contents
+        stride = img.stride[plane]
+
+        rows = (c_uint8 * (stride * height)).from_address(
+            cast(img.planes[plane], c_void_p).value)
+        # an owned image must outlive its views
+        rows._owner = self
+
+        return np.frombuffer(rows, dtype=np.uint8).reshape(height, stride)[:, :width]
+
+
+    def y_array(self) -> np.ndarray:
+        return self.plane_array(VPX_PLANE_Y, self._display_width, self._display_height)
+
+
+    def u_array(self) -> np.ndarray:
+        return self.plane_array(VPX_PLANE_U, (self._display_width + 1) // 2,
+                                (self._display_height + 1) // 2)
+
+
+    def v_array(self) -> np.ndarray:
+        return self.plane_array(VPX_PLANE_V, (self._display_width + 1) // 2,
+                                (self._display_height + 1) // 2)
+
+
+    def copy_from_packed_422(self, src: bytes, y_offset: int, u_offset: int, v_offset: int):
+        if self._display_width % 2:
+            raise RuntimeError("RawImage: packed 4:2:2 input needs an even width")
+
         if len(src) != self.y_size() * 2:
-            raise RuntimeError("RawImage: invalid YUYV size")
+            raise RuntimeError("RawImage: invalid packed 4:2:2 size")
+
+        # one row of (Y0, U, Y1, V) macropixels in some byte order per line
+        pixels = np.frombuffer(src, dtype=np.uint8).reshape(
+            self._display_height, self._display_width // 2, 4)
+
+        y = self.y_array()
+        y[:, 0::2] = pixels[:, :, y_offset]
+        y[:, 1::2] = pixels[:, :, y_offset + 2]
+
+        # 4:2:2 to 4:2:0: average the chroma of each pair of lines
+        self.u_array()[:] = _average_row_pairs(pixels[:, :, u_offset])
+        self.v_array()[:] = _average_row_pairs(pixels[:, :, v_offset])
+
+
+    def copy_from_yuyv(self, src: bytes):
+        self.copy_from_packed_422(src, 0, 1, 3)
+
+
+    def copy_from_uyvy(self, src: bytes):
+        self.copy_from_packed_422(src, 1, 0, 2)
+
+
+    def copy_from_nv12(self, src: bytes):
+        uv_width = (self._display_width + 1) // 2
+        uv_height = (self._display_height + 1) // 2
+        if len(src) != self.y_size() + 2 * uv_width * uv_height:
+            raise RuntimeError("RawImage: invalid NV12 size")
+
+        data = np.frombuffer(src, dtype=np.uint8)
+        self.y_array()[:] = data[:self.y_size()].reshape(
+            self._display_height, self._display_width)
+
+        uv = data[self.y_size():].reshape(uv_height, uv_width, 2)
+        self.u_array()[:] = uv[:, :, 0]
+        self.v_array()[:] = uv[:, :, 1]
+
+
+    def copy_from_rgb(self, src: bytes, order: tuple, matrix: ColorMatrix):
+        if len(src) != self.y_size() * 3:
+            raise RuntimeError("RawImage: invalid RGB size")
+
+        pixels = np.frombuffer(src, dtype=np.uint8).reshape(
+            self._display_height, self._display_width, 3)
+        y_coeffs, u_coeffs, v_coeffs = RGB_TO_YUV[matrix]
+
+        r = pixels[:, :, order[0]].astype(np.uint16)
+        g = pixels[:, :, order[1]].astype(np.uint16)
+        b = pixels[:, :, order[2]].astype(np.uint16)
+        self.y_array()[:] = _fixed_point_dot(r, g, b, y_coeffs, 16)
+
+        # chroma of the average color of each 2x2 block
+        if self._display_height % 2 or self._display_width % 2:
+            pad = ((0, self._display_height % 2), (0, self._display_width % 2))
+            r, g, b = (np.pad(c, pad, mode='edge') for c in (r, g, b))
+        r, g, b = _average_2x2(r), _average_2x2(g), _average_2x2(b)
+        self.u_array()[:] = _fixed_point_dot(r, g, b, u_coeffs, 128)
+        self.v_array()[:] = _fixed_point_dot(r, g, b, v_coeffs, 128)
 
-        dst_y = self.y_plane()
-        dst_u = self.u_plane()
-        dst_v = self.v_plane()
 
-        # Use ctypes.create_string_buffer to create a stable buffer
-        p = (c_uint8 * len(src)).from_buffer_copy(src)
+    def copy_from_rgb24(self, src: bytes, matrix: ColorMatrix = ColorMatrix.BT601):
+        self.copy_from_rgb(src, (0, 1, 2), matrix)
 
-        for i in range(self.y_size()):
-            dst_y[i] = (p[i * 2])
 
-        for i in range(self._display_height // 2):
-            for j in range(self._display_width // 2):
-                dst_u[i * (self._display_width // 2) + j] = (p[(i * 2 * self._display_width + j * 2) * 2 + 1])
-                dst_v[i * (self._display_width // 2) + j] = (p[(i * 2 * self._display_width + j * 2) * 2 + 3])
+    def copy_from_bgr24(self, src: bytes, matrix: ColorMatrix = ColorMatrix.BT601):
+        self.copy_from_rgb(src, (2, 1, 0), matrix)
 
 
     def copy_y_from(self, src: bytes):
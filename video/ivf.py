@@ -0,0 +1,216 @@
+import os
+import mmap
+import struct
+from typing import List
+
+from utils.file_descriptor import FileDescriptor
+from utils.exception_rim import check_syscall
+
+"""
+IVF container: a 32-byte file header followed by the frames, each preceded by
+a 12-byte frame header (frame size and presentation timestamp).
+
+A side index '<file>.idx' records the offset, size, flags and timestamp of
+every frame so that readers can seek without scanning the whole file.
+"""
+IVF_SIGNATURE = b"DKIF"
+IVF_FOURCC_VP9 = b"VP90"
+
+# signature, version, header size, fourcc, width, height,
+# timebase denominator (frame rate), timebase numerator, frame count, unused
+IVF_FILE_HEADER = struct.Struct('<4sHH4sHHIIII')
+# frame size, presentation timestamp
+IVF_FRAME_HEADER = struct.Struct('<IQ')
+
+IVF_INDEX_MAGIC = b"RMIVFIDX"
+# offset of frame data, frame size, flags, presentation timestamp
+IVF_INDEX_ENTRY = struct.Struct('<QIIQ')
+IVF_FRAME_IS_KEY = 0x1
+
+
+def ivf_index_path(ivf_path: str) -> str:
+    return ivf_path + ".idx"
+
+
+def vp9_is_key_frame(data) -> bool:
+    """Read the frame type from the uncompressed header of a VP9 frame."""
+    if len(data) == 0:
+        return False
+
+    byte = data[0]
+    if byte >> 6 != 0b10:  # frame marker
+        return False
+
+    profile = ((byte >> 5) & 1) | (((byte >> 4) & 1) << 1)
+    bit = 3 if profile < 3 else 2  # profile 3 carries a reserved zero bit
+
+    if (byte >> bit) & 1:  # show_existing_frame
+        return False
+
+    # frame_type: 0 for key frames
+    return (byte >> (bit - 1)) & 1 == 0
+
+
+def write_all(fd: int, bufs: list) -> None:
+    total = sum(len(buf) for buf in bufs)
+    written = os.writev(fd, bufs)
+
+    if written != total:
+        # short write: fall back to writing the remainder piece by piece
+        data = memoryview(b"".join(bytes(buf) for buf in bufs))[written:]
+        while data:
+            data = data[os.write(fd, data):]
+
+
+class IVFWriter:
+
+    def __init__(self, path: str, width: int, height: int, frame_rate: int,
+                 fourcc: bytes = IVF_FOURCC_VP9, write_index: bool = True):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        self._fd = FileDescriptor(check_syscall(os.open(path, flags, 0o644)))
+        self._index_fd = None
+        if write_index:
+            self._index_fd = FileDescriptor(check_syscall(
+                os.open(ivf_index_path(path), flags, 0o644)))
+            os.write(self._index_fd.fd_num(), IVF_INDEX_MAGIC)
+
+        self._width = width
+        self._height = height
+        self._frame_rate = frame_rate
+        self._fourcc = fourcc
+        self._frame_count = 0
+
+        self._offset = IVF_FILE_HEADER.size
+        os.write(self._fd.fd_num(), self.file_header())
+
+
+    def file_header(self) -> bytes:
+        return IVF_FILE_HEADER.pack(IVF_SIGNATURE, 0, IVF_FILE_HEADER.size, self._fourcc,
+                                    self._width, self._height, self._frame_rate, 1,
+                                    self._frame_count, 0)
+
+
+    def write_frame(self, data, pts: int, key: bool) -> None:
+        frame_size = len(data)
+        write_all(self._fd.fd_num(), [IVF_FRAME_HEADER.pack(frame_size, pts), data])
+
+        data_offset = self._offset + IVF_FRAME_HEADER.size
+        self._offset = data_offset + frame_size
+        self._frame_count += 1
+
+        if self._index_fd:
+            flags = IVF_FRAME_IS_KEY if key else 0
+            os.write(self._index_fd.fd_num(),
+                     IVF_INDEX_ENTRY.pack(data_offset, frame_size, flags, pts))
+
+
+    def frame_count(self) -> int:
+        return self._frame_count
+
+
+    def close(self) -> None:
+        if self._fd.fd_num() < 0:
+            return
+
+        # patch the frame count in the file header
+        os.pwrite(self._fd.fd_num(), self.file_header(), 0)
+        self._fd.close()
+
+        if self._index_fd:
+            self._index_fd.close()
+
+
+class IVFReader:
+
+    def __init__(self, path: str):
+        self._fd = FileDescriptor(check_syscall(os.open(path, os.O_RDONLY)))
+
+        file_size = self._fd.file_size()
+        if file_size < IVF_FILE_HEADER.size:
+            raise RuntimeError("IVF file is too small")
+
+        self._map = mmap.mmap(self._fd.fd_num(), file_size, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._map)
+
+        (signature, _, header_size, self._fourcc, self._width, self._height,
+         self._frame_rate, _, _, _) = IVF_FILE_HEADER.unpack_from(self._buf, 0)
+        if signature != IVF_SIGNATURE:
+            raise RuntimeError("invalid IVF file signature")
+
+        self._offsets: List[int] = []
+        self._sizes: List[int] = []
+        self._flags: List[int] = []
+        self._pts: List[int] = []
+
+        if not self.load_index(ivf_index_path(path)):
+            self.scan_frames(header_size)
+
+
+    def load_index(self, index_path: str) -> bool:
+        try:
+            with open(index_path, 'rb') as f:
+                index = f.read()
+        except FileNotFoundError:
+            return False
+
+        if index[:len(IVF_INDEX_MAGIC)] != IVF_INDEX_MAGIC:
+            return False
+
+        entries = memoryview(index)[len(IVF_INDEX_MAGIC):]
+        num_entries = len(entries) // IVF_INDEX_ENTRY.size
+        for offset, size, flags, pts in IVF_INDEX_ENTRY.iter_unpack(
+                entries[:num_entries * IVF_INDEX_ENTRY.size]):
+            # ignore a tail that was indexed but never fully written out
+            if offset + size > len(self._buf):
+                break
+            self._offsets.append(offset)
+            self._sizes.append(size)
+            self._flags.append(flags)
+            self._pts.append(pts)
+
+        return True
+
+
+    def scan_frames(self, header_size: int) -> None:
+        offset = header_size
+        while offset + IVF_FRAME_HEADER.size <= len(self._buf):
+            size, pts = IVF_FRAME_HEADER.unpack_from(self._buf, offset)
+            offset += IVF_FRAME_HEADER.size
+            if offset + size > len(self._buf):
+                break  # truncated frame
+
+            key = vp9_is_key_frame(self._buf[offset:offset + 1])
+            self._offsets.append(offset)
+            self._sizes.append(size)
+            self._flags.append(IVF_FRAME_IS_KEY if key else 0)
+            self._pts.append(pts)
+            offset += size
+
+
+    def frame_count(self) -> int:
+        return len(self._offsets)
+
+
+    def frame(self, frame_no: int) -> memoryview:
+        offset = self._offsets[frame_no]
+        return self._buf[offset:offset + self._sizes[frame_no]]
+
+
+    def is_key(self, frame_no: int) -> bool:
+        return bool(self._flags[frame_no] & IVF_FRAME_IS_KEY)
+
+
+    def pts(self, frame_no: int) -> int:
+        return self._pts[frame_no]
+
+
+    def display_width(self) -> int:
+        return self._width
+
+
+    def display_height(self) -> int:
+        return self._height
+
+
+    def frame_rate(self) -> int:
+        return self._frame_rate
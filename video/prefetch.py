@@ -0,0 +1,146 @@
+import threading
+from collections import deque
+from typing import Deque, Optional
+
+from video.image import RawImage
+from video.video_input import VideoInput
+
+
+class PrefetchingVideoInput(VideoInput):
+    """Reads the frames of another VideoInput ahead of time on a background thread.
+
+    A fixed set of RawImages circulates between a free list and a queue of
+    filled frames. next_frame() hands out the oldest filled image and takes
+    back the one it handed out before, so the caller only ever waits for
+    I/O when the source falls behind (an underrun).
+    """
+
+    def __init__(self, source: VideoInput, num_buffers: int = 4):
+        super().__init__()
+        if num_buffers < 2:
+            raise RuntimeError("PrefetchingVideoInput: needs at least two buffers")
+
+        self._source = source
+        self._free: Deque[RawImage] = deque(
+            RawImage(source.display_width(), source.display_height())
+            for _ in range(num_buffers))
+        self._filled: Deque[RawImage] = deque()
+
+        # image handed out by the last next_frame()
+        self._current: Optional[RawImage] = None
+
+        # frames to skip before the next read from the source
+        self._pending_skip = 0
+        self._eof = False
+        self._stop = False
+        self._num_underruns = 0
+
+        self._cv = threading.Condition()
+        self._thread = threading.Thread(target=self.prefetch_main, daemon=True)
+        self._thread.start()
+
+
+    def __del__(self):
+        self.close()
+
+
+    def prefetch_main(self) -> None:
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._free or self._stop)
+                if self._stop:
+                    return
+
+                raw_img = self._free.popleft()
+                skip = self._pending_skip
+                self._pending_skip = 0
+
+            # the source is only touched from this thread
+            if skip:
+                self._source.skip(skip)
+            got_frame = self._source.read_frame(raw_img)
+
+            with self._cv:
+                if not got_frame:
+                    self._free.append(raw_img)
+                    self._eof = True
+                elif self._pending_skip:
+                    # skipped while being read
+                    self._pending_skip -= 1
+                    self._free.append(raw_img)
+                else:
+                    self._filled.append(raw_img)
+
+                self._cv.notify_all()
+                if self._eof:
+                    return
+
+
+    def next_frame(self) -> Optional[RawImage]:
+        """Return the next frame, valid until the following call (None at the end)."""
+        with self._cv:
+            # recycle the previous frame
+            if self._current is not None:
+                self._free.append(self._current)
+                self._current = None
+                self._cv.notify_all()
+
+            if not self._filled and not self._eof:
+                self._num_underruns += 1
+                self._cv.wait_for(lambda: self._filled or self._eof)
+
+            if not self._filled:
+                return None
+
+            self._current = self._filled.popleft()
+            return self._current
+
+
+    def read_frame(self, raw_img: RawImage) -> bool:
+        frame = self.next_frame()
+        if frame is None:
+            return False
+
+        raw_img.y_array()[:] = frame.y_array()
+        raw_img.u_array()[:] = frame.u_array()
+        raw_img.v_array()[:] = frame.v_array()
+        return True
+
+
+    def skip(self, n: int) -> None:
+        with self._cv:
+            # drop frames that are already prefetched first
+            while n > 0 and self._filled:
+                self._free.append(self._filled.popleft())
+                n -= 1
+
+            self._pending_skip += n
+            self._cv.notify_all()
+
+
+    def num_underruns(self) -> int:
+        """Times next_frame() waited for the source since the last stats output."""
+        return self._num_underruns
+
+
+    def output_periodic_stats(self) -> None:
+        with self._cv:
+            num_underruns = self._num_underruns
+            self._num_underruns = 0
+
+        if num_underruns > 0:
+            print(f" - Prefetch underruns (waited for raw frames): {num_underruns}")
+
+
+    def close(self) -> None:
+        with self._cv:
+            self._stop = True
+            self._cv.notify_all()
+
+
+    def display_width(self) -> int:
+        return self._source.display_width()
+
+
+    def display_height(self) -> int:
+        return self._source.display_height()
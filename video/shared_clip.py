@@ -0,0 +1,241 @@
+import os
+import time
+import fcntl
+import struct
+import hashlib
+from typing import Optional
+from ctypes import addressof, c_ubyte
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from utils.vpx_wrap import vpx_image
+from video.yuv4mpeg import YUV4MPEG
+
+
+class SharedClip(YUV4MPEG):
+    """A YUV4MPEG2 clip loaded once into named shared memory for all senders on a host.
+
+    The first process to open a clip copies its I420 frames, back to back,
+    into a segment named after the file's path, size, modification time and
+    dimensions, then marks it ready. Every other process attaches to the
+    segment and serves frames from it exactly like YUV4MPEG serves them from
+    its file mapping, so wrap_frame() points images straight into the
+    shared pages. Attached processes never write to the segment.
+
+    The loading process holds a lock on the segment until it is ready, so
+    attaching processes can tell a loader that died from a slow one; a
+    segment left behind that way is removed and loaded again. A loader that
+    fails removes its segment itself.
+
+    The segment outlives the processes that use it (it is a cache); call
+    unlink() to remove it.
+    """
+    MAGIC = b"RMCLIP02"
+
+    # magic, ready flag, loader PID, width, height, frame count, frame size
+    HEADER = struct.Struct('<8sIIIIII')
+    READY_OFFSET = 8
+    LOADER_OFFSET = 12
+    DATA_OFFSET = 4096  # frames start page-aligned
+
+    LOAD_TIMEOUT = 60  # seconds to wait for another process to load the clip
+
+    def __init__(self, video_file_path: str, display_width: int, display_height: int,
+                 loop: bool = True):
+        self._display_width = display_width
+        self._display_height = display_height
+        self._loop = loop
+
+        self._name = self.segment_name(video_file_path, display_width, display_height)
+
+        # until attached to a ready segment or loaded one (again, if another
+        # loader died)
+        self._shm = None
+        deadline = time.monotonic() + self.LOAD_TIMEOUT
+        while self._shm is None:
+            try:
+                self._shm = self.attach(self._name, deadline)
+            except FileNotFoundError:
+                self._shm = self.load(video_file_path, deadline)
+
+        self._buf = self._shm.buf
+        self._data = np.frombuffer(self._buf, dtype=np.uint8)
+        self._address = addressof(c_ubyte.from_buffer(self._buf))
+
+        frame_count = self.HEADER.unpack_from(self._buf)[5]
+        self._offsets = [self.DATA_OFFSET + i * self.frame_size() for i in range(frame_count)]
+        self._next_frame = 0
+
+        # image header reused by wrap_frame()
+        self._wrapped_img = vpx_image()
+
+
+    def __del__(self):
+        # images returned by wrap_frame() may still point into the segment,
+        # in which case it stays mapped until exit
+        if getattr(self, '_shm', None) is None:
+            return  # failed to open
+
+        self._data = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass
+
+
+    @staticmethod
+    def segment_name(video_file_path: str, display_width: int, display_height: int) -> str:
+        # a clip that changes on disk gets a new segment
+        st = os.stat(video_file_path)
+        key = f"{os.path.realpath(video_file_path)}:{st.st_size}:{st.st_mtime_ns}:" \
+              f"{display_width}x{display_height}"
+        return "ringmaster_clip_" + hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+    @staticmethod
+    def untrack(shm: shared_memory.SharedMemory) -> None:
+        # the segment is shared across unrelated processes: don't let this
+        # process' resource tracker unlink it at exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+
+    def open_segment(self, name: str, deadline: float) -> shared_memory.SharedMemory:
+        """Open an existing segment, waiting for its creator to size it."""
+        while True:
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            except ValueError:
+                pass  # created but not sized yet: can't map an empty file
+            else:
+                self.untrack(shm)
+                if shm.size >= self.DATA_OFFSET:
+                    return shm
+                shm.close()
+
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"SharedClip: timed out waiting for {name} to be created")
+            time.sleep(0.01)
+
+
+    @staticmethod
+    def loading(shm: shared_memory.SharedMemory) -> bool:
+        """Whether a loading process holds the segment's lock."""
+        try:
+            fcntl.flock(shm._fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+
+        fcntl.flock(shm._fd, fcntl.LOCK_UN)
+        return False
+
+
+    def remove_stale(self, shm: shared_memory.SharedMemory) -> None:
+        """Remove a segment left behind by a loader that died, unless
+        another process has already replaced it."""
+        try:
+            stale = os.stat(f"/dev/shm/{shm.name}").st_ino == os.fstat(shm._fd).st_ino
+        except FileNotFoundError:
+            stale = False
+
+        if stale:
+            resource_tracker.register(shm._name, "shared_memory")
+            shm.unlink()
+        shm.close()
+
+
+    def attach(self, name: str, deadline: float) -> Optional[shared_memory.SharedMemory]:
+        """Attach to the segment once it is loaded.
+
+        Returns:
+            Optional[SharedMemory]: None if the segment was left behind by a
+                                    loader that died and has been removed
+        """
+        shm = self.open_segment(name, deadline)
+
+        # wait for the loading process to finish
+        while True:
+            magic, ready, loader_pid, width, height, _, frame_size = \
+                self.HEADER.unpack_from(shm.buf)
+            if ready:
+                break
+
+            # the loader (once its PID is set) holds the lock until ready
+            timed_out = time.monotonic() > deadline
+            if (loader_pid or timed_out) and not self.loading(shm):
+                if struct.unpack_from('<I', shm.buf, self.READY_OFFSET)[0]:
+                    continue  # became ready meanwhile
+
+                print(f"SharedClip: removing {name}, left behind by loader "
+                      f"{loader_pid or 'unknown'}")
+                self.remove_stale(shm)
+                return None
+
+            if timed_out:
+                shm.close()
+                raise RuntimeError(f"SharedClip: timed out waiting for {name} to be loaded")
+            time.sleep(0.01)
+
+        if (magic != self.MAGIC or width != self._display_width
+                or height != self._display_height or frame_size != self.frame_size()):
+            shm.close()
+            raise RuntimeError(f"SharedClip: {name} does not match the clip")
+
+        return shm
+
+
+    def load(self, video_file_path: str,
+             deadline: float) -> Optional[shared_memory.SharedMemory]:
+        y4m = YUV4MPEG(video_file_path, self._display_width, self._display_height)
+        frame_count = y4m.frame_count()
+
+        try:
+            shm = shared_memory.SharedMemory(
+                name=self._name, create=True,
+                size=self.DATA_OFFSET + frame_count * self.frame_size())
+        except FileExistsError:
+            # another process got there first
+            return self.attach(self._name, deadline)
+        self.untrack(shm)
+
+        data = None
+        try:
+            # released once ready, or by the kernel if this process dies
+            fcntl.flock(shm._fd, fcntl.LOCK_EX)
+            struct.pack_into('<I', shm.buf, self.LOADER_OFFSET, os.getpid())
+
+            # the segment is zero-filled, so it reads as not ready until the end
+            data = np.frombuffer(shm.buf, dtype=np.uint8)
+            for frame_no in range(frame_count):
+                offset = self.DATA_OFFSET + frame_no * self.frame_size()
+                data[offset:offset + self.frame_size()] = y4m.frame_data(frame_no)
+            data = None
+
+            self.HEADER.pack_into(shm.buf, 0, self.MAGIC, 0, os.getpid(), self._display_width,
+                                  self._display_height, frame_count, self.frame_size())
+            struct.pack_into('<I', shm.buf, self.READY_OFFSET, 1)
+            fcntl.flock(shm._fd, fcntl.LOCK_UN)
+        except BaseException:
+            # don't leave behind a segment that never becomes ready
+            data = None
+            resource_tracker.register(shm._name, "shared_memory")
+            shm.unlink()
+            shm.close()
+            raise
+
+        return shm
+
+
+    def name(self) -> str:
+        return self._name
+
+
+    def unlink(self) -> None:
+        """Remove the segment; processes that are attached keep their mapping."""
+        # SharedMemory.unlink() unregisters the segment from the tracker again
+        resource_tracker.register(self._shm._name, "shared_memory")
+        self._shm.unlink()
+
+
+    def fd(self):
+        raise RuntimeError("SharedClip: frames are not read from a file descriptor")
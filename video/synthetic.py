@@ -0,0 +1,152 @@
+from enum import Enum
+from typing import Optional, Tuple
+
+import numpy as np
+
+from video.image import RawImage
+from video.video_input import VideoInput
+
+
+class Pattern(Enum):
+    STATIC = "static"      # one still image per scene
+    GRADIENT = "gradient"  # a smooth texture panning horizontally
+    NOISE = "noise"        # a still texture under changing noise
+
+
+class SyntheticVideoInput(VideoInput):
+    """Generates I420 frames so that benchmarks don't need a clip on disk.
+
+    Every scene is a smooth texture made of sinusoids that repeat across the
+    frame width, built once from a generator seeded with (seed, scene number)
+    and panned (GRADIENT) or overlaid with noise (NOISE) per frame by copying
+    slices of precomputed arrays into the planes. A frame only depends on
+    its number and the parameters, so runs are reproducible.
+    """
+    NOISE_AMPLITUDE = 32  # noise values lie in [0, NOISE_AMPLITUDE)
+    NOISE_STEP = 104729   # pool offset between frames, beyond any motion search
+
+    def __init__(self, display_width: int, display_height: int,
+                 pattern: Pattern = Pattern.GRADIENT, scene_cut_interval: int = 0,
+                 speed: int = 4, seed: int = 0, num_frames: int = 0):
+        """
+        Args:
+            scene_cut_interval: frames per scene (0: a single scene)
+            speed: pixels the GRADIENT pattern pans by per frame
+            num_frames: frames to generate before reporting the end (0: endless)
+        """
+        super().__init__()
+        if display_width % 2 or display_height % 2:
+            raise RuntimeError("SyntheticVideoInput: dimensions must be even")
+
+        self._display_width = display_width
+        self._display_height = display_height
+        self._pattern = pattern
+        self._scene_cut_interval = scene_cut_interval
+        self._speed = speed - speed % 2  # keep luma and chroma aligned
+        self._seed = seed
+        self._num_frames = num_frames
+        self._next_frame = 0
+
+        # planes of the current scene, twice as wide as the frame
+        self._scene_no: Optional[int] = None
+        self._scene: Tuple[np.ndarray, ...] = ()
+
+        if pattern == Pattern.NOISE:
+            y_size = display_width * display_height
+            self._noise = np.random.default_rng([seed, 0xFFFF]).integers(
+                0, self.NOISE_AMPLITUDE, 2 * y_size, dtype=np.uint8)
+
+
+    @staticmethod
+    def texture(rng: np.random.Generator, width: int, height: int,
+                mean: int, amplitude: int) -> np.ndarray:
+        """A (height, 2 * width) texture with values within amplitude / 2 of mean."""
+        # whole periods across the width so that panning wraps seamlessly
+        cols = np.arange(2 * width) / width
+        rows = np.arange(height) / height
+
+        col_freq, row_freq = rng.integers(1, 6, 2)
+        col_phase, row_phase = rng.uniform(0, 2 * np.pi, 2)
+
+        # each term lies in [0, amplitude / 2], so their sum can't overflow uint8
+        quarter = amplitude / 4
+        col_term = np.rint(quarter * (1 + np.sin(2 * np.pi * col_freq * cols + col_phase)))
+        row_term = np.rint(quarter * (1 + np.sin(2 * np.pi * row_freq * rows + row_phase)))
+
+        low = mean - amplitude // 2
+        return (row_term.astype(np.uint8)[:, None] + col_term.astype(np.uint8)[None, :]
+                + np.uint8(low))
+
+
+    def build_scene(self, scene_no: int) -> None:
+        rng = np.random.default_rng([self._seed, scene_no])
+
+        # leave headroom for the noise overlay
+        y_mean = int(rng.integers(64, 160))
+        u_mean, v_mean = (int(m) for m in rng.integers(96, 160, 2))
+
+        width, height = self._display_width, self._display_height
+        self._scene = (self.texture(rng, width, height, y_mean, 60),
+                       self.texture(rng, width // 2, height // 2, u_mean, 24),
+                       self.texture(rng, width // 2, height // 2, v_mean, 24))
+        self._scene_no = scene_no
+
+
+    def read_frame(self, raw_img: RawImage) -> bool:
+        if raw_img.display_width() != self._display_width or raw_img.display_height() != self._display_height:
+            raise RuntimeError("SyntheticVideoInput: image dimensions don't match")
+
+        if self._num_frames and self._next_frame >= self._num_frames:
+            return False
+
+        frame_no = self._next_frame
+        self._next_frame += 1
+
+        scene_no = frame_no // self._scene_cut_interval if self._scene_cut_interval else 0
+        if scene_no != self._scene_no:
+            self.build_scene(scene_no)
+
+        width, height = self._display_width, self._display_height
+        planes = (raw_img.y_array(), raw_img.u_array(), raw_img.v_array())
+
+        if self._pattern == Pattern.NOISE:
+            y_size = width * height
+            for plane_no, (plane, scene) in enumerate(zip(planes, self._scene)):
+                # a different window into the noise pool for every plane and frame
+                plane_height, plane_width = plane.shape
+                offset = (frame_no * self.NOISE_STEP + plane_no * y_size // 4) % y_size
+                noise = self._noise[offset:offset + plane_width * plane_height]
+                np.add(scene[:, :plane_width], noise.reshape(plane_height, plane_width),
+                       out=plane)
+            return True
+
+        shift = 0
+        if self._pattern == Pattern.GRADIENT:
+            shift = frame_no * self._speed % width
+
+        for plane, scene in zip(planes, self._scene):
+            plane_width = plane.shape[1]
+            plane_shift = shift * plane_width // width
+            plane[:] = scene[:, plane_shift:plane_shift + plane_width]
+
+        return True
+
+
+    def skip(self, n: int) -> None:
+        self._next_frame += n
+
+
+    def seek(self, frame_no: int) -> None:
+        self._next_frame = frame_no
+
+
+    def tell(self) -> int:
+        return self._next_frame
+
+
+    def display_width(self) -> int:
+        return self._display_width
+
+
+    def display_height(self) -> int:
+        return self._display_height
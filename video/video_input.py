@@ -13,6 +13,9 @@ public:
 
   // read a raw frame into raw_img
   virtual bool read_frame(RawImage & raw_img) = 0;
+
+  // skip the next n frames without reading them
+  virtual void skip(size_t n) = 0;
 };
 """
 class VideoInput(ABC):
@@ -33,3 +36,7 @@ class VideoInput(ABC):
     @abstractmethod
     def read_frame(self, raw_img: RawImage) -> bool:
         pass
+
+    @abstractmethod
+    def skip(self, n: int) -> None:
+        pass
@@ -1,12 +1,25 @@
 import os
-from utils.file_descriptor import FileDescriptor  
-from video.image import RawImage  
-from video.video_input import VideoInput  
-from utils.conversion import strict_stoi  
+import mmap
+from ctypes import byref, addressof, c_ubyte
+from typing import List, Optional
+
+import numpy as np
+
+from utils.file_descriptor import FileDescriptor
+from utils.vpx_wrap import libvpx, vpx_image, VPX_IMG_FMT_I420
+from video.image import RawImage
+from video.video_input import VideoInput
+from utils.conversion import strict_stoi
 from utils.split import split
 from utils.exception_rim import check_syscall
 
 class YUV4MPEG(VideoInput):
+    """YUV4MPEG2 input backed by a memory mapping of the whole file.
+
+    The offset of every frame is indexed once at open, so reading a frame
+    is a copy out of the mapping (or no copy at all with wrap_frame()) and
+    looping back to the first frame costs nothing.
+    """
 
     def __init__(self, video_file_path: str, display_width: int, display_height: int, loop: bool = True):
         self._fd = FileDescriptor(check_syscall(os.open(video_file_path, os.O_RDONLY)))
@@ -14,12 +27,25 @@ class YUV4MPEG(VideoInput):
         self._display_height = display_height
         self._loop = loop
 
-        y4m_signature = "YUV4MPEG2"
-        y4m_read = self._fd.readn(len(y4m_signature))
-        if y4m_read.decode('utf-8') != y4m_signature:
+        file_size = self._fd.file_size()
+        if file_size == 0:
+            raise RuntimeError("invalid YUV4MPEG2 file signature")
+
+        # a private mapping is writable from Python's point of view (as ctypes
+        # requires) but pages are only ever read
+        self._map = mmap.mmap(self._fd.fd_num(), file_size, access=mmap.ACCESS_COPY)
+        self._data = np.frombuffer(self._map, dtype=np.uint8)
+        self._address = addressof(c_ubyte.from_buffer(self._map))
+
+        y4m_signature = b"YUV4MPEG2"
+        if self._map[:len(y4m_signature)] != y4m_signature:
             raise RuntimeError("invalid YUV4MPEG2 file signature")
 
-        header = self._fd.getline()
+        header_end = self._map.find(b"\n")
+        if header_end < 0:
+            raise RuntimeError("invalid YUV4MPEG2 input format")
+
+        header = self._map[len(y4m_signature):header_end].decode('utf-8')
         tokens = split(header, " ")
 
         for token in tokens:
@@ -29,15 +55,44 @@ class YUV4MPEG(VideoInput):
             if token[0] == 'W':  # width
                 if strict_stoi(token[1:]) != display_width:
                     raise RuntimeError("wrong YUV4MPEG2 frame width")
-                
+
             elif token[0] == 'H':  # height
                 if strict_stoi(token[1:]) != display_height:
                     raise RuntimeError("wrong YUV4MPEG2 frame height")
-                
+
             elif token[0] == 'C':  # color space
                 if token[:4] != "C420":
                     raise RuntimeError("only YUV420 color space is supported")
 
+        # frames start right after the stream header
+        self._header_size = header_end + 1
+        self._offsets = self.index_frames()
+        self._next_frame = 0
+
+        # image header reused by wrap_frame()
+        self._wrapped_img = vpx_image()
+
+
+    def index_frames(self) -> List[int]:
+        """Offsets of the planes of every complete frame in the file."""
+        offsets = []
+
+        offset = self._header_size
+        while offset < len(self._map):
+            # frame headers may carry parameters: "FRAME[ params]\n"
+            header_end = self._map.find(b"\n", offset)
+            if header_end < 0 or self._map[offset:offset + 5] != b"FRAME":
+                raise RuntimeError("invalid YUV4MPEG2 input format")
+
+            data_offset = header_end + 1
+            if data_offset + self.frame_size() > len(self._map):
+                break  # truncated frame
+
+            offsets.append(data_offset)
+            offset = data_offset + self.frame_size()
+
+        return offsets
+
 
     def frame_size(self) -> int:
         return self._display_width * self._display_height * 3 // 2
@@ -50,31 +105,94 @@ class YUV4MPEG(VideoInput):
     def uv_size(self) -> int:
         return self._display_width * self._display_height // 4
 
-    
+
+    def frame_count(self) -> int:
+        return len(self._offsets)
+
+
+    def seek(self, frame_no: int) -> None:
+        """Make 'frame_no' the next frame to read."""
+        if frame_no < 0 or frame_no >= len(self._offsets):
+            raise RuntimeError(f"YUV4MPEG: frame {frame_no} is out of range")
+
+        self._next_frame = frame_no
+
+
+    def skip(self, n: int) -> None:
+        """Skip the next 'n' frames without reading them."""
+        if not self._offsets:
+            return
+
+        if self._loop:
+            self._next_frame = (self._next_frame + n) % len(self._offsets)
+        else:
+            self._next_frame = min(self._next_frame + n, len(self._offsets))
+
+
+    def tell(self) -> int:
+        return self._next_frame
+
+
+    def next_frame_no(self) -> Optional[int]:
+        """Consume the next frame number, looping back if enabled."""
+        if self._next_frame == len(self._offsets):
+            if not self._loop or not self._offsets:
+                return None
+            self._next_frame = 0
+
+        frame_no = self._next_frame
+        self._next_frame += 1
+        return frame_no
+
+
+    def frame_data(self, frame_no: int) -> np.ndarray:
+        """The packed I420 planes of frame 'frame_no', as a view of the mapping."""
+        offset = self._offsets[frame_no]
+        return self._data[offset:offset + self.frame_size()]
+
+
     def read_frame(self, raw_img: RawImage) -> bool:
         if raw_img.display_width() != self.display_width() or raw_img.display_height() != self.display_height():
             raise RuntimeError("YUV4MPEG: image dimensions don't match")
 
-        frame_header = self._fd.getline()
+        frame_no = self.next_frame_no()
+        if frame_no is None:
+            return False
 
-        if self._fd.eof() and not frame_header:
-            if self._loop:
-                self._fd.reset_offset()
-                self._fd.getline()
-                frame_header = self._fd.getline()
-            else:
-                return False
-
-        if frame_header[:5] != "FRAME":
-            raise RuntimeError("invalid YUV4MPEG2 input format")
+        y_offset = self._offsets[frame_no]
+        u_offset = y_offset + self.y_size()
+        v_offset = u_offset + self.uv_size()
 
-        raw_img.copy_y_from(self._fd.readn(self.y_size()))
-        raw_img.copy_u_from(self._fd.readn(self.uv_size()))
-        raw_img.copy_v_from(self._fd.readn(self.uv_size()))
+        # copy the planes out of the mapping, honoring the image strides
+        raw_img.y_array()[:] = self._data[y_offset:u_offset].reshape(
+            self._display_height, self._display_width)
+        raw_img.u_array()[:] = self._data[u_offset:v_offset].reshape(
+            self._display_height // 2, self._display_width // 2)
+        raw_img.v_array()[:] = self._data[v_offset:v_offset + self.uv_size()].reshape(
+            self._display_height // 2, self._display_width // 2)
 
         return True
 
 
+    def wrap_frame(self) -> Optional[RawImage]:
+        """Return the next frame as an image that points into the mapping.
+
+        No pixels are copied. The image is only valid until the next call
+        and must not be written to.
+        """
+        frame_no = self.next_frame_no()
+        if frame_no is None:
+            return None
+
+        vpx_img = libvpx.vpx_img_wrap(byref(self._wrapped_img), VPX_IMG_FMT_I420,
+                                      self._display_width, self._display_height, 1,
+                                      self._address + self._offsets[frame_no])
+        if not vpx_img:
+            raise RuntimeError("YUV4MPEG: failed to wrap a frame")
+
+        return RawImage(self._display_width, self._display_height, vpx_img)
+
+
     def fd(self) -> FileDescriptor:
         return self._fd
 
@@ -84,4 +202,4 @@ class YUV4MPEG(VideoInput):
 
 
     def display_height(self) -> int:
-        return self._display_height
\ No newline at end of file
+        return self._display_height